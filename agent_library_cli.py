@@ -1,6 +1,7 @@
 import cmd2
 from utilities import toilet_banner_metal
-from agents import ModelInstructions, SystemAdmin, ToolManager
+from agents import ModelInstructions, SystemAdmin
+from runtime import agent_runtime
 
 
 def print_agentslib_menu():
@@ -63,7 +64,7 @@ class AgentsLibCli(cmd2.Cmd):
     def do_4(self, line):
         try:
             print("Getting the toolbox now...")
-            tool_manager = ToolManager()
+            tool_manager = agent_runtime.tool_manager
             tools = tool_manager.tools
             for tool in tools:
                 print(f"Tool: {tool}")
@@ -1,20 +1,25 @@
+import asyncio
 from dataclasses import asdict, dataclass, field
 import importlib
 import inspect
 import json
 import os
+from itertools import chain
 from pathlib import Path
 from string import Template
 import re
-import subprocess
-from typing import Any, Dict
-import requests
+import time
+from typing import Any, AsyncIterator, Dict, Iterator
 import yaml
 from config import ModelInstructions, ParamsConfig
-from messages import MessageCache
-from chroma import ChromaHandler
-from ollama import OllamaServer
-from utilities import stream_agent_response, message_cache_format_to_prompt
+from messages import MessageCache, SessionContext
+from chroma import ChromaHandler, memory_where
+from packing import PackReport, align_history_start, pack_prompt_sections, token_estimator
+from rerank import RerankReport
+from response_cache import ResponseCache, get_response_cache
+from runtime import agent_runtime
+from ollama import OllamaServer, OllamaTransport, get_transport
+from utilities import stream_agent_response, shared_prefix_length, toilet_banner_border_metal
 
 
 def parse_docstring(docstring: str) -> dict:
@@ -84,6 +89,59 @@ class ToolManager:
         return tool(*args)
 
 
+@dataclass
+class GenerationStats:
+    """
+    Timing and token counts for a single generation. Latencies are in seconds and measured from the moment the request is sent, token counts come straight from Ollama's final chunk when it reports them.
+    """
+    time_to_first_token: float = None
+    total_latency: float = None
+    prompt_eval_count: int = None
+    eval_count: int = None
+    streamed: bool = False
+    cached: bool = False
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+@dataclass(frozen=True)
+class CompiledTemplate:
+    """
+    A prompt template rendered from a set of instructions and parsed once: the string.Template plus the placeholders it contains.
+    """
+    fingerprint: str
+    template: Template
+    placeholders: frozenset
+
+
+# Shared across agents, keyed by ModelInstructions.fingerprint(). Small, since there are only ever a handful of instruction sets live.
+_compiled_templates: Dict[str, CompiledTemplate] = {}
+_compiled_templates_max = 64
+
+
+def compile_prompt_template(instructions: ModelInstructions) -> CompiledTemplate:
+    """
+    Return the compiled prompt template for these instructions, rendering and parsing to_prompt_script() only the first time a given fingerprint is seen. Editing the instructions changes the fingerprint, so stale templates are never served.
+
+    :param instructions: The agent's ModelInstructions.
+    :returns: CompiledTemplate
+    """
+    fingerprint = instructions.fingerprint()
+    compiled = _compiled_templates.get(fingerprint)
+    if compiled is None:
+        prompt_template = instructions.to_prompt_script()
+        compiled = CompiledTemplate(
+            fingerprint=fingerprint,
+            template=Template(prompt_template),
+            placeholders=frozenset(re.findall(r'\$(\w+)', prompt_template)),
+        )
+        if len(_compiled_templates) >= _compiled_templates_max:
+            _compiled_templates.pop(next(iter(_compiled_templates)))
+        _compiled_templates[fingerprint] = compiled
+    return compiled
+
+
 class Agent:
     name: str
     params_config: ParamsConfig
@@ -91,22 +149,52 @@ class Agent:
     message_cache: MessageCache
     tool_manager: ToolManager
     chroma_handler: ChromaHandler
+    transport: OllamaTransport
     last_response: str
+    last_stats: GenerationStats
+    incremental: bool
+    sessions: Dict[str, SessionContext]
+    verbose: bool
 
-    def __init__(self, params_config: ParamsConfig, instructions: ModelInstructions) -> None:
+    def __init__(self, params_config: ParamsConfig, instructions: ModelInstructions, chroma_handler: ChromaHandler = None, tool_manager: ToolManager = None, verbose: bool = None) -> None:
         """
         Agent init takes a params_config and instructions object to create the agent.
 
         :param params_config: The parameters configuration for the agent.
         :param instructions: The instructions for the agent.
+        :param chroma_handler: Memory handler. Defaults to the process-wide one from the runtime.
+        :param tool_manager: Loaded toolbox. Defaults to the process-wide one from the runtime.
+        :param verbose: Print debug output such as the rendered history. Defaults to $CHAT3J_VERBOSE being set (and not 0).
         """
+        self.verbose = verbose if verbose is not None else os.environ.get('CHAT3J_VERBOSE', '') not in ('', '0')
         self.params_config = params_config
         self.instructions = instructions
         self.name = self.instructions.name
-        self.message_cache = MessageCache(20)
+        self.chroma_handler = chroma_handler or agent_runtime.share_chroma_handler()
+        self.tool_manager = tool_manager or agent_runtime.share_tool_manager()
+        self.transport = get_transport(self.instructions.completions_url)
+        # Opt-in exact-match cache, only consulted for deterministic sampling
+        self.response_cache: ResponseCache = get_response_cache() if self.params_config.cache_responses else None
+        self.start_session()
+
+    def start_session(self) -> None:
+        """
+        Reset the per-chat state. Called on init and again when the runtime hands a cached agent to a new session. Saved session contexts on disk are left alone, session_for picks them up again.
+        """
+        self.message_cache = MessageCache(self.params_config.history_turns or 20, self.instructions.start_token, self.instructions.end_token)
         self.last_response = None
-        self.chroma_handler = ChromaHandler()
-        self.tool_manager = ToolManager()
+        self.last_stats = None
+        # Incremental mode: reuse Ollama's returned context instead of re-sending the history each turn
+        self.incremental = bool(self.params_config.incremental)
+        self.sessions = {}
+        self.active_session = None
+        self.prompt_context = None
+        # Shared prefix (chars) between consecutive full prompts, see prefix_cache_report
+        self.last_prompt = None
+        self.prefix_history = []
+        self.last_pack_report: PackReport = None
+        self.last_rerank_report: RerankReport = None
+        self.memory_tokens_saved = 0
     
     def look_in_toolbox(self) -> dict:
         """ 
@@ -143,19 +231,237 @@ class Agent:
         :param user_input: (str) The user's input text to be included in the prompt.
         :returns: (str) A formatted prompt string with the necessary substitutions made.
         """
-        # Pull the prompt template
-        prompt_template = self.instructions.to_prompt_script()
-        collection = self.chroma_handler.chroma_get_or_create_collection(f"{self.name}-{username}")
+        collection = self.memory_collection(username)
 
         if agent_agent == True:
-            formatted_chroma_results = None
+            chroma_results = None
         else:
-            chroma_results = self.chroma_handler.chroma_query_collection(collection, user_input, 5)
-            formatted_chroma_results = self.chroma_handler.chroma_results_format_to_prompt(chroma_results)
+            n_results, candidates = self.memory_counts()
+            if self.params_config.memory_search == 'hybrid':
+                chroma_results = self.chroma_handler.chroma_hybrid_query_collection(collection, user_input, candidates, where=self.memory_filter())
+            else:
+                chroma_results = self.chroma_handler.chroma_query_collection(collection, user_input, candidates, where=self.memory_filter(), include=self.memory_include())
+            if self.params_config.memory_rerank:
+                reranked, report = self.chroma_handler.chroma_rerank_results(chroma_results, user_input, n_results, **self.rerank_options())
+                chroma_results = self.note_rerank(chroma_results, reranked, report, n_results)
+
+        return self.compose_prompt(user_input, username, chroma_results)
+
+    async def abuild_prompt(self, user_input: str, username: str, agent_agent: bool) -> str:
+        """
+        Async counterpart of build_prompt. The Chroma round trips run on the handler's bounded executor so other sessions on the same event loop keep going while this one waits on memory.
+
+        :param user_input: (str) The user's input text to be included in the prompt.
+        :returns: (str) A formatted prompt string with the necessary substitutions made.
+        """
+        collection = await self.amemory_collection(username)
 
-        message_history = self.message_cache.get_message_cache()
-        message_cache_formatted = message_cache_format_to_prompt(self, message_history)
-        print(f"Message Cache Formatted: {message_cache_formatted}")
+        if agent_agent == True:
+            chroma_results = None
+        else:
+            n_results, candidates = self.memory_counts()
+            if self.params_config.memory_search == 'hybrid':
+                chroma_results = await self.chroma_handler.achroma_hybrid_query_collection(collection, user_input, candidates, where=self.memory_filter())
+            else:
+                chroma_results = await self.chroma_handler.achroma_query_collection(collection, user_input, candidates, where=self.memory_filter(), include=self.memory_include())
+            if self.params_config.memory_rerank:
+                reranked, report = await self.chroma_handler.achroma_rerank_results(chroma_results, user_input, n_results, **self.rerank_options())
+                chroma_results = self.note_rerank(chroma_results, reranked, report, n_results)
+
+        return self.compose_prompt(user_input, username, chroma_results)
+
+    def memory_collection(self, username: str):
+        """
+        The agent's memory collection for someone it talks to, opened with the agent's NumPy tier limit.
+
+        :param username: Who the agent is talking to, a person or another agent.
+        """
+        return self.chroma_handler.chroma_get_or_create_collection(f"{self.name}-{username}", self.params_config.max_numpy_documents)
+
+    async def amemory_collection(self, username: str):
+        return await self.chroma_handler.achroma_get_or_create_collection(f"{self.name}-{username}", self.params_config.max_numpy_documents)
+
+    def memory_counts(self) -> tuple:
+        """
+        (memories wanted, candidates to fetch). With re-ranking on, a wider pool is fetched so the cutoff and diversity selection have something to choose from.
+        """
+        n_results = self.params_config.memory_results or 5
+        return n_results, max(n_results * 3, 10) if self.params_config.memory_rerank else n_results
+
+    def memory_include(self) -> list:
+        return ['documents', 'metadatas', 'distances', 'embeddings'] if self.params_config.memory_rerank else None
+
+    def rerank_options(self) -> dict:
+        options = {'max_distance': self.params_config.memory_max_distance}
+        if self.params_config.memory_mmr_lambda is not None:
+            options['mmr_lambda'] = self.params_config.memory_mmr_lambda
+        return options
+
+    def note_rerank(self, candidates: dict, reranked: dict, report: RerankReport, n_results: int) -> dict:
+        """
+        Work out what re-ranking saved against injecting the plain top n_results, log it and keep a running total.
+
+        :param candidates: The results before re-ranking.
+        :param reranked: The results after.
+        :param report: The RerankReport from chroma_rerank_results, token counts are filled in here.
+        :param n_results: How many memories would have been injected without re-ranking.
+        :returns: The re-ranked results.
+        """
+        model = self.instructions.llm_model
+        top = {key: [value[0][:n_results]] for key, value in (candidates or {}).items() if isinstance(value, list) and value and isinstance(value[0], list)}
+        report.tokens_before = sum(token_estimator.estimate(entry, model) for entry in self.chroma_handler.chroma_results_to_entries(top))
+        report.tokens_after = sum(token_estimator.estimate(entry, model) for entry in self.chroma_handler.chroma_results_to_entries(reranked))
+        self.last_rerank_report = report
+        self.memory_tokens_saved += report.tokens_saved
+        if report.tokens_saved or report.kept < min(n_results, report.candidates):
+            print(report.to_string())
+        return reranked
+
+    def memory_filter(self) -> dict:
+        """
+        The where filter for memory queries from the agent's params, or None to search everything.
+        """
+        return memory_where(since_days=self.params_config.memory_max_age_days)
+
+    def compose_prompt(self, user_input: str, username: str, chroma_results: dict) -> str:
+        """
+        Picks between the incremental prompt (when incremental mode is on and the session context is still usable) and a full render of the template.
+
+        :param user_input: (str) The user's input text to be included in the prompt.
+        :param username: (str) The name of whoever is talking to the agent.
+        :param chroma_results: (dict) Raw Chroma query results, or None when memory is skipped.
+        :returns: (str) The prompt to send.
+        """
+        self.prompt_context = None
+        if self.incremental:
+            self.active_session = self.session_for(username)
+            prompt = self.build_incremental_prompt(user_input, username, chroma_results)
+            if prompt is not None:
+                return prompt
+
+        memories = self.chroma_handler.chroma_results_to_entries(chroma_results) if chroma_results else None
+        prompt = self.render_prompt(user_input, username, memories)
+
+        if self.incremental:
+            # Full rebuild, the memories that made it into the prompt are now part of the session
+            kept = self.last_pack_report.memories_kept
+            self.active_session.memory_ids = list(chroma_results["ids"][0][:kept]) if chroma_results and chroma_results.get("ids") else []
+        return prompt
+
+    def session_for(self, username: str) -> SessionContext:
+        """
+        The persisted Ollama session context for this agent and user, loaded on first use.
+
+        :param username: (str) The name of whoever is talking to the agent.
+        :returns: SessionContext
+        """
+        if username not in self.sessions:
+            self.sessions[username] = SessionContext.load(self.name, username)
+        return self.sessions[username]
+
+    def build_incremental_prompt(self, user_input: str, username: str, chroma_results: dict) -> str:
+        """
+        Builds only the new part of the conversation: memories not already injected into this session followed by the user's turn. The model already has everything before it through the session's context. Returns None when a full rebuild is needed: no context yet, the model or instructions changed, or the context window would overflow.
+
+        :param user_input: (str) The user's input text to be included in the prompt.
+        :param username: (str) The name of whoever is talking to the agent.
+        :param chroma_results: (dict) Raw Chroma query results, or None.
+        :returns: (str) The incremental prompt, or None.
+        """
+        session = self.active_session
+        if not session.is_valid_for(self.instructions.llm_model, self.instructions.fingerprint()):
+            session.reset()
+            return None
+
+        new_memories = None
+        new_ids = []
+        if chroma_results and chroma_results.get("ids") and chroma_results["ids"][0]:
+            keep = [i for i, memory_id in enumerate(chroma_results["ids"][0]) if memory_id not in session.memory_ids]
+            if keep:
+                new_ids = [chroma_results["ids"][0][i] for i in keep]
+                new_memories = {key: [[value[0][i] for i in keep]] for key, value in chroma_results.items() if isinstance(value, list) and value and isinstance(value[0], list)}
+
+        prompt = ""
+        if new_memories:
+            prompt += f"{self.instructions.mem_start_token}Context from memory: {self.chroma_handler.chroma_results_format_to_prompt(new_memories)}{self.instructions.mem_end_token}\n"
+        prompt += (
+            f"{self.instructions.start_token}{username}: \n"
+            f"{user_input}{self.instructions.end_token}\n"
+            f"{self.instructions.start_token}{self.name}: \n"
+        )
+
+        # Leave room for the reply
+        num_ctx = self.params_config.num_ctx or 2048
+        needed = len(session.context) + token_estimator.estimate(prompt, self.instructions.llm_model) + (self.params_config.num_predict or 0)
+        if needed > num_ctx:
+            print(f"Context window for {self.name} is full ({len(session.context)} tokens), rebuilding the prompt.")
+            session.reset()
+            return None
+
+        session.memory_ids.extend(new_ids)
+        self.prompt_context = session.context
+        return prompt
+
+    def calibrate_estimator(self, payload: dict, stats: GenerationStats) -> None:
+        """
+        Feed the server's prompt token count back into the shared token estimator. Incremental prompts are skipped since most of what was evaluated came from the context, not the prompt text.
+
+        :param payload: The request body that was sent.
+        :param stats: The stats recorded for the generation.
+        """
+        if "context" in payload:
+            return
+        token_estimator.calibrate(self.instructions.llm_model, len(payload["prompt"]), stats.prompt_eval_count)
+
+    def remember_context(self, context: list) -> None:
+        """
+        Store the context Ollama returned for the last generation on the active session and persist it.
+
+        :param context: (list) The token ids from the final /api/generate response.
+        """
+        self.prompt_context = None
+        if not self.incremental or self.active_session is None or not context:
+            return
+        session = self.active_session
+        session.context = context
+        session.llm_model = self.instructions.llm_model
+        session.instructions_fingerprint = self.instructions.fingerprint()
+        try:
+            session.save()
+        except OSError as e:
+            print(f"Error saving session context: {e}")
+
+    def render_prompt(self, user_input: str, username: str, memories: list = None) -> str:
+        """
+        Substitutes history, memories and the user's input into the prompt template. Shared by build_prompt and abuild_prompt once the memories have been fetched. History and memories are packed into context_share of num_ctx first, dropping the oldest turns and lowest-ranked memories when they don't fit. With the prefix_stable layout the history is then trimmed to start on a history_block boundary.
+
+        :param user_input: (str) The user's input text to be included in the prompt.
+        :param username: (str) The name of whoever is talking to the agent.
+        :param memories: (list) Formatted memories, best match first, or None when memory is skipped.
+        :returns: (str) A formatted prompt string with the necessary substitutions made.
+        """
+        # Pull the compiled prompt template, only re-rendered when the instructions change
+        compiled = compile_prompt_template(self.instructions)
+
+        self.message_cache.set_tokens(self.instructions.start_token, self.instructions.end_token)
+        model = self.instructions.llm_model
+        budget = int((self.params_config.num_ctx or 2048) * (self.params_config.context_share or 0.75))
+        fixed_tokens = token_estimator.estimate_chars(len(compiled.template.template) + len(user_input or '') + len(username or ''), model)
+        kept_history, kept_memories, self.last_pack_report = pack_prompt_sections(fixed_tokens, self.message_cache.get_rendered_turns(), memories or [], budget, model)
+        if self.last_pack_report.dropped_anything():
+            print(self.last_pack_report.to_string())
+        if self.instructions.prompt_layout == 'prefix_stable':
+            # Old turns go a block at a time so the history, and the prompt prefix, keep the same start for several turns
+            block = min(self.params_config.history_block or 4, max(1, self.message_cache.capacity // 2))
+            kept_history = align_history_start(kept_history, self.message_cache.turns_added, block)
+
+        message_cache_formatted = ''.join(chain.from_iterable(kept_history))
+        if self.verbose:
+            print(f"Message Cache Formatted: {message_cache_formatted}")
+        if memories is None:
+            formatted_chroma_results = None
+        else:
+            formatted_chroma_results = ''.join(kept_memories) if kept_memories else "No results found."
 
         # all possible substitutions
         substitutions = {
@@ -164,27 +470,46 @@ class Agent:
             "username": username,
             "context": formatted_chroma_results,
         }
-        # Identify the parameters in the template
-        params_in_template = set(re.findall(r'\$(\w+)', prompt_template))
-
         # Create a dictionary with only the necessary substitutions
-        required_substitutions = {key: substitutions[key] for key in params_in_template if key in substitutions}
+        required_substitutions = {key: substitutions[key] for key in compiled.placeholders if key in substitutions}
 
         # Substitute the values into the template
-        template = Template(prompt_template)
+        prompt = compiled.template.safe_substitute(required_substitutions)
+
+        if self.last_prompt is not None:
+            self.prefix_history.append((shared_prefix_length(self.last_prompt, prompt), len(prompt)))
+        self.last_prompt = prompt
 
-        return template.safe_substitute(required_substitutions)
+        return prompt
+
+    def prefix_cache_report(self) -> dict:
+        """
+        Summarise how much of each full prompt was shared with the one before it. With the prefix_stable layout this should stay close to everything but the tail; with classic it drops to the length of the system and intro blocks.
+
+        :returns: (dict) turns measured, shared and total chars for the last turn and the mean shared ratio.
+        """
+        if not self.prefix_history:
+            return {'turns': 0, 'last_shared_chars': 0, 'last_prompt_chars': 0, 'mean_shared_ratio': 0.0}
+        shared, total = self.prefix_history[-1]
+        ratios = [s / t for s, t in self.prefix_history if t]
+        return {
+            'turns': len(self.prefix_history),
+            'last_shared_chars': shared,
+            'last_prompt_chars': total,
+            'mean_shared_ratio': sum(ratios) / len(ratios) if ratios else 0.0,
+        }
     
-    def generate_response(self, prompt: str) -> str:
+    def completion_payload(self, prompt: str, stream: bool = False) -> dict:
         """
-        Generates an http request to the ollama server and returns the response.
+        Builds the /api/generate request body for this agent's model and params. When the last build_prompt produced an incremental prompt, the session's context is sent along with it.
 
         :param prompt: The prompt to send to the model.
-        :return: The response from the model.
+        :param stream: Ask Ollama for NDJSON chunks instead of a single response.
+        :returns: (dict) The request body.
         """
-        data = {
+        payload = {
             "model": self.instructions.llm_model,
-            "stream": False,
+            "stream": stream,
             "prompt": prompt,
             "options": {
                 "temperature": self.params_config.temperature,
@@ -195,37 +520,183 @@ class Agent:
                 "top_p": self.params_config.top_p,
             }
         }
+        # Only pinned when asked for, otherwise every reply would be sampled the same way
+        if self.params_config.seed is not None:
+            payload["options"]["seed"] = self.params_config.seed
+        if self.params_config.keep_alive is not None:
+            payload["keep_alive"] = self.params_config.keep_alive
+        if self.prompt_context:
+            payload["context"] = self.prompt_context
+        return payload
+
+    def lookup_cached_response(self, payload: dict) -> tuple:
+        """
+        Check the response cache for a request. Non-deterministic requests bypass it.
 
-        completion_headers = {
-            'Content-Type': 'application/json',
-        }
+        :param payload: The request body about to be sent.
+        :returns: (key, entry): key is None when the cache doesn't apply, entry is None on a miss.
+        """
+        if self.response_cache is None:
+            return None, None
+        if not ResponseCache.is_deterministic(payload):
+            self.response_cache.note_bypass()
+            return None, None
+        key = ResponseCache.key_for(payload)
+        return key, self.response_cache.get(key)
+
+    def replay_cached_response(self, entry: dict, stats: GenerationStats, started: float) -> str:
+        """
+        Finish a generation from a cache entry as if the server had answered.
+        """
+        stats.cached = True
+        stats.total_latency = time.perf_counter() - started
+        stats.time_to_first_token = stats.total_latency
+        stats.prompt_eval_count = entry.get("prompt_eval_count")
+        stats.eval_count = entry.get("eval_count")
+        self.last_stats = stats
+        self.remember_context(entry.get("context"))
+        return entry["response"]
+
+    def store_cached_response(self, key: str, response: str, stats: GenerationStats, context: list) -> None:
+        if key is None:
+            return
+        self.response_cache.put(key, {
+            "response": response,
+            "context": context,
+            "prompt_eval_count": stats.prompt_eval_count,
+            "eval_count": stats.eval_count,
+        })
+
+    def generate_response(self, prompt: str) -> str:
+        """
+        Generates an http request to the ollama server and returns the response.
+
+        :param prompt: The prompt to send to the model.
+        :return: The response from the model.
+        """
+        data = payload = self.completion_payload(prompt, stream=False)
 
-        url = f"http://localhost:11434/api/generate"
+        stats = GenerationStats()
+        started = time.perf_counter()
+        cache_key, cached = self.lookup_cached_response(payload)
+        if cached is not None:
+            return self.replay_cached_response(cached, stats, started)
         try:
-            response = requests.post(url, headers=completion_headers, data=json.dumps(data))
+            response = self.transport.post('/api/generate', data)
             # print(f"Response: {response}")
             if response.status_code == 200:
-                response_text = response.text
-                data = json.loads(response_text)
+                data = response.json()
                 response_content = data["response"]
+                # Without streaming the first token only shows up with the last one
+                stats.total_latency = time.perf_counter() - started
+                stats.time_to_first_token = stats.total_latency
+                stats.prompt_eval_count = data.get("prompt_eval_count")
+                stats.eval_count = data.get("eval_count")
+                self.last_stats = stats
+                self.calibrate_estimator(payload, stats)
+                self.remember_context(data.get("context"))
+                self.store_cached_response(cache_key, response_content, stats, data.get("context"))
                 return response_content
         except Exception as e:
             print(f"Error generating response: {e}")        
 
+    async def agenerate_response(self, prompt: str) -> str:
+        """
+        Async counterpart of generate_response. The blocking request runs on the transport's executor, which is sized to its connection pool, so many sessions can wait on the same Ollama server without holding up the event loop.
+
+        :param prompt: The prompt to send to the model.
+        :return: The response from the model.
+        """
+        return await self.transport.run_async(self.generate_response, prompt)
+
+    async def agenerate_response_stream(self, prompt: str) -> AsyncIterator[str]:
+        """
+        Async counterpart of generate_response_stream. The NDJSON stream is read on the transport's executor and tokens are handed back to the event loop through a queue as they arrive.
+
+        :param prompt: The prompt to send to the model.
+        :yields: (str) Response tokens in the order they were generated.
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        done = object()
+
+        def pump() -> None:
+            try:
+                for token in self.generate_response_stream(prompt):
+                    loop.call_soon_threadsafe(queue.put_nowait, token)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+
+        pumping = asyncio.ensure_future(self.transport.run_async(pump))
+        while True:
+            token = await queue.get()
+            if token is done:
+                break
+            yield token
+        await pumping
+
+    def generate_response_stream(self, prompt: str) -> Iterator[str]:
+        """
+        Streaming counterpart of generate_response. Posts with stream enabled and yields tokens as Ollama's NDJSON chunks arrive so the caller can render them right away. The full text is kept in last_response and the timings in last_stats once the generator is exhausted.
+
+        :param prompt: The prompt to send to the model.
+        :yields: (str) Response tokens in the order they were generated.
+        """
+        data = self.completion_payload(prompt, stream=True)
+
+        stats = GenerationStats(streamed=True)
+        tokens = []
+        started = time.perf_counter()
+        cache_key, cached = self.lookup_cached_response(data)
+        if cached is not None:
+            self.last_response = self.replay_cached_response(cached, stats, started)
+            yield self.last_response
+            return
+        try:
+            with self.transport.post('/api/generate', data, stream=True) as response:
+                if response.status_code != 200:
+                    print(f"Error generating response: HTTP {response.status_code}")
+                    return
+                for line in self.transport.iter_lines(response):
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    token = chunk.get("response", "")
+                    if token:
+                        if stats.time_to_first_token is None:
+                            stats.time_to_first_token = time.perf_counter() - started
+                        tokens.append(token)
+                        yield token
+                    if chunk.get("done"):
+                        stats.prompt_eval_count = chunk.get("prompt_eval_count")
+                        stats.eval_count = chunk.get("eval_count")
+                        self.calibrate_estimator(data, stats)
+                        self.remember_context(chunk.get("context"))
+                        self.store_cached_response(cache_key, "".join(tokens), stats, chunk.get("context"))
+                        break
+        except Exception as e:
+            print(f"Error generating response: {e}")
+        finally:
+            stats.total_latency = time.perf_counter() - started
+            self.last_stats = stats
+            self.last_response = "".join(tokens)
+
 
 class SystemAdmin:
     """
     The AgentAdmin is intended to handled assets, such as agents and kb data and directories.
     """
-    chroma_handler: ChromaHandler = ChromaHandler()
+    chroma_handler: ChromaHandler
     ollama_server: OllamaServer = OllamaServer()
 
+    def __init__(self) -> None:
+        self.chroma_handler = agent_runtime.share_chroma_handler()
+
     def create_new_agent(self):
         """
         Agent creation tool creates a new agent directory and populates it with the default files with the ability to customize the instructions.yaml file.
         """
-        agent_creator_banner = subprocess.run(['toilet', '--filter', 'border:metal', 'Agent Creator'], stdout=subprocess.PIPE)
-        print(agent_creator_banner.stdout.decode('utf-8'))
+        toilet_banner_border_metal('Agent Creator')
         
         # Instantiate instructions class
         new_instructions = ModelInstructions(method='create')
@@ -241,6 +712,7 @@ class SystemAdmin:
     
         # Instantiate agent class
         new_agent = Agent(params_config=new_params_config, instructions=new_instructions)
+        agent_runtime.register_agent(new_agent)
         print(f'--------------------\n New Agent {new_agent.name} Successfully Created\n--------------------\n')
         
         # Create a new agent record in the agents list
@@ -248,7 +720,7 @@ class SystemAdmin:
         print(f'--------------------\n {new_agent.name} Successfully Added to Agents List\n--------------------\n')
         
         # Create Chroma DB collection
-        self.chroma_handler.chroma_get_or_create_collection(f"{new_agent.name}-{username}")
+        new_agent.memory_collection(username)
         print(f'--------------------\n {new_agent.name} Chroma DB Collection Created\n--------------------\n')
         print(f'--------------------\n {new_agent.name} is now online.\n--------------------\n')
 
@@ -323,6 +795,7 @@ class SystemAdmin:
         agents_list = data.get('agents', [])
         agents_list = [agent for agent in agents_list if agent['agent_name'] != agent_name]
         data['agents'] = agents_list
+        agent_runtime.forget_agent(agent_name)
 
         # Save the updated data
         with open(file_path, 'w') as file:
@@ -0,0 +1,232 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from copy import copy
+from dataclasses import asdict, dataclass, fields
+import json
+import os
+from pathlib import Path
+import threading
+import time
+from typing import Iterator
+from agents import Agent
+from config import ParamsConfig
+from response_cache import response_cache_report
+from runtime import agent_runtime
+
+
+@dataclass
+class BatchSummary:
+    """
+    Aggregate results of a batch run. Throughput only counts records processed in this run, not ones skipped from a previous one. cached counts the successes served from the response cache, their tokens are left out of generated_tokens since nothing was generated.
+    """
+    processed: int = 0
+    succeeded: int = 0
+    cached: int = 0
+    failed: int = 0
+    skipped: int = 0
+    elapsed: float = 0.0
+    generated_tokens: int = 0
+
+    @property
+    def requests_per_second(self) -> float:
+        return self.processed / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def tokens_per_second(self) -> float:
+        return self.generated_tokens / self.elapsed if self.elapsed else 0.0
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        data['requests_per_second'] = self.requests_per_second
+        data['tokens_per_second'] = self.tokens_per_second
+        return data
+
+    def to_string(self) -> str:
+        return (f"Batch finished: {self.succeeded} ok ({self.cached} from the response cache), {self.failed} failed, {self.skipped} already done. "
+                f"{self.processed} requests in {self.elapsed:.1f}s ({self.requests_per_second:.2f} req/s, {self.tokens_per_second:.1f} tokens/s)")
+
+
+class BatchRunner:
+    """
+    Headless batch inference over a JSONL file of prompts. Each line is a record like {"id": "q1", "agent": "sherlock", "user": "bob", "prompt": "...", "params": {"temperature": 0}}; only agent and prompt are required. Records are read as a stream and run through Agent.build_prompt / generate_response on a pool of workers, and each result is appended to the output JSONL with its latency as soon as it completes. Re-running with the same output file skips ids that already succeeded, so a crashed run picks up where it stopped.
+
+    :param input_path: JSONL file of prompt records.
+    :param output_path: JSONL file results are appended to.
+    :param workers: Number of concurrent generations.
+    :param default_user: Username used for records without one (it picks the agent's memory collection).
+    """
+    def __init__(self, input_path: str, output_path: str, workers: int = 4, default_user: str = None) -> None:
+        self.input_path = Path(input_path)
+        self.output_path = Path(output_path)
+        self.workers = workers
+        self.default_user = default_user or os.environ.get('USER') or os.environ.get('USERNAME')
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        # Bounds how far reading runs ahead of the workers, so huge inputs are never held in memory
+        self._in_flight = threading.BoundedSemaphore(workers * 2)
+
+    def completed_ids(self) -> set:
+        """
+        Ids that already have a successful result in the output file.
+        """
+        done = set()
+        if not self.output_path.exists():
+            return done
+        with open(self.output_path, 'r') as file:
+            for line in file:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    # A torn last line from a crash, the record will simply be run again
+                    continue
+                if result.get('status') == 'ok':
+                    done.add(result.get('id'))
+        return done
+
+    def read_records(self) -> Iterator[dict]:
+        """
+        Stream records from the input file. Records without an id get one from their line number so resuming still works.
+        """
+        with open(self.input_path, 'r') as file:
+            for line_number, line in enumerate(file, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError as e:
+                    print(f"Skipping line {line_number}: {e}")
+                    continue
+                record.setdefault('id', f"line-{line_number}")
+                yield record
+
+    def agent_for(self, agent_name: str) -> Agent:
+        """
+        Agents hold per-call state (last prompt, stats), so each worker thread keeps its own copy per agent name. They all share the runtime's chroma handler and toolbox.
+        """
+        agents = getattr(self._local, 'agents', None)
+        if agents is None:
+            agents = self._local.agents = {}
+        if agent_name not in agents:
+            agent = agents[agent_name] = agent_runtime.new_agent(agent_name)
+            # Records are independent, carrying one's context into the next would make results depend on the order they ran in
+            agent.incremental = False
+        return agents[agent_name]
+
+    @staticmethod
+    def override_params(params: ParamsConfig, overrides: dict) -> ParamsConfig:
+        """
+        A copy of an agent's params with a record's overrides applied. ParamsConfig's own __init__ loads from yaml, so dataclasses.replace can't build one and this copies the instance instead.
+
+        :param params: The agent's params, left untouched.
+        :param overrides: The record's "params".
+        :returns: The new ParamsConfig.
+        """
+        names = {field.name for field in fields(ParamsConfig)}
+        unknown = sorted(set(overrides) - names)
+        if unknown:
+            raise ValueError(f"Unknown params: {', '.join(unknown)}")
+        for key in ('cache_responses', 'incremental'):
+            if key in overrides:
+                # Read when the agent is built, a per-record switch would be silently ignored
+                raise ValueError(f"{key} can't be overridden per record, set it in the agent's params_config.yaml")
+        params = copy(params)
+        for key, value in overrides.items():
+            setattr(params, key, value)
+        return params
+
+    def run_record(self, record: dict) -> dict:
+        """
+        Build the prompt and generate a response for one record.
+
+        :param record: A parsed input record.
+        :returns: The result record written to the output file.
+        """
+        agent_name = record.get('agent', '').lower()
+        username = record.get('user') or self.default_user
+        result = {'id': record['id'], 'agent': agent_name, 'user': username, 'prompt': record.get('prompt')}
+        started = time.perf_counter()
+        try:
+            agent = self.agent_for(agent_name)
+            base_params = agent.params_config
+            overrides = record.get('params') or {}
+            if overrides:
+                agent.params_config = self.override_params(base_params, overrides)
+            try:
+                prompt = agent.build_prompt(record['prompt'], username=username, agent_agent=False)
+                response = agent.generate_response(prompt)
+            finally:
+                agent.params_config = base_params
+            stats = agent.last_stats
+            result.update({
+                'status': 'ok' if response is not None else 'error',
+                'response': response,
+                'latency': time.perf_counter() - started,
+                'time_to_first_token': stats.time_to_first_token if stats else None,
+                'prompt_eval_count': stats.prompt_eval_count if stats else None,
+                'eval_count': stats.eval_count if stats else None,
+                'cached': stats.cached if stats else False,
+            })
+        except Exception as e:
+            result.update({'status': 'error', 'error': str(e), 'latency': time.perf_counter() - started})
+        return result
+
+    def write_result(self, output_file, result: dict) -> None:
+        with self._write_lock:
+            output_file.write(json.dumps(result) + "\n")
+            output_file.flush()
+
+    def run(self) -> BatchSummary:
+        """
+        Run every record not already completed and return the aggregate throughput.
+        """
+        summary = BatchSummary()
+        summary_lock = threading.Lock()
+        done = self.completed_ids()
+        self.output_path.parent.mkdir(parents=True, exist_ok=True)
+
+        def work(record: dict, output_file) -> None:
+            try:
+                result = self.run_record(record)
+                self.write_result(output_file, result)
+                with summary_lock:
+                    summary.processed += 1
+                    if result['status'] == 'ok':
+                        summary.succeeded += 1
+                        if result.get('cached'):
+                            summary.cached += 1
+                        else:
+                            summary.generated_tokens += result.get('eval_count') or 0
+                    else:
+                        summary.failed += 1
+            finally:
+                self._in_flight.release()
+
+        started = time.perf_counter()
+        with open(self.output_path, 'a') as output_file, ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='batch') as executor:
+            for record in self.read_records():
+                if record['id'] in done:
+                    summary.skipped += 1
+                    continue
+                self._in_flight.acquire()
+                executor.submit(work, record, output_file)
+        summary.elapsed = time.perf_counter() - started
+        return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a JSONL file of prompts through agents without the chat loop.")
+    parser.add_argument('input', help="JSONL file of records: {id, agent, user, prompt, params}")
+    parser.add_argument('output', help="JSONL file results are appended to (and resumed from)")
+    parser.add_argument('--workers', type=int, default=4, help="Concurrent generations")
+    parser.add_argument('--user', default=None, help="Username for records that don't set one")
+    args = parser.parse_args()
+
+    summary = BatchRunner(args.input, args.output, workers=args.workers, default_user=args.user).run()
+    print(summary.to_string())
+    cache_report = response_cache_report()
+    if cache_report:
+        print(cache_report)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,30 +1,40 @@
+import asyncio
 from datetime import datetime
 import os
 from uuid import uuid4
-from agents import Agent
 from chroma import ChromaHandler
-from config import ModelInstructions, ParamsConfig
 from messages import Message, Turn, start_new_conversation
-from utilities import stream_agent_response, toilet_banner_metal, toilet_banner_plain, debug_print_function_return
+from renderer import get_renderer
+from response_cache import response_cache_report
+from runtime import agent_runtime
+from warmup import SessionWarmup
+from utilities import stream_agent_response, stream_agent_tokens, toilet_banner_metal, toilet_banner_plain, debug_print_function_return
 
 
 class ChatHandler:
     """
     With multiple chat formats, it makes sense to kick this to it's own class to keep things tidy. Supports User>Agent chat and Agent>Agent chat currently. Looking at integrating a pub sub library so num of participants is arbitrary. The logic for round robin with agents is a little trickier to flesh out and maintain a consistent flow. Agent>Agent chat still tends to convert to mimicry after 12 to 15 rounds but i am hoping improvements in source will fix this along with logic to filter, limit or remove chroma results from prompt which has shown good results in testing but limits the functionality and overall scope.
     """
-    chroma_handler: ChromaHandler = ChromaHandler()
+    chroma_handler: ChromaHandler
 
-    def chat_with_agent(self, assistant_name: str) -> None:
+    def __init__(self) -> None:
+        self.chroma_handler = agent_runtime.share_chroma_handler()
+
+    def chat_with_agent(self, assistant_name: str, stream: bool = True, incremental: bool = None) -> None:
         """
         Opens a chat session and starts a new conversation with the selected agent. Chroma collection is created with agent:user nomencalture to refine results. This function uses exec through the OllamaServer instance to find available ports and start a server on that port. The server is stopped when the chat session ends. 
 
         :param project: The name of the project to chat about. If None, chat about all projects.
+        :param stream: Render tokens as Ollama generates them instead of waiting for the full completion.
+        :param incremental: Reuse the model's context from the previous turn (and the previous session) instead of re-sending the whole history every turn. None leaves it to the agent's params_config.
         """
-        instructions = ModelInstructions(method='load', assistant_name=assistant_name)
-        
-        config = ParamsConfig(method='load', assistant_name=assistant_name)
-        
-        agent = Agent(params_config=config, instructions=instructions)
+        # Cached after the first chat with this agent, the runtime only reloads it if its yaml changed
+        agent = agent_runtime.get_agent(assistant_name)
+        if incremental is not None:
+            agent.incremental = incremental
+
+        # Load the model, embedding runtime and collection in the background while the session is set up
+        warmup = SessionWarmup(self.chroma_handler, [(agent.instructions, agent.params_config)], [f"{agent.name}-{os.environ.get('USER') or os.environ.get('USERNAME')}"]).start()
 
         # Start a new conversation for chat logging. TODO: ability to check existing conversations and load OR new
         conversation = start_new_conversation(host=agent.name, 
@@ -32,7 +42,7 @@ class ChatHandler:
                                               guest=os.environ.get('USER') or os.environ.get('USERNAME'), 
                                               guest_is_bot=False)
         
-        collection=self.chroma_handler.chroma_get_or_create_collection(f"{agent.name}-{conversation.guest}")
+        collection=agent.memory_collection(conversation.guest)
 
         # Instantiate the server, find an available port, and start the server on that port. 
         #TODO: varying the port seems to be causing issues. I am rolling back to hard coded single port default for now, investigating further.
@@ -41,8 +51,12 @@ class ChatHandler:
         #server.start_server()
 
 
+        renderer = get_renderer()
+        turn_index = 0
         try:
             while True:
+                # The last reply may still be typing out while its turn was stored
+                renderer.wait()
                 # Get the user's request
                 request = input("User>> ")
 
@@ -50,11 +64,12 @@ class ChatHandler:
                     print("Exiting chat...\n\n")
                     break
                 elif request == '!focus':
-                    input(f"Current focus: {agent.instructions.assistant_focus}. Type a new focus message or press enter to keep this one.")
-                    if input == '':
+                    new_focus = input(f"Current focus: {agent.instructions.assistant_focus}. Type a new focus message or press enter to keep this one.")
+                    if new_focus == '':
                         continue
                     else:
-                        agent.instructions.assistant_focus = input
+                        # Changes the instructions fingerprint, so the prompt template is recompiled next turn
+                        agent.instructions.assistant_focus = new_focus
                         continue
                 
                 # Convert to Message class
@@ -66,6 +81,11 @@ class ChatHandler:
                     content=request
                 )
 
+                # The first turn needs everything warm anyway, report how long it took
+                if warmup is not None:
+                    print(warmup.wait().to_string())
+                    warmup = None
+
                 # Build the prompt
                 username = os.environ.get('USER') or os.environ.get('USERNAME')
                 prompt = agent.build_prompt(request_message.content, username=username, agent_agent=False)
@@ -75,7 +95,10 @@ class ChatHandler:
                 #####  DEBUG END  #####
 
                 # Get the response and stream it to the terminal
-                agent.last_response = agent.generate_response(prompt=prompt)
+                if stream:
+                    agent.last_response = stream_agent_tokens(agent.name, agent.generate_response_stream(prompt=prompt))
+                else:
+                    agent.last_response = agent.generate_response(prompt=prompt)
 
                 # Convert response to message class and pull the message string
                 response_message = Message(
@@ -86,22 +109,25 @@ class ChatHandler:
                     content=agent.last_response
                 )
 
-                stream_agent_response(agent.name, text=agent.last_response, delay=.05)
+                if not stream:
+                    stream_agent_response(agent.name, text=agent.last_response, delay=.05, wait=False)
 
                 # Create turn and add to chat history
                 convo_turn = Turn(
                     uuid=str(uuid4()),
                     request=request_message,
-                    response=response_message
+                    response=response_message,
+                    metrics=agent.last_stats.to_dict() if agent.last_stats else None
                 )
 
                 agent.message_cache.add_message(convo_turn)
 
-                # Chroma Upsert
-                document = convo_turn.request.to_memory_string()
-                document += convo_turn.response.to_memory_string()
+                # Chroma Upsert, queued on the write-behind buffer so the next prompt doesn't wait on embedding and SQLite
+                document = convo_turn.to_memory_document()
+                metadata = convo_turn.to_memory_metadata(conversation.uuid, turn_index)
+                turn_index += 1
                 #print(f"Documents: {document}")
-                self.chroma_handler.chroma_upsert_to_collection(collection=collection, metadata=None, document=document, id=convo_turn.uuid)
+                self.chroma_handler.chroma_buffer_upsert(collection=collection, metadata=metadata, document=document, id=convo_turn.uuid)
                 
 
                 ###  DEBUG: TURN BASE DICT  ###
@@ -114,26 +140,47 @@ class ChatHandler:
             #server.stop_server()
         
         finally:
+            renderer.finish()
+            self.chroma_handler.chroma_flush_memories()
+            embedding_report = self.chroma_handler.embedding_cache_report()
+            if embedding_report:
+                print(embedding_report)
+            report = agent.prefix_cache_report()
+            if report['turns']:
+                print(f"Prompt prefix reuse ({agent.instructions.prompt_layout or 'classic'} layout): {report['mean_shared_ratio']:.0%} over {report['turns']} turns")
+            print(f"Ollama at {agent.transport.base_url}: {agent.transport.stats.to_string()}")
+            cache_report = response_cache_report()
+            if cache_report:
+                print(cache_report)
+            print(agent_runtime.stats.to_string())
             print("Chat session ended.")
             #server.stop_server()
 
 
-    def multi_agent_chat(self, host_agent_name: str, guest_agent_name: str) -> None:
+    def multi_agent_chat(self, host_agent_name: str, guest_agent_name: str, stream: bool = True, incremental: bool = None) -> None:
         """
         Puts two agents into a chat session together. Super fun. Warning: This function uses exec through the OllamaServer instance to find available ports and start a server on that port. The server is stopped when the chat session ends.
 
         :param host_agent: The name of the agent to host the chat.
         :param guest_agent: The name of the agent to join the chat.
+        :param stream: Render tokens as Ollama generates them instead of waiting for the full completion.
+        :param incremental: Reuse each agent's context from its previous turn instead of re-sending the whole history. None leaves it to each agent's params_config.
         :returns: Hours of enjoyment if you know how to prompt..
         """
-        # Load the host agent from file
-        host_agent_model_instructions = ModelInstructions(method='load', assistant_name=host_agent_name)
-        host_agent_params_config = ParamsConfig(method='load', assistant_name=host_agent_name)
-        host_agent = Agent(host_agent_params_config, host_agent_model_instructions)
-        # Load the guest agent from file
-        guest_agent_model_instructions = ModelInstructions(method='load', assistant_name=guest_agent_name)
-        guest_agent_params_config = ParamsConfig(method='load', assistant_name=guest_agent_name)
-        guest_agent = Agent(guest_agent_params_config, guest_agent_model_instructions)
+        # Load both agents through the runtime. An agent talking to itself needs a second instance so the two sides keep separate histories.
+        host_agent = agent_runtime.get_agent(host_agent_name)
+        guest_agent = agent_runtime.get_agent(guest_agent_name) if guest_agent_name != host_agent_name else agent_runtime.new_agent(guest_agent_name)
+
+        # Warm both models and both collections while the banners are printed
+        warmup = SessionWarmup(
+            self.chroma_handler,
+            [(host_agent.instructions, host_agent.params_config), (guest_agent.instructions, guest_agent.params_config)],
+            [f"{host_agent.name}-{guest_agent.name}", f"{guest_agent.name}-{host_agent.name}"],
+        ).start()
+
+        if incremental is not None:
+            host_agent.incremental = incremental
+            guest_agent.incremental = incremental
 
         # Print the banners
         toilet_banner_metal(host_agent.name)
@@ -150,18 +197,28 @@ class ChatHandler:
         #server.start_server()
         #print(f"This session will use port: {server.port}")
         
-        host_collection = self.chroma_handler.chroma_get_or_create_collection(f"{host_agent.name}-{guest_agent.name}")
-        guest_collection = self.chroma_handler.chroma_get_or_create_collection(f"{guest_agent.name}-{host_agent.name}")
+        host_collection = host_agent.memory_collection(guest_agent.name)
+        guest_collection = guest_agent.memory_collection(host_agent.name)
 
 
         # Get the guest's first message before entering the chat to give the while loop a little better progression.
         host_agent.last_response = f"Hello, I'm {host_agent.name}, welcome to my room! People describe me as: {host_agent.instructions.description}. Please first tell me a little bit about yourself, and then give me 2 topics that you may be interested in speaking with me about. As your host, I will choose our first subject from your list."
 
+        print(warmup.wait().to_string())
+
+        renderer = get_renderer()
+        turn_index = 0
         try:
             while True:
+                # Prompt building prints, so let the previous reply finish typing first
+                renderer.wait()
                 guest_prompt = guest_agent.build_prompt(host_agent.last_response, username=host_agent.name, agent_agent=True)
                 #debug_print_function_return('Guest Prompt', guest_prompt)
-                guest_agent.last_response = guest_agent.generate_response(prompt=guest_prompt)
+                if stream:
+                    guest_agent.last_response = stream_agent_tokens(guest_agent.name, guest_agent.generate_response_stream(prompt=guest_prompt))
+                else:
+                    guest_agent.last_response = guest_agent.generate_response(prompt=guest_prompt)
+                guest_stats = guest_agent.last_stats
                 guest_request_message = Message(
                     uuid=str(uuid4()),
                     timestamp=str(datetime.now().strftime('%Y-%m-%d @ %H:%M')),
@@ -170,13 +227,17 @@ class ChatHandler:
                     content=guest_agent.last_response
                 )
 
-                # Stream the guest request to the terminal chat
-                stream_agent_response(guest_agent.name, guest_agent.last_response, 0.05)
+                # Stream the guest request to the terminal chat, the host starts on its reply while it types out
+                if not stream:
+                    stream_agent_response(guest_agent.name, guest_agent.last_response, 0.05, wait=False)
                 
                 # Request to Hosting Agent
                 host_agent_prompt = host_agent.build_prompt(guest_agent.last_response, username=guest_agent.name, agent_agent=True)
                 #debug_print_function_return('Host Prompt', host_agent_prompt)
-                host_agent.last_response = host_agent.generate_response(prompt=host_agent_prompt)
+                if stream:
+                    host_agent.last_response = stream_agent_tokens(host_agent.name, host_agent.generate_response_stream(prompt=host_agent_prompt))
+                else:
+                    host_agent.last_response = host_agent.generate_response(prompt=host_agent_prompt)
 
                 host_response_message = Message(
                     uuid=str(uuid4()),
@@ -187,13 +248,18 @@ class ChatHandler:
                 )
 
                 # Stream the host response to the terminal chat
-                stream_agent_response(host_agent.name, host_agent.last_response, 0.05)
+                if not stream:
+                    stream_agent_response(host_agent.name, host_agent.last_response, 0.05, wait=False)
 
                 # Create turn and add to chat history
                 message_turn = Turn(
                     uuid=str(uuid4()),
                     request=guest_request_message,
-                    response=host_response_message
+                    response=host_response_message,
+                    metrics={
+                        'request': guest_stats.to_dict() if guest_stats else None,
+                        'response': host_agent.last_stats.to_dict() if host_agent.last_stats else None,
+                    }
                 )
 
                 # Add Turn to each agents' message cache for prompt context
@@ -202,14 +268,179 @@ class ChatHandler:
 
                 # Add Turn to Conversation
                 conversation.create_turn(guest_request_message, host_response_message)
-                document = message_turn.request.to_memory_string()
-                document += message_turn.response.to_memory_string()
-                self.chroma_handler.chroma_upsert_to_collection(collection=host_collection, metadata=None, document=document, id=message_turn.uuid)
-                self.chroma_handler.chroma_upsert_to_collection(collection=guest_collection, metadata=None, document=document, id=message_turn.uuid)
+                document = message_turn.to_memory_document()
+                metadata = message_turn.to_memory_metadata(conversation.uuid, turn_index)
+                turn_index += 1
+                self.chroma_handler.chroma_buffer_upsert(collection=host_collection, metadata=metadata, document=document, id=message_turn.uuid)
+                self.chroma_handler.chroma_buffer_upsert(collection=guest_collection, metadata=metadata, document=document, id=message_turn.uuid)
         except KeyboardInterrupt:
             print("Interrupted by user...\n")
             #server.stop_server()
         
         finally:
+            renderer.finish()
+            self.chroma_handler.chroma_flush_memories()
+            embedding_report = self.chroma_handler.embedding_cache_report()
+            if embedding_report:
+                print(embedding_report)
+            # Both agents share one transport when they use the same server
+            for transport in {id(agent.transport): agent.transport for agent in (host_agent, guest_agent)}.values():
+                print(f"Ollama at {transport.base_url}: {transport.stats.to_string()}")
+            cache_report = response_cache_report()
+            if cache_report:
+                print(cache_report)
+            print(agent_runtime.stats.to_string())
             print("Chat session ended.")
             #server.stop_server()
+
+
+class AsyncChatHandler(ChatHandler):
+    """
+    Asyncio flavour of ChatHandler so one event loop can drive many sessions against a single Ollama server. Prompt building and generation go through Agent.abuild_prompt / agenerate_response, upserts through the handler's executor. Output is printed a full response at a time since per-character streaming would interleave badly with other sessions. The sync methods are inherited untouched for the cmd2 menus.
+    """
+
+    async def achat_with_agent(self, assistant_name: str, read_input=None, incremental: bool = None) -> None:
+        """
+        Async counterpart of chat_with_agent.
+
+        :param assistant_name: The name of the agent to chat with.
+        :param read_input: Optional coroutine function returning the next user request. Defaults to input() run off the event loop.
+        :param incremental: Reuse the model's context from the previous turn instead of re-sending the whole history. None leaves it to the agent's params_config.
+        """
+        loop = asyncio.get_running_loop()
+        if read_input is None:
+            async def read_input():
+                return await loop.run_in_executor(None, input, "User>> ")
+
+        # Concurrent sessions may share an agent name, so each gets its own instance (still on the shared handler and toolbox)
+        agent = agent_runtime.new_agent(assistant_name)
+        if incremental is not None:
+            agent.incremental = incremental
+
+        username = os.environ.get('USER') or os.environ.get('USERNAME')
+        conversation = start_new_conversation(host=agent.name, 
+                                              host_is_bot=True, 
+                                              guest=username, 
+                                              guest_is_bot=False)
+        collection = await agent.amemory_collection(conversation.guest)
+
+        turn_index = 0
+        try:
+            while True:
+                request = await read_input()
+                if request is None or request == 'exit' or request == 'quit':
+                    print("Exiting chat...\n\n")
+                    break
+
+                request_message = Message(
+                    uuid=str(uuid4()),
+                    timestamp=str(datetime.now().strftime('%Y-%m-%d @ %H:%M')),
+                    role='user',
+                    speaker=conversation.guest,
+                    content=request
+                )
+
+                prompt = await agent.abuild_prompt(request_message.content, username=username, agent_agent=False)
+                agent.last_response = await agent.agenerate_response(prompt=prompt)
+                print(f"\n{agent.name}>> {agent.last_response}")
+
+                response_message = Message(
+                    uuid=str(uuid4()),
+                    timestamp=str(datetime.now().strftime('%Y-%m-%d @ %H:%M')),
+                    role='assistant',
+                    speaker=conversation.host,
+                    content=agent.last_response
+                )
+                convo_turn = Turn(
+                    uuid=str(uuid4()),
+                    request=request_message,
+                    response=response_message,
+                    metrics=agent.last_stats.to_dict() if agent.last_stats else None
+                )
+                agent.message_cache.add_message(convo_turn)
+
+                document = convo_turn.to_memory_document()
+                metadata = convo_turn.to_memory_metadata(conversation.uuid, turn_index)
+                turn_index += 1
+                self.chroma_handler.chroma_buffer_upsert(collection, document, metadata, convo_turn.uuid)
+        finally:
+            await self.chroma_handler.run_async(self.chroma_handler.chroma_flush_memories)
+            print("Chat session ended.")
+
+    async def amulti_agent_chat(self, host_agent_name: str, guest_agent_name: str, max_rounds: int = None) -> None:
+        """
+        Async counterpart of multi_agent_chat. Without a human in the loop these are the sessions worth running by the dozen, so a round limit is available.
+
+        :param host_agent_name: The name of the agent to host the chat.
+        :param guest_agent_name: The name of the agent to join the chat.
+        :param max_rounds: Stop after this many guest/host exchanges. None runs until cancelled.
+        """
+        host_agent = agent_runtime.new_agent(host_agent_name)
+        guest_agent = agent_runtime.new_agent(guest_agent_name)
+
+        conversation = start_new_conversation(host_agent.name, 
+                                              host_is_bot=True, 
+                                              guest=guest_agent.name, 
+                                              guest_is_bot=True)
+        host_collection, guest_collection = await asyncio.gather(
+            host_agent.amemory_collection(guest_agent.name),
+            guest_agent.amemory_collection(host_agent.name),
+        )
+
+        host_agent.last_response = f"Hello, I'm {host_agent.name}, welcome to my room! People describe me as: {host_agent.instructions.description}. Please first tell me a little bit about yourself, and then give me 2 topics that you may be interested in speaking with me about. As your host, I will choose our first subject from your list."
+
+        rounds = 0
+        try:
+            while max_rounds is None or rounds < max_rounds:
+                guest_prompt = await guest_agent.abuild_prompt(host_agent.last_response, username=host_agent.name, agent_agent=True)
+                guest_agent.last_response = await guest_agent.agenerate_response(prompt=guest_prompt)
+                guest_stats = guest_agent.last_stats
+                print(f"\n[{conversation.uuid[:8]}] {guest_agent.name}>> {guest_agent.last_response}")
+                guest_request_message = Message(
+                    uuid=str(uuid4()),
+                    timestamp=str(datetime.now().strftime('%Y-%m-%d @ %H:%M')),
+                    role='user',
+                    speaker=guest_agent.name,
+                    content=guest_agent.last_response
+                )
+
+                host_agent_prompt = await host_agent.abuild_prompt(guest_agent.last_response, username=guest_agent.name, agent_agent=True)
+                host_agent.last_response = await host_agent.agenerate_response(prompt=host_agent_prompt)
+                print(f"\n[{conversation.uuid[:8]}] {host_agent.name}>> {host_agent.last_response}")
+                host_response_message = Message(
+                    uuid=str(uuid4()),
+                    timestamp=str(datetime.now().strftime('%Y-%m-%d @ %H:%M')),
+                    role='assistant',
+                    speaker=host_agent.name,
+                    content=host_agent.last_response
+                )
+
+                message_turn = Turn(
+                    uuid=str(uuid4()),
+                    request=guest_request_message,
+                    response=host_response_message,
+                    metrics={
+                        'request': guest_stats.to_dict() if guest_stats else None,
+                        'response': host_agent.last_stats.to_dict() if host_agent.last_stats else None,
+                    }
+                )
+                host_agent.message_cache.add_message(message_turn)
+                guest_agent.message_cache.add_message(message_turn)
+
+                document = message_turn.to_memory_document()
+                metadata = message_turn.to_memory_metadata(conversation.uuid, rounds)
+                self.chroma_handler.chroma_buffer_upsert(host_collection, document, metadata, message_turn.uuid)
+                self.chroma_handler.chroma_buffer_upsert(guest_collection, document, metadata, message_turn.uuid)
+                rounds += 1
+        finally:
+            await self.chroma_handler.run_async(self.chroma_handler.chroma_flush_memories)
+            print(f"Chat session {conversation.uuid} ended.")
+
+    async def arun_multi_agent_chats(self, pairings: list, max_rounds: int = None) -> None:
+        """
+        Run several agent-to-agent sessions concurrently on the current event loop.
+
+        :param pairings: A list of (host_agent_name, guest_agent_name) tuples.
+        :param max_rounds: Round limit applied to every session.
+        """
+        await asyncio.gather(*(self.amulti_agent_chat(host, guest, max_rounds=max_rounds) for host, guest in pairings))
@@ -17,6 +17,7 @@ def print_chat_menu():
     [2] Chat Room: Agent > Agent
     [3] List Existing Agents
     [4] Create New Agent
+    [5] Compact Agent Memory
 
     [9] Back to main menu (or type 'back' or 'main')
 
@@ -69,6 +70,19 @@ class ChatApp(cmd2.Cmd):
         curator = SystemAdmin()
         curator.create_new_agent()
 
+    def do_5(self, line):
+        try:
+            from compaction import MemoryCompactor
+            from runtime import agent_runtime
+            agent = agent_runtime.new_agent(input("Enter the name of the agent: ").lower())
+            username = input("Enter the user or agent it talks to: ")
+            days = input("Roll up turns older than how many days? (blank to only remove duplicates): ").strip()
+            older_than = int(days) if days else None
+            compactor = MemoryCompactor(agent_runtime.share_chroma_handler(), summarizer=agent.generate_response)
+            print(compactor.compact(f"{agent.name}-{username}", older_than_days=older_than).to_string())
+        except Exception as e:
+            print(f"Error: {e}")
+
     def do_9(self, line):
         print("\nHeading back to base...")
         return True
@@ -1,46 +1,474 @@
-from uuid import uuid4
-import chromadb
-from chromadb.utils import embedding_functions
+import asyncio
+import atexit
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import functools
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import TYPE_CHECKING, Dict, List
+
+from lexical import BM25Index, reciprocal_rank_fusion
+from vector_store import matches_where
+
+if TYPE_CHECKING:
+    import chromadb
+    from vector_store import TieredVectorStore, VectorCollection
+
+
+DEFAULT_CHROMA_PATH = "library/chroma.db"
+DEFAULT_EMBEDDING = "default"
+# Collections up to this size live in the NumPy tier, $CHAT3J_MAX_NUMPY_DOCUMENTS or an agent's params_config can change it
+DEFAULT_MAX_NUMPY_DOCUMENTS = 5000
+
+# One client per store path and one embedding function per backend for the whole process, created on first use
+_clients = {}
+_embedding_functions = {}
+_init_lock = threading.Lock()
+
+
+@dataclass
+class CollectionCacheStats:
+    hits: int = 0
+    misses: int = 0
+    invalidations: int = 0
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+class CollectionCache:
+    """
+    Collection handles by name for one store. get_or_create_collection is a round trip through Chroma's system tables and re-binds the embedding function, so after the first turn a chat only pays for the query itself. Shared by every handler on the same store so a delete or rename through any of them is seen by all. The lexical (BM25) index of each collection lives here too, so it is dropped along with the handle.
+    """
+    def __init__(self) -> None:
+        self.handles = {}
+        self.lexical_indexes = {}
+        self.lexical_build_locks = {}
+        self.stats = CollectionCacheStats()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple):
+        with self._lock:
+            handle = self.handles.get(key)
+            if handle is None:
+                self.stats.misses += 1
+            else:
+                self.stats.hits += 1
+            return handle
+
+    def put(self, key: tuple, handle) -> None:
+        with self._lock:
+            self.handles[key] = handle
+
+    def invalidate(self, name: str = None) -> None:
+        """
+        Drop the handles for a collection name, or every handle when name is None.
+        """
+        with self._lock:
+            keys = [key for key in self.handles if name is None or key[0] == name]
+            for key in keys:
+                del self.handles[key]
+            self.stats.invalidations += len(keys)
+            if name is None:
+                self.lexical_indexes.clear()
+            else:
+                self.lexical_indexes.pop(name, None)
+
+
+_collection_caches: Dict[str, CollectionCache] = {}
+
+
+def get_collection_cache(path: str) -> CollectionCache:
+    with _init_lock:
+        cache = _collection_caches.get(path)
+        if cache is None:
+            cache = _collection_caches[path] = CollectionCache()
+        return cache
+
+
+def memory_where(conversation: str = None, source: str = None, speaker: str = None, since_days: float = None) -> dict:
+    """
+    Build a where filter over memory metadata (see Turn.to_memory_metadata) for the query methods. Memories stored before metadata was recorded have none and never match a filter.
+
+    :param conversation: Only this conversation's turns.
+    :param source: Only memories from this source: 'chat', 'kb', 'command' or 'summary'.
+    :param speaker: Only turns started by this speaker.
+    :param since_days: Only memories from the last this many days.
+    :returns: A Chroma where dict, or None when nothing is filtered.
+    """
+    clauses = []
+    if conversation is not None:
+        clauses.append({'conversation': conversation})
+    if source is not None:
+        clauses.append({'source': source})
+    if speaker is not None:
+        clauses.append({'speaker': speaker})
+    if since_days is not None:
+        clauses.append({'timestamp': {'$gte': time.time() - since_days * 86400}})
+    if not clauses:
+        return None
+    # Chroma wants $and to have at least two clauses
+    return clauses[0] if len(clauses) == 1 else {'$and': clauses}
+
+
+def load_embedding_function(backend: str):
+    """
+    Build an embedding function from a backend spec. Importing chromadb's embedding functions (and onnxruntime behind the default one) is slow, so this only happens the first time memory is actually used.
+
+    :param backend: 'default' for chroma's bundled MiniLM or 'sentence-transformers:<model>'. Anything else can be passed to ChromaHandler as an embedding function object.
+    :returns: A chroma embedding function.
+    """
+    from chromadb.utils import embedding_functions
+
+    kind, _, model = backend.partition(':')
+    if kind == 'default':
+        return embedding_functions.DefaultEmbeddingFunction()
+    if kind == 'sentence-transformers':
+        return embedding_functions.SentenceTransformerEmbeddingFunction(model_name=model or "all-MiniLM-L6-v2")
+    raise ValueError(f"Unknown embedding backend: {backend}")
+
+
+def embedding_model_id(backend: str) -> str:
+    """
+    The model behind a backend spec. The embedding cache is kept per model, so it is keyed on this rather than on the spec.
+
+    :param backend: See load_embedding_function.
+    """
+    kind, _, model = backend.partition(':')
+    if kind == 'default':
+        # What chroma's DefaultEmbeddingFunction runs, through onnxruntime
+        return "all-MiniLM-L6-v2"
+    if kind == 'sentence-transformers':
+        return f"sentence-transformers/{model or 'all-MiniLM-L6-v2'}"
+    return backend
+
+
+def get_chroma_client(path: str):
+    """
+    The shared PersistentClient for a store path, opened on first use.
+
+    :param path: Directory of the chroma store.
+    """
+    client = _clients.get(path)
+    if client is None:
+        with _init_lock:
+            client = _clients.get(path)
+            if client is None:
+                import chromadb
+                client = _clients[path] = chromadb.PersistentClient(path=path)
+    return client
+
+
+def get_embedding_function(backend: str):
+    """
+    The shared embedding function for a backend spec, built on first use.
+
+    :param backend: See load_embedding_function.
+    """
+    embedding_function = _embedding_functions.get(backend)
+    if embedding_function is None:
+        with _init_lock:
+            embedding_function = _embedding_functions.get(backend)
+            if embedding_function is None:
+                embedding_function = _embedding_functions[backend] = load_embedding_function(backend)
+    return embedding_function
+
+
+class MemoryWriteBuffer:
+    """
+    Write-behind buffer for turn memories. Chat loops hand documents over with add() and carry on; a background thread groups them per collection and writes each group with one embedding call and one collection.upsert once it reaches max_batch documents or its oldest document is max_delay seconds old. Documents stay visible to ChromaHandler.chroma_query_collection until they have been written, so prompts never miss the last few turns. Everything left is flushed on flush()/close() and at interpreter exit. A collection whose write fails is retried in the background with exponential backoff, and its batch is dropped once max_retries retries have failed too.
+
+    :param handler: The ChromaHandler whose embedding function is used.
+    :param max_batch: Flush a collection once this many documents are waiting.
+    :param max_delay: Flush a collection once its oldest document has waited this long, in seconds.
+    :param max_retries: Retries for a failed batch before it is dropped.
+    :param retry_delay: Seconds before the first retry, doubled after each failure.
+    """
+    def __init__(self, handler: 'ChromaHandler', max_batch: int = 16, max_delay: float = 2.0, max_retries: int = 6, retry_delay: float = 2.0) -> None:
+        self.handler = handler
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        # collection name -> (failed attempts in a row, monotonic time of the next background attempt)
+        self._retries: Dict[str, tuple] = {}
+        # collection name -> {id: entry}, entry = {collection, document, metadata, embedding, queued_at}
+        self._pending: Dict[str, Dict[str, dict]] = {}
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        self.batches_written = 0
+        self.documents_written = 0
+        self.documents_dropped = 0
+        atexit.register(self.close)
+
+    def add(self, collection, document: str, metadata: dict, id: str) -> None:
+        """
+        Queue a document for upsert and return immediately. A later add with the same id replaces the queued one.
+
+        :param collection: The collection to write to.
+        :param document: The document text.
+        :param metadata: Metadata dict, or None.
+        :param id: The document id.
+        """
+        with self._condition:
+            entries = self._pending.setdefault(collection.name, {})
+            entries[id] = {'collection': collection, 'document': document, 'metadata': metadata, 'embedding': None, 'queued_at': time.monotonic()}
+            if self._thread is None and not self._closed:
+                self._thread = threading.Thread(target=self._run, name='chroma-write-behind', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def pending(self, collection_name: str) -> List[tuple]:
+        """
+        Documents queued for a collection that are not in Chroma yet.
+
+        :param collection_name: The collection's name.
+        :returns: A list of (id, entry) pairs.
+        """
+        with self._condition:
+            return list(self._pending.get(collection_name, {}).items())
+
+    def _due(self, now: float) -> List[str]:
+        due = []
+        for name, entries in self._pending.items():
+            if not entries:
+                continue
+            retry = self._retries.get(name)
+            if retry is not None and now < retry[1]:
+                continue
+            oldest = min(entry['queued_at'] for entry in entries.values())
+            if len(entries) >= self.max_batch or now - oldest >= self.max_delay:
+                due.append(name)
+        return due
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                due = self._due(time.monotonic())
+                while not due and not self._closed:
+                    self._condition.wait(self.max_delay / 4)
+                    due = self._due(time.monotonic())
+                if self._closed:
+                    return
+            for name in due:
+                self.flush(name)
+
+    def flush(self, collection_name: str = None) -> None:
+        """
+        Write queued documents now, in one upsert per collection.
+
+        :param collection_name: Only flush this collection. None flushes everything.
+        """
+        with self._flush_lock:
+            with self._condition:
+                names = [collection_name] if collection_name is not None else list(self._pending)
+                batches = {name: list(self._pending.get(name, {}).items()) for name in names}
+            for name, batch in batches.items():
+                if not batch:
+                    continue
+                try:
+                    self._write(batch)
+                except Exception as e:
+                    self._failed(name, batch, e)
+                    continue
+                with self._condition:
+                    self._retries.pop(name, None)
+                    self._remove(name, batch)
+
+    def _remove(self, name: str, batch: List[tuple]) -> int:
+        # Caller holds the condition. Only drops entries that weren't replaced while the batch was being written.
+        entries = self._pending.get(name, {})
+        removed = 0
+        for id, entry in batch:
+            if entries.get(id) is entry:
+                del entries[id]
+                removed += 1
+        if not entries:
+            self._pending.pop(name, None)
+        return removed
+
+    def _failed(self, name: str, batch: List[tuple], error: Exception) -> None:
+        now = time.monotonic()
+        with self._condition:
+            failures, next_attempt = self._retries.get(name, (0, now))
+            failures += 1
+            if failures > self.max_retries:
+                self._retries.pop(name, None)
+                dropped = self._remove(name, batch)
+                self.documents_dropped += dropped
+                print(f"Error flushing memories to {name}: {error}. Gave up after {self.max_retries} retries, dropped {dropped} memories.")
+                return
+            delay = self.retry_delay * 2 ** (failures - 1)
+            self._retries[name] = (failures, now + delay)
+        # Explicit flushes inside a backoff window fail quietly, so there's one message per window
+        if now >= next_attempt:
+            print(f"Error flushing memories to {name}: {error}. Retrying in {delay:g}s.")
+
+    def _write(self, batch: List[tuple]) -> None:
+        missing = [entry for _, entry in batch if entry['embedding'] is None]
+        if missing:
+            for entry, embedding in zip(missing, self.handler.embedding_function([entry['document'] for entry in missing])):
+                entry['embedding'] = embedding
+        collection = batch[0][1]['collection']
+        metadatas = [entry['metadata'] for _, entry in batch]
+        collection.upsert(
+            ids=[id for id, _ in batch],
+            documents=[entry['document'] for _, entry in batch],
+            embeddings=[entry['embedding'] for _, entry in batch],
+            metadatas=metadatas if any(metadata for metadata in metadatas) else None,
+        )
+        self.batches_written += 1
+        self.documents_written += len(batch)
+
+    def close(self) -> None:
+        """
+        Stop the background thread and write whatever is left.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self.flush()
 
 
 class ChromaHandler:
     """
-    A class to handle all interactions with the chroma database.
+    A class to handle all interactions with the chroma database. Collections are opened through a VectorStore (see vector_store.py): small ones live in an in-memory NumPy matrix snapshotted next to the chroma store and are moved into Chroma once they outgrow it. The store, client and embedding function are only created when first used, and are shared by every handler pointing at the same store/backend.
+
+    :param path: Chroma store directory. Defaults to $CHAT3J_CHROMA_PATH or library/chroma.db, so worker processes and test runs can each use their own store.
+    :param embedding: Embedding backend spec (see load_embedding_function) or an embedding function object. Defaults to $CHAT3J_EMBEDDING or chroma's default.
+    :param max_numpy_documents: Collections up to this size are kept in NumPy instead of Chroma. Defaults to $CHAT3J_MAX_NUMPY_DOCUMENTS or 5000, 0 keeps everything in Chroma. A collection opened with its own limit uses that instead.
     """
-    embedding_function = embedding_functions.DefaultEmbeddingFunction()
-    chroma = chromadb.PersistentClient(path="library/chroma.db")
-        
+    # Async callers share this pool, it caps how many embedding/SQLite calls run at once.
+    executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='chroma')
+
+    def __init__(self, path: str = None, embedding=None, max_numpy_documents: int = None) -> None:
+        self.path = path or os.environ.get('CHAT3J_CHROMA_PATH') or DEFAULT_CHROMA_PATH
+        if max_numpy_documents is None:
+            max_numpy_documents = int(os.environ.get('CHAT3J_MAX_NUMPY_DOCUMENTS', DEFAULT_MAX_NUMPY_DOCUMENTS))
+        self.max_numpy_documents = max_numpy_documents
+        embedding = embedding or os.environ.get('CHAT3J_EMBEDDING') or DEFAULT_EMBEDDING
+        if isinstance(embedding, str):
+            self.embedding_backend = embedding
+            self.embedding_model = embedding_model_id(embedding)
+            self._raw_embedding_function = None
+        else:
+            model_name = getattr(embedding, 'model_name', None)
+            self.embedding_backend = f"{type(embedding).__name__}:{model_name}" if model_name else type(embedding).__name__
+            self.embedding_model = model_name or type(embedding).__name__
+            self._raw_embedding_function = embedding
+        self._embedding_function = None
+        self._write_buffer = None
+        self._write_buffer_lock = threading.Lock()
+
+    @property
+    def chroma(self) -> 'chromadb.ClientAPI':
+        return get_chroma_client(self.path)
+
+    @property
+    def vector_store(self) -> 'TieredVectorStore':
+        from vector_store import get_vector_store
+        return get_vector_store(self.path, self.max_numpy_documents)
+
+    @property
+    def collection_cache(self) -> CollectionCache:
+        return get_collection_cache(self.path)
+
+    @property
+    def raw_embedding_function(self):
+        """
+        The embedding function itself. This is what collections are created with, so the config Chroma stores per collection stays the real model's.
+        """
+        if self._raw_embedding_function is None:
+            self._raw_embedding_function = get_embedding_function(self.embedding_backend)
+        return self._raw_embedding_function
+
+    @property
+    def embedding_function(self):
+        """
+        The embedding function behind the process-wide embedding cache. Every handler path embeds through this and hands Chroma the vectors, so identical text is only embedded once per model.
+        """
+        if self._embedding_function is None:
+            from embedding_cache import get_embedding_cache
+            self._embedding_function = get_embedding_cache(self.raw_embedding_function, self.embedding_model)
+        return self._embedding_function
+
+    @property
+    def write_buffer(self) -> MemoryWriteBuffer:
+        with self._write_buffer_lock:
+            if self._write_buffer is None:
+                self._write_buffer = MemoryWriteBuffer(self)
+            return self._write_buffer
+
+    async def run_async(self, fn, *args, **kwargs):
+        """
+        Run a blocking call on the handler's executor and await it. Every a* method goes through this, and async callers can use it for any other handler method.
+
+        :param fn: The function to call.
+        :returns: Whatever fn returns.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+
 
-    def chroma_get_collection(self, name: str) -> chromadb.Collection:
+    def chroma_get_collection(self, name: str) -> 'VectorCollection':
         """
         Load a collection from the chroma database.
         """
-        collection = self.chroma.get_collection(name=name)
+        # get_collection binds no embedding function, so its handle is cached apart from get_or_create's
+        key = (name, None)
+        collection = self.collection_cache.get(key)
+        if collection is None:
+            collection = self.vector_store.get(name)
+            self.collection_cache.put(key, collection)
         return collection
 
 
-    def chroma_get_or_create_collection(self, name: str) -> chromadb.Collection:
+    def chroma_get_or_create_collection(self, name: str, max_numpy_documents: int = None) -> 'VectorCollection':
         """
         Load a collection from the chroma database. If the collection does not exist, create it.
 
         :param name: The name of the collection to load or create.
+        :param max_numpy_documents: This collection's NumPy tier limit, see TieredVectorStore. None uses the handler's.
         """
-        collection = self.chroma.get_or_create_collection(name=name, embedding_function=self.embedding_function)
+        if max_numpy_documents is not None:
+            self.vector_store.set_limit(name, max_numpy_documents)
+        key = (name, self.embedding_backend)
+        collection = self.collection_cache.get(key)
+        if collection is None:
+            collection = self.vector_store.get_or_create(name, self.raw_embedding_function)
+            self.collection_cache.put(key, collection)
         
         return collection
 
 
+    async def achroma_get_or_create_collection(self, name: str, max_numpy_documents: int = None) -> 'VectorCollection':
+        """
+        Async chroma_get_or_create_collection, run on the handler's executor.
+
+        :param name: The name of the collection to load or create.
+        :param max_numpy_documents: See chroma_get_or_create_collection.
+        """
+        return await self.run_async(self.chroma_get_or_create_collection, name, max_numpy_documents)
+
+
     def chroma_delete_collection(self, name: str) -> None:
         """
         Deleta a collection from the chroma database.
 
         :param name: The name of the collection to delete.
         """
-        self.chroma.delete_collection(name=name)
+        self.collection_cache.invalidate(name)
+        self.vector_store.delete(name)
         print(f"Deleted collection: {name}")
 
 
-    def chroma_upsert_to_collection(self, collection, document, metadata, id):
+    def chroma_upsert_to_collection(self, collection: 'VectorCollection', document, metadata, id):
         """
         Add documents to a collection.
 
@@ -49,38 +477,307 @@ class ChromaHandler:
         :param metadatas: A list of metadata to add to the collection. ([{"source": "my_source"}, {"source": "my_source"}])
         :param ids: A list of ids to add to the collection. (["id1", "id2"])
         """
+        documents = [document] if isinstance(document, str) else document
         collection.upsert(ids=id,
                         metadatas=metadata, 
                         documents=document,
+                        embeddings=self.embedding_function(documents),
         )
+        self.lexical_note(collection, [id] if isinstance(id, str) else id, documents)
 
 
-    def chroma_collection_change_name(self, collection: str, new_name: str) -> None:
+    def chroma_buffer_upsert(self, collection: 'VectorCollection', document: str, metadata: dict, id: str) -> None:
+        """
+        Queue a document on the write-behind buffer instead of embedding and committing it right now. Queries through this handler still see it.
+
+        :param collection: The collection to add the document to.
+        :param document: The document.
+        :param metadata: Its metadata, or None.
+        :param id: Its id.
+        """
+        self.write_buffer.add(collection, document, metadata, id)
+        self.lexical_note(collection, [id], [document])
+
+
+    def chroma_flush_memories(self) -> None:
+        """
+        Write everything queued by chroma_buffer_upsert. Called when a chat ends.
+        """
+        if self._write_buffer is not None:
+            self._write_buffer.flush()
+
+
+    async def achroma_upsert_to_collection(self, collection: 'VectorCollection', document, metadata, id):
+        """
+        Async chroma_upsert_to_collection, run on the handler's executor.
+        """
+        await self.run_async(self.chroma_upsert_to_collection, collection, document, metadata, id)
+
+
+    def chroma_collection_change_name(self, collection: 'VectorCollection', new_name: str) -> None:
         """
         Change the name of a collection in the chroma database.
 
         :param collection: The collection to change the name of.
         :param new_name: The new name of the collection.
         """
-        collection.change_name(name=new_name)
+        old_name = collection.name
+        collection.modify(name=new_name)
+        self.collection_cache.invalidate(old_name)
+        self.collection_cache.invalidate(new_name)
+
+
+    def chroma_reset(self) -> None:
+        """
+        Forget every cached collection handle for this store. Use it after collections were changed from outside this process (another worker, deletecollection.py); stored data is untouched. NumPy collections reload themselves whenever their snapshot changes on disk.
+        """
+        self.collection_cache.invalidate()
+        self.vector_store.reset()
 
 
-    def chroma_query_collection(self, collection: str, query: str, n_results: int) -> list:
+    def chroma_query_collection(self, collection: 'VectorCollection', query: str, n_results: int, where: dict = None, include: List[str] = None) -> list:
         """
         Query a collection and return (n_results) nearest neighbors.
 
         :param collection: The collection to query.
         :param query: The query to use. ("This is a query")
         :param n_results: The number of results to return.
+        :param where: Metadata filter (see memory_where), applied before ranking so only matching memories are scanned.
+        :param include: Result fields, e.g. add 'embeddings' for re-ranking. Defaults to documents, metadatas and distances.
         returns: A list of results.
         """
-        results = collection.query(query_texts=query, 
+        query_embedding = self.embedding_function([query] if isinstance(query, str) else query)[0]
+        results = collection.query(query_embeddings=[query_embedding],
                                 n_results=n_results,
+                                **({'where': where} if where else {}),
+                                **({'include': include} if include else {}),
         )
 
+        # Turns still in the write-behind buffer are ranked against the same query embedding alongside Chroma's results
+        pending = self._write_buffer.pending(collection.name) if self._write_buffer is not None else []
+        pending = [(id, entry) for id, entry in pending if matches_where(entry['metadata'], where)]
+        if pending:
+            return self.merge_pending_results(results, pending, query_embedding, n_results)
         return results
 
 
+    def merge_pending_results(self, results: dict, pending: List[tuple], query_embedding, n_results: int) -> dict:
+        """
+        Merge not-yet-written documents into a query result by squared L2 distance, the same metric the collections use.
+
+        :param results: Result of collection.query for a single query.
+        :param pending: (id, entry) pairs from MemoryWriteBuffer.pending.
+        :param query_embedding: The query's embedding.
+        :param n_results: How many results to keep.
+        :returns: The result dict with the merged top n_results.
+        """
+        import numpy as np
+
+        missing = [entry for _, entry in pending if entry['embedding'] is None]
+        if missing:
+            for entry, embedding in zip(missing, self.embedding_function([entry['document'] for entry in missing])):
+                entry['embedding'] = embedding
+
+        query_vector = np.asarray(query_embedding, dtype=np.float32)
+        pending_ids = {id for id, _ in pending}
+        candidates = []
+        for id, entry in pending:
+            distance = float(np.sum((np.asarray(entry['embedding'], dtype=np.float32) - query_vector) ** 2))
+            candidates.append((distance, id, entry['document'], entry['metadata'], entry['embedding']))
+
+        ids = (results.get('ids') or [[]])[0]
+        columns = {}
+        for key in ('documents', 'metadatas', 'distances', 'embeddings'):
+            column = (results.get(key) or [None])[0]
+            columns[key] = list(column) if column is not None else [None] * len(ids)
+        for index, id in enumerate(ids):
+            # A queued version of the same id is newer than what is stored
+            if id not in pending_ids:
+                candidates.append((columns['distances'][index], id, columns['documents'][index], columns['metadatas'][index], columns['embeddings'][index]))
+        candidates.sort(key=lambda candidate: candidate[0])
+        candidates = candidates[:n_results]
+
+        merged = dict(results)
+        merged['ids'] = [[candidate[1] for candidate in candidates]]
+        merged['documents'] = [[candidate[2] for candidate in candidates]]
+        merged['metadatas'] = [[candidate[3] for candidate in candidates]]
+        merged['distances'] = [[candidate[0] for candidate in candidates]]
+        if results.get('embeddings') is not None:
+            merged['embeddings'] = [[candidate[4] for candidate in candidates]]
+        return merged
+
+
+    async def achroma_query_collection(self, collection: 'VectorCollection', query: str, n_results: int, where: dict = None, include: List[str] = None) -> list:
+        """
+        Async chroma_query_collection, run on the handler's executor. The query embedding is the expensive part so this is what keeps the event loop free.
+        """
+        return await self.run_async(self.chroma_query_collection, collection, query, n_results, where, include)
+
+
+    def lexical_index(self, collection: 'VectorCollection') -> BM25Index:
+        """
+        The collection's BM25 index, built from its stored documents (plus anything still in the write-behind buffer) the first time it is asked for in this process, by paging through the whole collection. After that, every write through a handler in this process keeps it current. Writes from other processes only show up once the index is rebuilt (chroma_reset).
+
+        :param collection: The collection.
+        :returns: The BM25Index.
+        """
+        cache = self.collection_cache
+        index = cache.lexical_indexes.get(collection.name)
+        if index is not None:
+            return index
+        with _init_lock:
+            build_lock = cache.lexical_build_locks.setdefault(collection.name, threading.Lock())
+        with build_lock:
+            index = cache.lexical_indexes.get(collection.name)
+            if index is not None:
+                return index
+            index = BM25Index()
+            offset = 0
+            while True:
+                page = collection.get(include=['documents'], limit=5000, offset=offset)
+                if not page['ids']:
+                    break
+                index.add_many(page['ids'], page['documents'])
+                offset += len(page['ids'])
+            if self._write_buffer is not None:
+                for id, entry in self._write_buffer.pending(collection.name):
+                    index.add(id, entry['document'])
+            cache.lexical_indexes[collection.name] = index
+            return index
+
+
+    def lexical_note(self, collection: 'VectorCollection', ids: List[str], documents: List[str]) -> None:
+        """
+        Add written documents to the collection's BM25 index, if it has been built. An index that hasn't been built yet picks them up from the store when it is.
+        """
+        index = self.collection_cache.lexical_indexes.get(collection.name)
+        if index is not None:
+            index.add_many(ids, documents)
+
+
+    def chroma_hybrid_query_collection(self, collection: 'VectorCollection', query: str, n_results: int, candidates: int = None, rrf_k: int = 60, where: dict = None) -> dict:
+        """
+        Query a collection by embedding similarity and by BM25 and fuse the two rankings with reciprocal rank fusion. Exact names, ids and identifiers that embeddings blur are found lexically, so fewer memories are needed for the same recall.
+
+        :param collection: The collection to query.
+        :param query: The query text.
+        :param n_results: The number of results to return.
+        :param candidates: How deep each ranking goes before fusing. Defaults to 4x n_results (at least 20).
+        :param rrf_k: Reciprocal rank fusion constant.
+        :param where: Metadata filter (see memory_where). The vector side is filtered by the store, lexical hits are checked against it before fusing.
+        :returns: Results shaped like chroma_query_collection's, best first, plus 'scores' with the fused scores. Distances are None for documents only the lexical side found.
+        """
+        candidates = candidates or max(n_results * 4, 20)
+        vector_results = self.chroma_query_collection(collection, query, candidates, where)
+        lexical_ids = [id for id, _ in self.lexical_index(collection).search(query, candidates)]
+        if where and lexical_ids:
+            lexical_ids = self.filter_ids(collection, lexical_ids, where)
+
+        vector_ids = (vector_results.get('ids') or [[]])[0]
+        fused = reciprocal_rank_fusion([vector_ids, lexical_ids], k=rrf_k)[:n_results]
+
+        found = {}
+        for index, id in enumerate(vector_ids):
+            found[id] = (vector_results['documents'][0][index],
+                         (vector_results.get('metadatas') or [[None] * len(vector_ids)])[0][index],
+                         (vector_results.get('distances') or [[None] * len(vector_ids)])[0][index])
+        missing = [id for id, _ in fused if id not in found]
+        if missing and self._write_buffer is not None:
+            for id, entry in self._write_buffer.pending(collection.name):
+                if id in missing:
+                    found[id] = (entry['document'], entry['metadata'], None)
+        missing = [id for id in missing if id not in found]
+        if missing:
+            stored = collection.get(ids=missing, include=['documents', 'metadatas'])
+            for id, document, metadata in zip(stored['ids'], stored['documents'], stored['metadatas'] or [None] * len(stored['ids'])):
+                found[id] = (document, metadata, None)
+
+        fused = [(id, score) for id, score in fused if id in found]
+        return {
+            'ids': [[id for id, _ in fused]],
+            'documents': [[found[id][0] for id, _ in fused]],
+            'metadatas': [[found[id][1] for id, _ in fused]],
+            'distances': [[found[id][2] for id, _ in fused]],
+            'scores': [[score for _, score in fused]],
+        }
+
+
+    def filter_ids(self, collection: 'VectorCollection', ids: List[str], where: dict) -> List[str]:
+        """
+        The ids, in order, whose metadata passes a where filter. Queued documents are checked here, stored ones by the store.
+        """
+        pending = dict(self._write_buffer.pending(collection.name)) if self._write_buffer is not None else {}
+        stored = [id for id in ids if id not in pending]
+        passing = set(collection.get(ids=stored, where=where, include=[])['ids']) if stored else set()
+        passing.update(id for id in ids if id in pending and matches_where(pending[id]['metadata'], where))
+        return [id for id in ids if id in passing]
+
+
+    async def achroma_hybrid_query_collection(self, collection: 'VectorCollection', query: str, n_results: int, where: dict = None) -> dict:
+        """
+        Async chroma_hybrid_query_collection, run on the handler's executor.
+        """
+        return await self.run_async(self.chroma_hybrid_query_collection, collection, query, n_results, where=where)
+
+
+    def chroma_rerank_results(self, results: dict, query: str, n_results: int, max_distance: float = None, mmr_lambda: float = 0.7, duplicate_similarity: float = 0.95) -> tuple:
+        """
+        Cut a query result down to the memories worth injecting: drop candidates further than max_distance from the query, then pick up to n_results of the rest by maximal marginal relevance so near-duplicates don't take several slots. Can return fewer than n_results, or none.
+
+        :param results: A single-query result from chroma_query_collection (ideally with embeddings included) or chroma_hybrid_query_collection.
+        :param query: The query text, its embedding comes out of the embedding cache.
+        :param n_results: Most memories to keep.
+        :param max_distance: Squared L2 cutoff, the metric the collections use. None keeps everything. Hybrid hits that only BM25 found have no distance and are never cut by it, their exact match is the point.
+        :param mmr_lambda: Relevance/diversity trade-off, see rerank.mmr_select.
+        :param duplicate_similarity: Cosine similarity at which a candidate counts as a copy of one already kept.
+        :returns: (results shaped like the input with the kept memories best first, RerankReport)
+        """
+        import numpy as np
+        from rerank import RerankReport, mmr_select
+
+        ids = (results.get('ids') or [[]])[0] if results else []
+        report = RerankReport(candidates=len(ids))
+        if not ids:
+            return results, report
+
+        columns = {}
+        for key in ('documents', 'metadatas', 'distances', 'embeddings', 'scores'):
+            column = (results.get(key) or [None])[0]
+            columns[key] = list(column) if column is not None else [None] * len(ids)
+        missing = [index for index, embedding in enumerate(columns['embeddings']) if embedding is None]
+        if missing:
+            # Hybrid and merged results come without embeddings, the cache has them from when the memory was stored
+            for index, embedding in zip(missing, self.embedding_function([columns['documents'][index] or "" for index in missing])):
+                columns['embeddings'][index] = embedding
+        embeddings = np.asarray(columns['embeddings'], dtype=np.float32)
+        query_embedding = np.asarray(self.embedding_function([query])[0], dtype=np.float32)
+
+        distances = columns['distances']
+        if max_distance is not None:
+            candidates = [index for index, distance in enumerate(distances) if distance is None or distance <= max_distance]
+        else:
+            candidates = list(range(len(ids)))
+        report.too_distant = len(ids) - len(candidates)
+
+        picked, report.redundant = mmr_select(query_embedding, embeddings[candidates], n_results, mmr_lambda, duplicate_similarity)
+        kept = [candidates[index] for index in picked]
+        report.kept = len(kept)
+
+        reranked = {'ids': [[ids[index] for index in kept]]}
+        for key in ('documents', 'metadatas', 'distances'):
+            reranked[key] = [[columns[key][index] for index in kept]]
+        if results.get('scores') is not None:
+            reranked['scores'] = [[columns['scores'][index] for index in kept]]
+        return reranked, report
+
+
+    async def achroma_rerank_results(self, results: dict, query: str, n_results: int, **kwargs) -> tuple:
+        """
+        Async chroma_rerank_results, run on the handler's executor (it may have to embed).
+        """
+        return await self.run_async(self.chroma_rerank_results, results, query, n_results, **kwargs)
+
+
     def chroma_upser_agent_command(self, command_name: str, command: str) -> None:
         """
         Add a command to the agent commands collection.
@@ -90,42 +787,86 @@ class ChromaHandler:
         """
         self.chroma_upsert_to_collection(collection=self.chroma_get_or_create_collection("agent_commands"),
                                     document=[command],
-                                    metadata=[{"name": command_name}],
+                                    metadata=[{"name": command_name, "source": "command", "timestamp": time.time()}],
                                     id=[command_name],
         )
 
 
     def upsert_chunks_from_corpus(self, corpus_path: str, collection_name: str) -> None:
             """
-            Upserts chunks from a corpus file into the agent's collection. kb=knowledgebase
+            Upserts chunks from a corpus file into a collection. kb=knowledgebase. Runs through the ingest pipeline, so chunks are streamed, batched and keyed by content hash and re-running it doesn't duplicate anything.
 
             :param corpus_path: The path to the corpus file.
+            :param collection_name: The collection to upsert into.
             """
-            collection = self.chroma_get_or_create_collection(self.name)
-            with open(corpus_path, 'r') as file:
-                corpus = file.read()
-            corpus_chunks = corpus.split('\n\n')
-            for chunk in corpus_chunks:
-                self.chroma_upsert_to_collection(collection=collection_name, metadata=None, document=chunk, id=f"{self.name}-kb-{str(uuid4())}")
-            print("Corpus chunks upserted.")
+            from ingest import CorpusIngestor
+            report = CorpusIngestor(self, collection_name).ingest_paths([corpus_path])
+            print(f"Corpus chunks upserted. {report.to_string()}")
+
+
+    def embedding_cache_report(self) -> str:
+        """
+        Hit rate of the embedding cache, or None if nothing has been embedded yet.
+        """
+        if self._embedding_function is None:
+            return None
+        return self._embedding_function.stats.to_string()
+
+
+    def chroma_results_to_entries(self, chroma_results) -> list:
+        """
+        Format each document of a query result as its own prompt entry, best match first, so callers can budget memories one at a time.
+
+        :param chroma_results: Results from chroma_query_collection.
+        :returns: A list of formatted memory strings.
+        """
+        if not chroma_results or not chroma_results.get("documents"):
+            return []
+        entries = []
+        for query_index, result in enumerate(chroma_results["documents"]):
+            # One list of documents per query text
+            documents = result if isinstance(result, list) else [result]
+            metadatas = (chroma_results.get("metadatas") or [None] * (query_index + 1))[query_index] or [None] * len(documents)
+            for document, metadata in zip(documents, metadatas):
+                if not document:
+                    continue
+                if metadata and (metadata.get("timestamp") is not None or metadata.get("source")):
+                    entries.append(self.memory_entry(document, metadata))
+                    continue
+                # Stored before turns had metadata: split the result into components (sender, timestamp, message)
+                components = document.split(" @ ")
+                if len(components) < 3:
+                    entries.append(f"\n{document.strip()}")
+                    continue
+                sender = components[0].strip()
+                timestamp = components[1].strip()
+                message = " @ ".join(components[2:]).strip()
+                # Format each entry
+                entries.append(f"\n{sender} ({timestamp}):\n{message}")
+        return entries
+
+
+    @staticmethod
+    def memory_entry(document: str, metadata: dict) -> str:
+        """
+        Format a memory for the prompt from its metadata. Turn documents already name who said what, so they only get a time header.
+        """
+        when = datetime.fromtimestamp(metadata["timestamp"]).strftime('%Y-%m-%d @ %H:%M') if isinstance(metadata.get("timestamp"), (int, float)) else None
+        source = metadata.get("source")
+        if source == "kb":
+            label = f"From {os.path.basename(metadata.get('path', '')) or 'knowledge base'}"
+        elif source == "summary":
+            label = "Summary"
+        elif source == "command":
+            label = f"Command {metadata.get('name', '')}".strip()
+        else:
+            return f"\n({when}):\n{document.strip()}" if when else f"\n{document.strip()}"
+        return f"\n{label} ({when}):\n{document.strip()}" if when else f"\n{label}:\n{document.strip()}"
 
 
     def chroma_results_format_to_prompt(self, chroma_results):
-        if not chroma_results["documents"] or all(not doc for doc in chroma_results["documents"]):
+        entries = self.chroma_results_to_entries(chroma_results)
+        if not entries:
             return "No results found."
-        formatted_output = ""
-        for result in chroma_results["documents"]:
-            # Join the list into a string if the result is a list
-            if isinstance(result, list):
-                result = " ".join(result)
-
-        # Split the result into components (sender, timestamp, message)
-        components = result.split(" @ ")
-        sender = components[0].strip()
-        timestamp = components[1].strip()
-        message = " @ ".join(components[2:]).strip()
-        # Format each entry
-        formatted_output += f"\n{sender} ({timestamp}):\n{message}"
-        
 
-        return formatted_output
\ No newline at end of file
+        return "".join(entries)
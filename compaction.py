@@ -0,0 +1,298 @@
+import argparse
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+import hashlib
+import random
+import re
+import time
+from typing import Callable, Dict, List
+import numpy as np
+from chroma import ChromaHandler
+
+
+# Turns stored before they had metadata are "<speaker> @ <YYYY-MM-DD> @ <HH:MM>: <content>", see Message.to_memory_string
+MEMORY_TIMESTAMP_PATTERN = re.compile(r" @ (\d{4}-\d{2}-\d{2}) @ (\d{2}:\d{2})")
+SUMMARY_PROMPT = (
+    "Summarise the following conversation turns from {date} in a short paragraph. "
+    "Keep names, facts, decisions, numbers and anything someone asked to be remembered; drop greetings and repetition.\n\n{turns}"
+)
+# What a dry run assumes each summary comes to, a short paragraph. Never more than the turns it replaces.
+ESTIMATED_SUMMARY_CHARACTERS = 600
+
+
+@dataclass
+class CompactionReport:
+    """
+    Before/after numbers for one collection.
+    """
+    collection: str
+    documents_before: int = 0
+    documents_after: int = 0
+    characters_before: int = 0
+    characters_after: int = 0
+    duplicates_removed: int = 0
+    turns_rolled_up: int = 0
+    summaries_written: int = 0
+    query_ms_before: float = 0.0
+    query_ms_after: float = 0.0
+    dry_run: bool = False
+    elapsed: float = 0.0
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    def to_string(self) -> str:
+        remove, roll = ("would remove", "would roll") if self.dry_run else ("removed", "rolled")
+        estimate = "~" if self.dry_run and self.summaries_written else ""
+        return (f"{self.collection}: {self.documents_before} -> {self.documents_after} documents, "
+                f"{self.characters_before} -> {estimate}{self.characters_after} characters "
+                f"({remove} {self.duplicates_removed} duplicates, {roll} {self.turns_rolled_up} old turns into {self.summaries_written} summaries). "
+                f"Query {self.query_ms_before:.2f}ms -> {self.query_ms_after:.2f}ms, took {self.elapsed:.1f}s")
+
+
+def memory_time(document: str, metadata: dict = None) -> datetime:
+    """
+    When a memory was written, from its metadata if it has a timestamp, otherwise parsed from the turn document.
+
+    :returns: A datetime, or None if it can't be told.
+    """
+    if metadata and isinstance(metadata.get('timestamp'), (int, float)):
+        return datetime.fromtimestamp(metadata['timestamp'])
+    match = MEMORY_TIMESTAMP_PATTERN.search(document or "")
+    if match:
+        try:
+            return datetime.strptime(f"{match.group(1)} {match.group(2)}", '%Y-%m-%d %H:%M')
+        except ValueError:
+            return None
+    return None
+
+
+def near_duplicate_groups(embeddings: np.ndarray, threshold: float = 0.95, block_size: int = 1024) -> List[List[int]]:
+    """
+    Greedy clustering by cosine similarity. Rows are taken in order; a row within threshold of an already chosen representative joins that cluster, otherwise it becomes a representative itself. Rows are compared a block at a time against every representative so far, which keeps this a handful of matrix products even for large collections.
+
+    :param embeddings: One row per document, in order of preference for representative.
+    :param threshold: Cosine similarity at or above which two documents count as duplicates.
+    :param block_size: Rows compared per matrix product.
+    :returns: Clusters as lists of row numbers, each starting with its representative.
+    """
+    if not len(embeddings):
+        return []
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.where(norms == 0, 1, norms)
+
+    representatives = np.zeros((0, vectors.shape[1]), dtype=np.float32)
+    clusters: List[List[int]] = []
+    for start in range(0, len(vectors), block_size):
+        block = vectors[start:start + block_size]
+        known = block @ representatives.T
+        new_rows = []
+        for offset, vector in enumerate(block):
+            row = start + offset
+            best_cluster, best_similarity = -1, threshold
+            if known.shape[1]:
+                candidate = int(np.argmax(known[offset]))
+                if known[offset, candidate] >= best_similarity:
+                    best_cluster, best_similarity = candidate, known[offset, candidate]
+            # Representatives picked earlier in this block aren't in `known` yet
+            for cluster_index, new_row in new_rows:
+                similarity = float(vectors[new_row] @ vector)
+                if similarity >= best_similarity:
+                    best_cluster, best_similarity = cluster_index, similarity
+            if best_cluster >= 0:
+                clusters[best_cluster].append(row)
+            else:
+                clusters.append([row])
+                new_rows.append((len(clusters) - 1, row))
+        if new_rows:
+            representatives = np.vstack([representatives, vectors[[row for _, row in new_rows]]])
+    return clusters
+
+
+class MemoryCompactor:
+    """
+    Shrinks a memory collection. Near-duplicate memories (agent-to-agent chats fill both collections with near-identical mimicry after a dozen rounds) are clustered by embedding similarity and only the newest of each cluster is kept. Optionally, turns older than a number of days are rolled up, one day at a time, into summary documents written by the agent's model, and the originals are deleted. Summaries are stored with source 'summary' metadata and the time of their last turn, so build_prompt labels them and time filters still apply.
+
+    :param chroma_handler: Handler for the store.
+    :param threshold: Cosine similarity at or above which memories are duplicates.
+    :param summarizer: Callable taking a prompt and returning the summary text. Needed for rollups only.
+    :param turns_per_summary: Most turns folded into one summary.
+    :param latency_queries: How many sample queries the before/after latency is averaged over.
+    """
+    def __init__(self, chroma_handler: ChromaHandler, threshold: float = 0.95, summarizer: Callable[[str], str] = None, turns_per_summary: int = 20, latency_queries: int = 20) -> None:
+        self.chroma_handler = chroma_handler
+        self.threshold = threshold
+        self.summarizer = summarizer
+        self.turns_per_summary = turns_per_summary
+        self.latency_queries = latency_queries
+
+    def load(self, collection) -> Dict[str, list]:
+        records = {'ids': [], 'documents': [], 'metadatas': [], 'embeddings': []}
+        offset = 0
+        while True:
+            page = collection.get(include=['documents', 'metadatas', 'embeddings'], limit=5000, offset=offset)
+            if not page['ids']:
+                break
+            records['ids'].extend(page['ids'])
+            records['documents'].extend(page['documents'])
+            records['metadatas'].extend(page['metadatas'] or [None] * len(page['ids']))
+            records['embeddings'].extend(page['embeddings'])
+            offset += len(page['ids'])
+        return records
+
+    def time_queries(self, collection, queries: List[str]) -> float:
+        """
+        Mean milliseconds per query. The query embeddings come out of the embedding cache after the first pass, so this is mostly the store's own time.
+        """
+        if not queries:
+            return 0.0
+        started = time.perf_counter()
+        for query in queries:
+            self.chroma_handler.chroma_query_collection(collection, query, 5)
+        return (time.perf_counter() - started) * 1000 / len(queries)
+
+    def compact(self, collection_name: str, older_than_days: int = None, dry_run: bool = False) -> CompactionReport:
+        """
+        Compact one collection.
+
+        :param collection_name: The collection.
+        :param older_than_days: Roll up turns older than this many days. None skips the rollup.
+        :param dry_run: Work out and report the changes without writing anything. The summarizer isn't called, the size of the summaries is estimated.
+        :returns: The CompactionReport.
+        """
+        started = time.perf_counter()
+        report = CompactionReport(collection=collection_name, dry_run=dry_run)
+        # Queued turns would otherwise land after compaction and never be considered
+        self.chroma_handler.chroma_flush_memories()
+        collection = self.chroma_handler.chroma_get_collection(collection_name)
+        records = self.load(collection)
+        count = len(records['ids'])
+        report.documents_before = report.documents_after = count
+        report.characters_before = report.characters_after = sum(len(document or "") for document in records['documents'])
+        if not count:
+            report.elapsed = time.perf_counter() - started
+            return report
+
+        queries = random.Random(0).sample(records['documents'], min(self.latency_queries, count))
+        self.time_queries(collection, queries)  # warm the embedding cache so both timings measure the same thing
+        report.query_ms_before = self.time_queries(collection, queries)
+
+        times = [memory_time(document, metadata) for document, metadata in zip(records['documents'], records['metadatas'])]
+        # Newest first, so the newest of each cluster is its representative
+        order = sorted(range(count), key=lambda row: times[row] or datetime.min, reverse=True)
+        clusters = near_duplicate_groups(np.asarray(records['embeddings'])[order], self.threshold)
+        duplicates = [order[row] for cluster in clusters for row in cluster[1:]]
+        report.duplicates_removed = len(duplicates)
+        removed = set(duplicates)
+
+        summaries, summary_characters = [], 0
+        if older_than_days is not None:
+            summaries, rolled = self.roll_up(records, times, removed, datetime.now() - timedelta(days=older_than_days), dry_run=dry_run)
+            report.turns_rolled_up = len(rolled)
+            report.summaries_written = len(summaries)
+            removed.update(rolled)
+            if dry_run:
+                summary_characters = sum(min(ESTIMATED_SUMMARY_CHARACTERS, group['characters']) for group in summaries)
+            else:
+                summary_characters = sum(len(summary['document']) for summary in summaries)
+
+        report.documents_after = count - len(removed) + len(summaries)
+        report.characters_after = (report.characters_before
+                                   - sum(len(records['documents'][row] or "") for row in removed)
+                                   + summary_characters)
+        if dry_run:
+            report.query_ms_after = report.query_ms_before
+            report.elapsed = time.perf_counter() - started
+            return report
+
+        if summaries:
+            self.chroma_handler.chroma_upsert_to_collection(collection,
+                                                            [summary['document'] for summary in summaries],
+                                                            [summary['metadata'] for summary in summaries],
+                                                            [summary['id'] for summary in summaries])
+        removed_ids = [records['ids'][row] for row in removed]
+        for start in range(0, len(removed_ids), 5000):
+            collection.delete(ids=removed_ids[start:start + 5000])
+        # Drops the cached handle and its BM25 index, which still has the deleted documents
+        self.chroma_handler.collection_cache.invalidate(collection_name)
+        collection = self.chroma_handler.chroma_get_collection(collection_name)
+        report.query_ms_after = self.time_queries(collection, queries)
+        report.elapsed = time.perf_counter() - started
+        return report
+
+    def roll_up(self, records: Dict[str, list], times: List[datetime], removed: set, cutoff: datetime, dry_run: bool = False) -> tuple:
+        """
+        Summarise chat turns written before cutoff, a day (and at most turns_per_summary turns) per summary. Earlier summaries, knowledge base chunks, commands and undated documents are left alone, and a group whose summary fails keeps its turns.
+
+        :param dry_run: Only group the turns, without calling the summarizer.
+        :returns: (summaries, rows rolled up) where each summary is a dict of id, document and metadata. With dry_run, one dict of day, turns and characters per group that would be summarised instead.
+        """
+        if self.summarizer is None and not dry_run:
+            raise ValueError("Rolling up old turns needs a summarizer")
+        days: Dict[str, List[int]] = {}
+        for row, moment in enumerate(times):
+            metadata = records['metadatas'][row] or {}
+            if row in removed or moment is None or moment >= cutoff or metadata.get('source') in ('summary', 'kb', 'command'):
+                continue
+            days.setdefault(moment.strftime('%Y-%m-%d'), []).append(row)
+
+        summaries, rolled = [], []
+        for day, rows in sorted(days.items()):
+            rows.sort(key=lambda row: times[row])
+            for start in range(0, len(rows), self.turns_per_summary):
+                group = rows[start:start + self.turns_per_summary]
+                turns = "\n\n".join(records['documents'][row] for row in group)
+                if dry_run:
+                    summaries.append({'day': day, 'turns': len(group), 'characters': sum(len(records['documents'][row]) for row in group)})
+                    rolled.extend(group)
+                    continue
+                try:
+                    summary = self.summarizer(SUMMARY_PROMPT.format(date=day, turns=turns))
+                except Exception as e:
+                    print(f"Error summarising turns from {day}: {e}")
+                    summary = None
+                if not summary:
+                    continue
+                summaries.append({
+                    'id': f"summary-{day}-{hashlib.sha256(turns.encode('utf-8')).hexdigest()[:16]}",
+                    'document': summary.strip(),
+                    'metadata': {'source': 'summary', 'turns': len(group), 'timestamp': times[group[-1]].timestamp()},
+                })
+                rolled.extend(group)
+        return summaries, rolled
+
+
+def agent_summarizer(agent_name: str) -> Callable[[str], str]:
+    """
+    Summarise with an agent's own model and params.
+    """
+    from runtime import agent_runtime
+    agent = agent_runtime.new_agent(agent_name)
+    return agent.generate_response
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deduplicate memory collections and roll old turns up into summaries.")
+    parser.add_argument('collections', nargs='+', help="Collection names, e.g. sherlock-juliet")
+    parser.add_argument('--threshold', type=float, default=0.95, help="Cosine similarity at which memories count as duplicates")
+    parser.add_argument('--older-than', type=int, default=None, metavar='DAYS', help="Roll turns older than DAYS into summaries")
+    parser.add_argument('--agent', default=None, help="Agent whose model writes the summaries (default: the collection name up to the first '-')")
+    parser.add_argument('--turns-per-summary', type=int, default=20)
+    parser.add_argument('--dry-run', action='store_true', help="Report what would change without writing")
+    args = parser.parse_args()
+
+    chroma_handler = ChromaHandler()
+    for name in args.collections:
+        summarizer = None
+        if args.older_than is not None and not args.dry_run:
+            summarizer = agent_summarizer(args.agent or name.split('-')[0])
+        compactor = MemoryCompactor(chroma_handler, threshold=args.threshold, summarizer=summarizer, turns_per_summary=args.turns_per_summary)
+        try:
+            print(compactor.compact(name, older_than_days=args.older_than, dry_run=args.dry_run).to_string())
+        except Exception as e:
+            print(f"Error compacting {name}: {e}")
+
+
+if __name__ == '__main__':
+    main()
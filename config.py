@@ -1,4 +1,6 @@
 from dataclasses import dataclass, asdict, field
+import hashlib
+import json
 from pathlib import Path
 import yaml
 import os
@@ -25,6 +27,7 @@ class ModelInstructions:
     chat_start_token: str = None
     chat_end_token: str = None
     completions_url: str = None
+    prompt_layout: str = None
 
     def __init__(self, method: str, assistant_name: str = None) -> None:
         """
@@ -113,6 +116,21 @@ class ModelInstructions:
         """
         return asdict(self)
     
+    def __setattr__(self, key, value) -> None:
+        # Any field change (update_model_instructions, !focus, yaml load) invalidates the memoised fingerprint
+        self.__dict__['_fingerprint'] = None
+        super().__setattr__(key, value)
+
+    def fingerprint(self) -> str:
+        """
+        Stable hash of the instructions. Anything that caches work derived from the instructions (prompt templates, Ollama session contexts) keys on this so an edit invalidates it. Memoised until the next field assignment.
+
+        :returns: Hex digest of the instructions fields.
+        """
+        if self.__dict__.get('_fingerprint') is None:
+            self.__dict__['_fingerprint'] = hashlib.sha1(json.dumps(self.to_dict(), sort_keys=True, default=str).encode('utf-8')).hexdigest()
+        return self.__dict__['_fingerprint']
+
     def print_model_instructions(self) -> None:
         """
         Print the config to the terminal.
@@ -121,12 +139,33 @@ class ModelInstructions:
         """
         print(f"Agent Configuration:\n{self.to_dict()}")
     
-    def to_prompt_script(self) -> str:
+    def to_prompt_script(self, layout: str = None) -> str:
         """
-        Export config class to a base dict
+        Render the instructions into the prompt template. Two layouts are available:
 
-        :returns: Base dictionary for the config class.
-        """
+        classic: system, intro, focus, memories, history, user input. Memories change every turn and sit near the top, so consecutive prompts diverge early.
+        prefix_stable: system and intro, then the append-only history, with the volatile parts (memories, focus, user input) at the tail. Consecutive prompts share everything up to the end of the history, which is what lets Ollama/llama.cpp reuse its prompt cache. Once the history is full it is trimmed history_block turns at a time (see ParamsConfig), so that prefix holds for several turns rather than breaking every time the oldest turn is dropped.
+
+        :param layout: 'classic' or 'prefix_stable'. Defaults to the prompt_layout field, then classic.
+        :returns: The prompt template with $context, $history, $username and $user_input placeholders.
+        """
+        layout = layout or self.prompt_layout or 'classic'
+        if layout == 'prefix_stable':
+            return (
+                f"{self.start_token}System: \n"
+                f"{self.system_message}{self.end_token}\n"
+                f"{self.start_token}Assistant: \n"
+                f"{self.assistant_intro}{self.end_token}\n"
+                f"Chat History: \n"
+                f"$history\n"
+                f"{self.mem_start_token}Context from memory: "
+                f"$context{self.mem_end_token}\n"
+                f"{self.start_token}User: \n"
+                f"Your current focus should be: {self.assistant_focus}{self.end_token}\n"
+                f"{self.start_token}$username: \n"
+                f"$user_input{self.end_token}\n"
+                f"{self.start_token}{self.name}: \n"
+            )
         return (
             f"{self.start_token}System: \n"
             f"{self.system_message}{self.end_token}\n"
@@ -192,7 +231,7 @@ class ModelInstructions:
 @dataclass
 class ParamsConfig:
     """
-    Agent configuration dataclass for tweaking completion parameters. More are available through Ollama's API, I will build this out to cover it all eventually. Parameter definitions from Ollama and their defaults values are given in params. Class field defaults are values that I have found to work well for my use cases.
+    Agent configuration dataclass for tweaking completion parameters. More are available through Ollama's API, I will build this out to cover it all eventually. Parameter definitions from Ollama and their defaults values are given in params. Class field defaults are values that I have found to work well for my use cases. The memory_* retrieval options default to plain vector recall here and in agent-templates/params_config.yaml alike, hybrid search and re-ranking are opt-in per agent.
 
     :param temperature: The temperature of the model. Increasing the temperature will make the model answer more creatively. (Default: 0.8)
     :param num_ctx: Sets the size of the context window used to generate the next token. (Default: 4096)
@@ -201,7 +240,7 @@ class ParamsConfig:
     :param top_k: Reduces the probability of generating nonsense. A higher value (e.g. 100) will give more diverse answers, while a lower value (e.g. 10) will be more conservative. (Default: 40)
     :param top_p: Works together with top-k. A higher value (e.g., 0.95) will lead to more diverse text, while a lower value (e.g., 0.5) will generate more focused and conservative text. (Default: 0.9)
     :param num_predict: The number of tokens to generate. (Default: 128)
-    :param seed: The seed to use for random number generation. (Default: 0)
+    :param seed: The seed to use for random number generation. Only sent when set, which makes sampling reproducible. (Default: unset, a fresh seed per request)
     :param mirostat: Enables the Mirostat algorithm. (Default: 0)
     :param mirostat_eta: The learning rate for the Mirostat algorithm. (Default: 0.1)
     :param mirostat_tau: The temperature for the Mirostat algorithm. (Default: 5.0)
@@ -211,6 +250,19 @@ class ParamsConfig:
     :param start_token: The token to use to start the prompt.
     :param end_token: The token to use to end the prompt.
     :param tfs_z: The number of tokens to use for the TFS-Z algorithm. (Default: 0)
+    :param keep_alive: How long Ollama keeps the model loaded after a request, e.g. '5m', '1h' or -1 for forever. (Default: 5m)
+    :param context_share: Share of num_ctx the prompt may fill; history and memories are packed to fit, the rest is left for the reply. (Default: 0.75)
+    :param history_turns: Number of chat turns kept as candidates for the prompt's history. (Default: 20)
+    :param history_block: With the prefix_stable layout, old history turns are dropped this many at a time, so the prompt prefix Ollama can reuse stays the same for up to this many turns once history_turns or the budget is reached. Up to history_block - 1 fewer turns are sent in exchange. Capped at half of history_turns. (Default: 4)
+    :param memory_results: Number of Chroma memories retrieved as candidates for the prompt. (Default: 5)
+    :param incremental: Reuse the model's context from the previous turn (and the previous session) instead of re-sending the whole history every turn. A full prompt is still sent when the model or instructions change or the context window fills up. (Default: False)
+    :param cache_responses: Serve repeated prompts from the response cache when sampling is deterministic (temperature 0, or a fixed seed). (Default: False)
+    :param memory_search: How memories are retrieved: 'vector' (embedding similarity) or 'hybrid' (embeddings + BM25 fused with reciprocal rank fusion). (Default: vector)
+    :param memory_max_age_days: Only recall memories from the last this many days. Memories stored before turns had metadata are left out when this is set. (Default: no limit)
+    :param memory_rerank: Re-rank memory candidates before injecting them: drop the ones further than memory_max_distance and pick the rest by maximal marginal relevance, so near-duplicates and weak matches don't cost prompt tokens. Fewer than memory_results may be injected. (Default: False)
+    :param memory_max_distance: Squared L2 distance above which a candidate is dropped when re-ranking. For the default normalised embeddings 1.4 is roughly cosine similarity 0.3. (Default: no cutoff)
+    :param max_numpy_documents: The agent's memory collections stay in the in-memory NumPy tier up to this many memories and are moved into Chroma after that, 0 keeps them in Chroma. (Default: $CHAT3J_MAX_NUMPY_DOCUMENTS or 5000)
+    :param memory_mmr_lambda: Relevance vs diversity when re-ranking, 1 is pure relevance. (Default: 0.7)
     :creates: Param config object for the agent.
     """
     temperature: float = None
@@ -226,6 +278,19 @@ class ParamsConfig:
     mirostat_tau: float = None
     repeat_last_n: int = None
     tfs_z: int = None
+    keep_alive: str = None
+    context_share: float = None
+    history_turns: int = None
+    history_block: int = None
+    memory_results: int = None
+    incremental: bool = None
+    cache_responses: bool = None
+    memory_search: str = None
+    memory_max_age_days: float = None
+    memory_rerank: bool = None
+    memory_max_distance: float = None
+    memory_mmr_lambda: float = None
+    max_numpy_documents: int = None
     assistant_name: str = None
 
     def __init__(self, method: str, assistant_name: str) -> None:
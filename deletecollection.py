@@ -4,5 +4,5 @@ from sys import argv
 
 def main():
     agent_name = argv[1]
-    ChromaHandler.chroma_delete_collection(agent_name)
+    ChromaHandler().chroma_delete_collection(agent_name)
     print(f"Deleted collection for {agent_name}.")
\ No newline at end of file
@@ -0,0 +1,202 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+import hashlib
+import json
+import os
+from pathlib import Path
+import re
+import threading
+from typing import Dict, List
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: appends are only safe from one process at a time
+    fcntl = None
+
+
+@dataclass
+class EmbeddingCacheStats:
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        data['hit_rate'] = self.hit_rate
+        return data
+
+    def to_string(self) -> str:
+        return (f"Embedding cache: {self.hit_rate:.0%} hit rate "
+                f"({self.memory_hits} memory, {self.disk_hits} disk, {self.misses} embedded)")
+
+
+class CachedEmbeddingFunction:
+    """
+    Content-addressed cache in front of an embedding function. The same text always embeds to the same vector under the same model, so a turn upserted into two collections, a query repeated across turns or a re-ingested corpus only pays for the embedding once. Vectors are looked up by sha256 of the text in an in-memory LRU, then in an on-disk store: one float32 matrix per model, memory-mapped, plus an append-only index of (hash, row) lines. Appends hold an exclusive flock on the store's lock file so several processes can share it. Called like the function it wraps.
+
+    :param embedding_function: The real embedding function.
+    :param model_id: The model's name, the disk store is kept per model so vectors never mix.
+    :param path: Root directory for the disk stores.
+    :param max_memory_entries: Vectors kept in the LRU.
+    """
+    def __init__(self, embedding_function, model_id: str, path: str = 'library/embedding_cache', max_memory_entries: int = 10000) -> None:
+        self.embedding_function = embedding_function
+        self.model_id = model_id
+        self.max_memory_entries = max_memory_entries
+        self.stats = EmbeddingCacheStats()
+        self.directory = Path(path) / re.sub(r'[^A-Za-z0-9._-]+', '_', model_id)
+        self.vectors_path = self.directory / 'vectors.f32'
+        self.index_path = self.directory / 'index.txt'
+        self.meta_path = self.directory / 'meta.json'
+        self.lock_path = self.directory / 'lock'
+        self._memory = OrderedDict()
+        self._rows: Dict[str, int] = {}
+        self._dim = None
+        self._matrix = None
+        self._lock = threading.Lock()
+        self._load_index()
+
+    @contextmanager
+    def _file_lock(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with open(self.lock_path, 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            # Released when the file is closed
+            yield
+
+    def _trim_tail(self, vectors_file) -> int:
+        """
+        Cut off a partial row left by a crash mid-append, so every later row lands where the index says it is. Caller holds the file lock.
+
+        :returns: Number of whole rows in the file.
+        """
+        row_bytes = self._dim * 4
+        size = vectors_file.seek(0, os.SEEK_END)
+        if size % row_bytes:
+            vectors_file.truncate(size - size % row_bytes)
+        return size // row_bytes
+
+    def _load_index(self) -> None:
+        if not self.meta_path.exists():
+            return
+        try:
+            with self._file_lock():
+                with open(self.meta_path, 'r') as f:
+                    self._dim = json.load(f)['dim']
+                with open(self.vectors_path, 'ab') as vectors_file:
+                    stored_rows = self._trim_tail(vectors_file)
+                with open(self.index_path, 'r') as f:
+                    for line in f:
+                        key, _, row = line.strip().partition(' ')
+                        # Index lines are written after their vector, but a crash can still leave a torn last line
+                        if row.isdigit() and int(row) < stored_rows:
+                            self._rows[key] = int(row)
+        except (OSError, ValueError, KeyError):
+            self._rows = {}
+
+    @staticmethod
+    def key_for(text: str) -> str:
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def _read_row(self, row: int) -> np.ndarray:
+        if self._matrix is None or row >= self._matrix.shape[0]:
+            # The file has grown since it was mapped
+            rows = os.path.getsize(self.vectors_path) // (self._dim * 4)
+            self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(rows, self._dim))
+        return np.array(self._matrix[row])
+
+    def _remember(self, key: str, vector: np.ndarray) -> None:
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _store(self, new_vectors: Dict[str, np.ndarray]) -> None:
+        try:
+            with self._file_lock():
+                if self._dim is None:
+                    # Another process may have started the store since this one loaded
+                    if self.meta_path.exists():
+                        with open(self.meta_path, 'r') as f:
+                            self._dim = json.load(f)['dim']
+                    else:
+                        self._dim = len(next(iter(new_vectors.values())))
+                        with open(self.meta_path, 'w') as f:
+                            json.dump({'model_id': self.model_id, 'dim': self._dim}, f)
+                with open(self.vectors_path, 'ab') as vectors_file:
+                    # Rows are numbered from the file's size under the lock, so concurrent appends never share one
+                    row = self._trim_tail(vectors_file)
+                    keys = []
+                    for key, vector in new_vectors.items():
+                        if vector.shape[0] != self._dim:
+                            continue
+                        vectors_file.write(vector.astype(np.float32).tobytes())
+                        keys.append((key, row))
+                        row += 1
+                with open(self.index_path, 'a') as index_file:
+                    index_file.writelines(f"{key} {row}\n" for key, row in keys)
+            self._rows.update(keys)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Error writing embedding cache: {e}")
+
+    def __call__(self, input: List[str]) -> list:
+        texts = [input] if isinstance(input, str) else list(input)
+        keys = [self.key_for(text) for text in texts]
+        vectors = [None] * len(texts)
+        missing = OrderedDict()
+
+        with self._lock:
+            for index, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    self.stats.memory_hits += 1
+                elif key in self._rows:
+                    vector = self._read_row(self._rows[key])
+                    self._remember(key, vector)
+                    self.stats.disk_hits += 1
+                else:
+                    missing.setdefault(key, texts[index])
+                    self.stats.misses += 1
+                    continue
+                vectors[index] = vector
+
+        if missing:
+            computed = self.embedding_function(list(missing.values()))
+            new_vectors = {key: np.asarray(vector, dtype=np.float32) for key, vector in zip(missing, computed)}
+            with self._lock:
+                for key, vector in new_vectors.items():
+                    self._remember(key, vector)
+                self._store({key: vector for key, vector in new_vectors.items() if key not in self._rows})
+            for index, key in enumerate(keys):
+                if vectors[index] is None:
+                    vectors[index] = new_vectors[key]
+
+        return vectors
+
+
+_embedding_caches = {}
+_embedding_caches_lock = threading.Lock()
+
+
+def get_embedding_cache(embedding_function, model_id: str) -> CachedEmbeddingFunction:
+    """
+    The process-wide cache for a model, so every handler and call path shares its hits.
+
+    :param embedding_function: The real embedding function (only used the first time a model is seen).
+    :param model_id: The model's name, see chroma.embedding_model_id.
+    """
+    with _embedding_caches_lock:
+        cache = _embedding_caches.get(model_id)
+        if cache is None:
+            cache = _embedding_caches[model_id] = CachedEmbeddingFunction(embedding_function, model_id)
+        return cache
@@ -0,0 +1,274 @@
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+import hashlib
+import json
+import os
+from pathlib import Path
+import time
+from typing import Iterator, List, Tuple
+from chroma import ChromaHandler
+
+
+MANIFEST_NAME = '.ingest_manifest.json'
+
+
+@dataclass
+class IngestReport:
+    """
+    Totals for an ingestion run. chunks_seen counts the chunks this run processed, chunks_resumed the ones an interrupted run had already stored and this one read past.
+    """
+    files: int = 0
+    files_skipped: int = 0
+    chunks_seen: int = 0
+    chunks_resumed: int = 0
+    chunks_existing: int = 0
+    chunks_written: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def chunks_per_second(self) -> float:
+        return self.chunks_seen / self.elapsed if self.elapsed else 0.0
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        data['chunks_per_second'] = self.chunks_per_second
+        return data
+
+    def to_string(self) -> str:
+        return (f"Ingested {self.files} files ({self.files_skipped} unchanged): {self.chunks_seen} chunks ({self.chunks_resumed} more resumed past), "
+                f"{self.chunks_written} written, {self.chunks_existing} already stored, "
+                f"{self.elapsed:.1f}s ({self.chunks_per_second:.1f} chunks/s)")
+
+
+def chunk_id(chunk: str) -> str:
+    """
+    Content hash used as the chunk's id, so ingesting the same text twice upserts the same record instead of duplicating it.
+    """
+    return hashlib.sha256(chunk.encode('utf-8')).hexdigest()
+
+
+def iter_file_chunks(path: Path, chunk_words: int = 200, overlap: int = 50) -> Iterator[str]:
+    """
+    Stream a text file as overlapping windows of chunk_words words, each starting chunk_words - overlap words after the last, without reading the whole file into memory. Unlike split_corpus_into_chunks, a shorter last window is only emitted if it has words the previous chunk didn't cover, so the tail of a file isn't stored again as a chunk of its own.
+
+    :param path: The file to read.
+    :param chunk_words: Words per chunk.
+    :param overlap: Words shared between consecutive chunks.
+    """
+    step = max(1, chunk_words - overlap)
+    words = []
+    covered = 0  # leading words of the buffer that are already part of an emitted chunk
+    with open(path, 'r', encoding='utf-8', errors='replace') as file:
+        for line in file:
+            words.extend(line.split())
+            while len(words) >= chunk_words:
+                yield ' '.join(words[:chunk_words])
+                words = words[step:]
+                covered = chunk_words - step
+    if len(words) > covered:
+        yield ' '.join(words)
+
+
+class CorpusIngestor:
+    """
+    Streams text files into a Chroma collection. Files are chunked as they are read, each chunk gets its content hash as id, and chunks already in the collection are skipped before anything is embedded. Embedding runs in batches on a worker pool while the next batch is being read, and the results are written with large upserts. A manifest next to the knowledge base records how far each file got, so an interrupted multi-GB run resumes where it stopped and unchanged files are skipped outright.
+
+    :param chroma_handler: Handler for the store and embedding function.
+    :param collection_name: The collection to ingest into.
+    :param embed_batch_size: Chunks per embedding call.
+    :param upsert_batch_size: Chunks per collection.upsert (capped by the client's max batch size).
+    :param workers: Embedding threads.
+    :param chunk_words: Words per chunk.
+    :param overlap: Words shared between consecutive chunks.
+    """
+    def __init__(self, chroma_handler: ChromaHandler, collection_name: str, embed_batch_size: int = 64, upsert_batch_size: int = 1024, workers: int = 4, chunk_words: int = 200, overlap: int = 50) -> None:
+        self.chroma_handler = chroma_handler
+        self.collection = chroma_handler.chroma_get_or_create_collection(collection_name)
+        self.embed_batch_size = embed_batch_size
+        try:
+            upsert_batch_size = min(upsert_batch_size, chroma_handler.chroma.get_max_batch_size())
+        except Exception:
+            pass
+        self.upsert_batch_size = upsert_batch_size
+        self.workers = workers
+        self.chunk_words = chunk_words
+        self.overlap = overlap
+        self.report = IngestReport()
+
+    @staticmethod
+    def load_manifest(manifest_path: Path) -> dict:
+        try:
+            with open(manifest_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def save_manifest(manifest_path: Path, manifest: dict) -> None:
+        # Write then rename so a crash mid-write never leaves a torn manifest
+        tmp_path = manifest_path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, manifest_path)
+
+    def existing_ids(self, ids: List[str]) -> set:
+        return set(self.collection.get(ids=ids, include=[])['ids'])
+
+    def embed(self, batch: List[Tuple[str, str, dict]]) -> Tuple[List[Tuple[str, str, dict]], list]:
+        return batch, self.chroma_handler.embedding_function([chunk for _, chunk, _ in batch])
+
+    def ingest_paths(self, paths: List[Path], manifest_path: Path = None) -> IngestReport:
+        """
+        Ingest files and directories (recursively). Hidden files and the manifest itself are ignored.
+
+        :param paths: Files or directories to ingest.
+        :param manifest_path: Where progress is recorded. None disables resume.
+        :returns: The IngestReport for the run.
+        """
+        started = time.perf_counter()
+        manifest = self.load_manifest(manifest_path) if manifest_path else {}
+        for path in paths:
+            path = Path(path)
+            files = sorted(p for p in path.rglob('*') if p.is_file()) if path.is_dir() else [path]
+            for file_path in files:
+                if any(part.startswith('.') for part in file_path.relative_to(path if path.is_dir() else path.parent).parts):
+                    continue
+                self.ingest_file(file_path, manifest, manifest_path)
+        self.report.elapsed = time.perf_counter() - started
+        return self.report
+
+    def ingest_file(self, file_path: Path, manifest: dict = None, manifest_path: Path = None) -> None:
+        """
+        Ingest one file, resuming from the manifest if it was partly done and hasn't changed since.
+
+        :param file_path: The file to ingest.
+        :param manifest: Progress records, updated in place.
+        :param manifest_path: Where to save the manifest after each upsert.
+        """
+        manifest = manifest if manifest is not None else {}
+        file_path = Path(file_path)
+        stat = file_path.stat()
+        key = str(file_path)
+        record = manifest.get(key)
+        if record is None or record.get('size') != stat.st_size or record.get('mtime') != stat.st_mtime:
+            record = manifest[key] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'chunks_done': 0, 'complete': False}
+        if record['complete']:
+            self.report.files_skipped += 1
+            return
+        self.report.files += 1
+        resume_from = record['chunks_done']
+
+        def commit(batch_chunks: list, embeddings: list, through: int) -> None:
+            # The same text can come up twice before either copy is stored, and one upsert can't repeat an id
+            unique = {}
+            for (id, chunk, metadata), embedding in zip(batch_chunks, embeddings):
+                unique.setdefault(id, (chunk, metadata, embedding))
+            self.report.chunks_existing += len(batch_chunks) - len(unique)
+            if unique:
+                self.collection.upsert(
+                    ids=list(unique),
+                    documents=[chunk for chunk, _, _ in unique.values()],
+                    metadatas=[metadata for _, metadata, _ in unique.values()],
+                    embeddings=[embedding for _, _, embedding in unique.values()],
+                )
+                self.chroma_handler.lexical_note(self.collection, list(unique), [chunk for chunk, _, _ in unique.values()])
+                self.report.chunks_written += len(unique)
+            record['chunks_done'] = through
+            if manifest_path:
+                self.save_manifest(manifest_path, manifest)
+
+        in_flight = deque()
+        pending_chunks, pending_embeddings = [], []
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='ingest') as executor:
+            def drain(limit: int) -> None:
+                # Futures complete in any order but are consumed in order, so chunks_done only ever covers chunks that are stored
+                while len(in_flight) > limit:
+                    future, through = in_flight.popleft()
+                    batch, embeddings = future.result()
+                    pending_chunks.extend(batch)
+                    pending_embeddings.extend(embeddings)
+                    if len(pending_chunks) >= self.upsert_batch_size:
+                        commit(pending_chunks, pending_embeddings, through)
+                        pending_chunks.clear()
+                        pending_embeddings.clear()
+
+            batch = []
+            index = 0
+            for index, chunk in enumerate(iter_file_chunks(file_path, self.chunk_words, self.overlap), start=1):
+                if index <= resume_from:
+                    self.report.chunks_resumed += 1
+                    continue
+                self.report.chunks_seen += 1
+                batch.append((chunk_id(chunk), chunk, {'source': 'kb', 'path': str(file_path), 'chunk': index, 'timestamp': time.time()}))
+                if len(batch) >= self.embed_batch_size:
+                    self.submit(executor, in_flight, batch, index)
+                    batch = []
+                    drain(self.workers * 2)
+            if batch:
+                self.submit(executor, in_flight, batch, index)
+            drain(0)
+        commit(pending_chunks, pending_embeddings, index)
+        record['complete'] = True
+        if manifest_path:
+            self.save_manifest(manifest_path, manifest)
+
+    def submit(self, executor: ThreadPoolExecutor, in_flight: deque, batch: list, through: int) -> None:
+        """
+        Drop chunks the collection already has, then queue the rest for embedding.
+        """
+        existing = self.existing_ids(list({id for id, _, _ in batch}))
+        if existing:
+            self.report.chunks_existing += len(existing)
+            batch = [item for item in batch if item[0] not in existing]
+        in_flight.append((executor.submit(self.embed, batch) if batch else executor.submit(lambda: ([], [])), through))
+
+
+def knowledge_dir(agent_name: str) -> Path:
+    """
+    Where an agent's knowledge base files live.
+    """
+    return Path(f"agents/{agent_name.lower()}/knowledge")
+
+
+def ingest_agent_knowledge(agent_name: str, paths: List[str] = None, chroma_handler: ChromaHandler = None, **kwargs) -> IngestReport:
+    """
+    Ingest an agent's knowledge base into its '<agent>-kb' collection.
+
+    :param agent_name: The agent.
+    :param paths: Files or directories to ingest. Defaults to agents/<agent>/knowledge.
+    :param chroma_handler: Defaults to a new handler on the default store.
+    :returns: The IngestReport.
+    """
+    base = knowledge_dir(agent_name)
+    base.mkdir(parents=True, exist_ok=True)
+    ingestor = CorpusIngestor(chroma_handler or ChromaHandler(), f"{agent_name}-kb", **kwargs)
+    return ingestor.ingest_paths([Path(p) for p in paths] if paths else [base], manifest_path=base / MANIFEST_NAME)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest text files into an agent's knowledge base collection.")
+    parser.add_argument('agent', help="Agent name, the collection is '<agent>-kb'")
+    parser.add_argument('paths', nargs='*', help="Files or directories (default: agents/<agent>/knowledge)")
+    parser.add_argument('--embed-batch-size', type=int, default=64)
+    parser.add_argument('--upsert-batch-size', type=int, default=1024)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--chunk-words', type=int, default=200)
+    parser.add_argument('--overlap', type=int, default=50)
+    args = parser.parse_args()
+
+    chroma_handler = ChromaHandler()
+    report = ingest_agent_knowledge(args.agent, args.paths,
+                                    chroma_handler=chroma_handler,
+                                    embed_batch_size=args.embed_batch_size,
+                                    upsert_batch_size=args.upsert_batch_size,
+                                    workers=args.workers,
+                                    chunk_words=args.chunk_words,
+                                    overlap=args.overlap)
+    print(report.to_string())
+    print(chroma_handler.embedding_cache_report())
+
+
+if __name__ == '__main__':
+    main()
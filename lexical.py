@@ -0,0 +1,157 @@
+from collections import Counter
+import heapq
+import math
+import re
+import threading
+from typing import Dict, List, Tuple
+
+
+# Words, numbers and identifiers. Dotted/dashed names (config.yaml, utf-8) are kept whole as well as split into their parts
+TOKEN_PATTERN = re.compile(r"[A-Za-z0-9_]+(?:[.\-/:][A-Za-z0-9_]+)*")
+SEPARATOR_PATTERN = re.compile(r"[.\-/:]")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercased terms for the lexical index.
+
+    :param text: The text to tokenize.
+    :returns: A list of terms, compound identifiers followed by their parts.
+    """
+    terms = []
+    for match in TOKEN_PATTERN.finditer(text.lower()):
+        token = match.group(0)
+        terms.append(token)
+        if SEPARATOR_PATTERN.search(token):
+            terms.extend(part for part in SEPARATOR_PATTERN.split(token) if part)
+    return terms
+
+
+class BM25Index:
+    """
+    In-memory inverted index with BM25 scoring, kept next to a Chroma collection. Embedding similarity is fuzzy about exact names, ids and code identifiers; this catches them. Postings are per term so a query only touches documents containing its terms, and terms that appear in more than max_df of all documents are skipped at query time (their idf is near zero and they would make every query walk most of the collection).
+
+    The index is never persisted. Each process builds its own the first time a collection is searched, by paging through every document in it (see ChromaHandler.lexical_index), so that first hybrid query costs a full read of the collection. After that, only writes made through the same process keep it current.
+
+    :param k1: Term frequency saturation.
+    :param b: Length normalisation.
+    :param max_df: Skip query terms found in more than this share of documents.
+    """
+    def __init__(self, k1: float = 1.2, b: float = 0.75, max_df: float = 0.5) -> None:
+        self.k1 = k1
+        self.b = b
+        self.max_df = max_df
+        self.postings: Dict[str, Dict[int, int]] = {}
+        self.doc_ids: List[str] = []
+        self.doc_lengths: List[int] = []
+        self.doc_terms: List[tuple] = []
+        self.slots: Dict[str, int] = {}
+        self.free_slots: List[int] = []
+        self.total_length = 0
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    def add(self, id: str, text: str) -> None:
+        """
+        Index a document, replacing any earlier version with the same id.
+
+        :param id: The document id.
+        :param text: The document text.
+        """
+        counts = Counter(tokenize(text or ""))
+        with self._lock:
+            self._add(id, counts)
+
+    def add_many(self, ids: List[str], texts: List[str]) -> None:
+        """
+        Index a batch of documents under a single lock acquisition, for building an index from a whole collection.
+        """
+        batch = [(id, Counter(tokenize(text or ""))) for id, text in zip(ids, texts)]
+        with self._lock:
+            for id, counts in batch:
+                self._add(id, counts)
+
+    def _add(self, id: str, counts: Counter) -> None:
+        if id in self.slots:
+            self._remove(id)
+        length = sum(counts.values())
+        terms = tuple(counts)
+        if self.free_slots:
+            slot = self.free_slots.pop()
+            self.doc_ids[slot] = id
+            self.doc_lengths[slot] = length
+            self.doc_terms[slot] = terms
+        else:
+            slot = len(self.doc_ids)
+            self.doc_ids.append(id)
+            self.doc_lengths.append(length)
+            self.doc_terms.append(terms)
+        self.slots[id] = slot
+        self.total_length += length
+        postings = self.postings
+        for term, count in counts.items():
+            posting = postings.get(term)
+            if posting is None:
+                postings[term] = {slot: count}
+            else:
+                posting[slot] = count
+
+    def remove(self, id: str) -> None:
+        with self._lock:
+            if id in self.slots:
+                self._remove(id)
+
+    def _remove(self, id: str) -> None:
+        slot = self.slots.pop(id)
+        for term in self.doc_terms[slot]:
+            posting = self.postings[term]
+            del posting[slot]
+            if not posting:
+                del self.postings[term]
+        self.total_length -= self.doc_lengths[slot]
+        self.doc_ids[slot] = None
+        self.doc_lengths[slot] = 0
+        self.doc_terms[slot] = ()
+        self.free_slots.append(slot)
+
+    def search(self, query: str, n_results: int) -> List[Tuple[str, float]]:
+        """
+        Top documents for a query by BM25 score.
+
+        :param query: The query text.
+        :param n_results: How many to return.
+        :returns: (id, score) pairs, best first.
+        """
+        with self._lock:
+            total_docs = len(self.slots)
+            if not total_docs:
+                return []
+            average_length = self.total_length / total_docs or 1
+            scores: Dict[int, float] = {}
+            for term in set(tokenize(query)):
+                posting = self.postings.get(term)
+                if not posting or len(posting) > self.max_df * total_docs and total_docs > 10:
+                    continue
+                idf = math.log(1 + (total_docs - len(posting) + 0.5) / (len(posting) + 0.5))
+                for slot, frequency in posting.items():
+                    norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[slot] / average_length)
+                    scores[slot] = scores.get(slot, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+            best = heapq.nlargest(n_results, scores.items(), key=lambda item: item[1])
+            return [(self.doc_ids[slot], score) for slot, score in best]
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """
+    Fuse several rankings of ids into one. Each id scores sum(1 / (k + rank)) over the rankings it appears in, so agreement between rankings beats a single high rank, and no score calibration between BM25 and distances is needed.
+
+    :param rankings: Lists of ids, best first.
+    :param k: Damping constant, 60 is the usual choice.
+    :returns: (id, fused score) pairs, best first.
+    """
+    fused: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, id in enumerate(ranking, start=1):
+            fused[id] = fused.get(id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
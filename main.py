@@ -1,10 +1,13 @@
+from collections import defaultdict
+import os
+import subprocess
 import sys
 import cmd2
-from chat_cli import ChatApp
-from agent_library_cli import AgentsLibCli
-from ollama_cli import OllamaApp
-from utilities import stream_agent_response, stream_disco_def, print_main_banner, print_dev_stamp
-from agents import Agent
+from utilities import stream_disco_def, print_main_banner, print_dev_stamp
+
+
+# Time-to-menu target for `python main.py --startup-profile`, in milliseconds
+STARTUP_BUDGET_MS = 500
 
 
 def print_main_menu():
@@ -47,22 +50,25 @@ class Main(cmd2.Cmd):
 
     """
     prompt = "3J:Moonbase> "
-    intro = main_intro()
 
+    # The submenus pull in chromadb, nltk, bs4 and friends, so they are only imported once picked
     def do_1(self, line):
         print("Entering chat lobby...")
+        from chat_cli import ChatApp
         chat_app = ChatApp()
         chat_app.cmdloop()
         child_break_banner()
     
     def do_2(self, line):
         print("Entering agents library...")
+        from agent_library_cli import AgentsLibCli
         agents_app = AgentsLibCli()
         agents_app.cmdloop()
         child_break_banner()
     
     def do_3(self, line):
         print("Entering Ollama library...")
+        from ollama_cli import OllamaApp
         ollama_app = OllamaApp()
         ollama_app.cmdloop()
         child_break_banner()
@@ -96,6 +102,38 @@ class Main(cmd2.Cmd):
         print_main_menu()
         intro = "Welcome to Base Chat by 3Juliet! Type ? for help"
 
+
+def profile_startup(top: int = 15) -> bool:
+    """
+    Import main in a fresh interpreter with -X importtime and summarise where the time to the main menu goes, grouped by top level package.
+
+    :param top: How many packages to list.
+    :returns: True if the import fits in STARTUP_BUDGET_MS.
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import main'], stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    self_us = defaultdict(int)
+    total_us = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        try:
+            own, cumulative, name = line[len('import time:'):].split('|')
+        except ValueError:
+            continue
+        package = name.strip().split('.')[0]
+        self_us[package] += int(own)
+        if name.strip() == 'main':
+            total_us = int(cumulative)
+
+    print(f"Startup profile: import main took {total_us / 1000:.1f}ms (budget {STARTUP_BUDGET_MS}ms)")
+    for package, micros in sorted(self_us.items(), key=lambda item: item[1], reverse=True)[:top]:
+        print(f"    {package:<24} {micros / 1000:8.1f}ms")
+    return total_us / 1000 <= STARTUP_BUDGET_MS
+
+
 if __name__ == '__main__':
+    if '--startup-profile' in sys.argv:
+        sys.exit(0 if profile_startup() else 1)
+    main_intro()
     app = Main()
     app.cmdloop()
@@ -1,8 +1,12 @@
 from dataclasses import dataclass, asdict, field
 from datetime import datetime
+import json
+from pathlib import Path
+import time
 from uuid import uuid4
 from typing import List
 from collections import deque
+from itertools import chain
 import yaml
 
 
@@ -63,6 +67,7 @@ class Turn:
     uuid: str
     request: Message
     response: Message
+    metrics: dict = None
 
     def dep_to_dict(self):
         """
@@ -82,6 +87,33 @@ class Turn:
         """
         return asdict(self)
 
+    def to_memory_document(self):
+        """
+        The text stored (and embedded) for this turn in memory. Who said what, one message per line; when and where it was said goes in to_memory_metadata.
+        """
+        return f"{self.request.speaker}: {self.request.content}\n{self.response.speaker}: {self.response.content}"
+
+    def to_memory_metadata(self, conversation: str, turn_index: int, source: str = 'chat') -> dict:
+        """
+        Structured metadata stored with the turn, so retrieval can filter on it and prompts can be formatted from it.
+
+        :param conversation: The conversation's uuid.
+        :param turn_index: Position of the turn in its conversation, from 0.
+        :param source: Where the memory came from ('chat', 'kb', 'command', 'summary').
+        :return: dict with conversation, speaker, role, responder, timestamp (epoch seconds), turn_index and source.
+        """
+        metadata = {
+            "conversation": conversation,
+            "speaker": self.request.speaker,
+            "role": self.request.role,
+            "responder": self.response.speaker,
+            "timestamp": time.time(),
+            "turn_index": turn_index,
+            "source": source,
+        }
+        # Chroma only takes str, int, float and bool values (the guest can be None when $USER isn't set)
+        return {key: value for key, value in metadata.items() if value is not None}
+
 
 @dataclass
 class Conversation:
@@ -129,16 +161,61 @@ class Conversation:
 class MessageCache:
     """
     This class manages the conversation history for inclusion in prompt context injection as a deque with structural
-    preservation on i/o
+    preservation on i/o. Each turn is rendered to its prompt strings once, when it is added, and kept in a parallel ring
+    that evicts together with the turn, so producing the history block for a prompt is a single join.
     """
 
-    def __init__(self, capacity, *args, **kwargs):
+    def __init__(self, capacity, start_token: str = None, end_token: str = None, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.capacity = capacity
+        self.start_token = start_token
+        self.end_token = end_token
         self.cache = deque(maxlen=capacity)
+        self.rendered = deque(maxlen=capacity)
+        # Every turn ever added, including the ones the deque has since evicted
+        self.turns_added = 0
+
+    def render_message(self, message: Message) -> str:
+        """
+        Render one message the way it appears in the prompt's chat history.
+
+        :param message: The Message to render.
+        :return: The prompt string, with blank lines collapsed like format_chat_history does.
+        """
+        rendered = f"{self.start_token}{message.speaker} ({message.timestamp}):\n{message.content}{self.end_token}\n"
+        return rendered.replace('\n\n', '\n')
 
     def add_message(self, turn: Turn):
         self.cache.append(turn)
+        self.rendered.append((self.render_message(turn.request), self.render_message(turn.response)))
+        self.turns_added += 1
+
+    def set_tokens(self, start_token: str, end_token: str) -> None:
+        """
+        Change the tokens turns are wrapped in. Only re-renders the ring when they actually differ, so it is cheap to call every turn.
+
+        :param start_token: The agent's start token.
+        :param end_token: The agent's end token.
+        """
+        if start_token == self.start_token and end_token == self.end_token:
+            return
+        self.start_token = start_token
+        self.end_token = end_token
+        self.rendered = deque(((self.render_message(turn.request), self.render_message(turn.response)) for turn in self.cache), maxlen=self.capacity)
+
+    def render_history(self) -> str:
+        """
+        The chat history block for the prompt.
+
+        :return: Every cached turn's pre-rendered request and response, joined.
+        """
+        return ''.join(chain.from_iterable(self.rendered))
+
+    def get_rendered_turns(self) -> list:
+        """
+        The pre-rendered turns, oldest first, as (request, response) string pairs.
+        """
+        return list(self.rendered)
 
     def get_message_cache(self):
         message_cache = list(self.cache)
@@ -149,11 +226,72 @@ class MessageCache:
         return message_cache
     
     def get_chat_history(self):
-        chat_history = []
-        for turn in self.cache:
-            chat_history.append(turn.request.to_prompt_message_string())
-            chat_history.append(turn.response.to_prompt_message_string())
-        return chat_history
+        return list(chain.from_iterable(self.rendered))
+
+
+@dataclass
+class SessionContext:
+    """
+    Ollama hands back a `context` token array with every /api/generate response, the ids of everything it evaluated for that turn. Keeping it per agent/user session lets the next turn send only the new request instead of re-prefilling the whole history. It is stored next to the agent's conversations so a resumed chat picks up where it left off. The model and an instructions fingerprint are kept with it so a stale context is never reused.
+    """
+    agent: str
+    username: str
+    llm_model: str = None
+    instructions_fingerprint: str = None
+    context: List[int] = field(default_factory=list)
+    memory_ids: List[str] = field(default_factory=list)
+    updated_at: str = None
+
+    @property
+    def path(self) -> Path:
+        return Path(f"agents/{self.agent.lower()}/contexts/{self.username}.json")
+
+    def to_dict(self):
+        return asdict(self)
+
+    def is_valid_for(self, llm_model: str, instructions_fingerprint: str) -> bool:
+        """
+        Whether this context can be extended for the given model and instructions.
+
+        :param llm_model: The model the next turn will run on.
+        :param instructions_fingerprint: ModelInstructions.fingerprint() of the agent's current instructions.
+        """
+        return bool(self.context) and self.llm_model == llm_model and self.instructions_fingerprint == instructions_fingerprint
+
+    def reset(self) -> None:
+        """
+        Drop the token context and the memories injected into it, forcing a full prompt rebuild next turn.
+        """
+        self.context = []
+        self.memory_ids = []
+
+    def save(self) -> None:
+        """
+        Write the session context to agents/{agent}/contexts/{username}.json.
+        """
+        self.updated_at = str(datetime.now().strftime('%Y-%m-%d @ %H:%M'))
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, 'w') as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, agent: str, username: str) -> 'SessionContext':
+        """
+        Load a persisted session context, or start an empty one if there is none (or it can't be read).
+
+        :param agent: The agent's name.
+        :param username: Who the agent is talking to.
+        :returns: SessionContext
+        """
+        session = cls(agent=agent, username=username)
+        if session.path.exists():
+            try:
+                with open(session.path, 'r') as f:
+                    data = json.load(f)
+                session = cls(**data)
+            except (ValueError, TypeError) as e:
+                print(f"Could not load session context from {session.path}, starting fresh: {e}")
+        return session
 
 
 def start_new_conversation(host: str, host_is_bot: bool, guest: str, guest_is_bot: bool) -> Conversation:
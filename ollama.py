@@ -1,6 +1,22 @@
-from dataclasses import dataclass
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+import functools
+import json
+import os
+import re
 import socket
 import subprocess
+import threading
+import time
+from typing import Iterator
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+
+
+DEFAULT_OLLAMA_URL = "http://localhost:11434"
+MODELFILE_INSTRUCTION = re.compile(r'^(FROM|PARAMETER|TEMPLATE|SYSTEM|LICENSE|ADAPTER)\s+(.*)$', re.IGNORECASE)
 
 
 @dataclass
@@ -66,51 +82,322 @@ class OllamaServer:
         raise ValueError(f"No available ports found in the range {start_port}-{end_port}")
 
 
+@dataclass
+class TransportStats:
+    """
+    Running counters for an OllamaTransport. Latency is wall time from sending the request to the last byte read, so streamed generations count their full duration.
+    """
+    requests: int = 0
+    failures: int = 0
+    retries: int = 0
+    bytes_sent: int = 0
+    bytes_received: int = 0
+    total_latency: float = 0.0
+    last_latency: float = None
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    def to_string(self) -> str:
+        mean = self.total_latency / self.requests if self.requests else 0.0
+        return (f"{self.requests} requests ({self.failures} failed, {self.retries} retries), "
+                f"{self.bytes_sent / 1024:.1f} KB sent, {self.bytes_received / 1024:.1f} KB received, {mean:.2f}s mean latency")
+
+
+class OllamaTransport:
+    """
+    Shared HTTP layer for everything that talks to an Ollama server. One pooled keep-alive session per endpoint, so a chat reuses the same TCP connection turn after turn instead of opening a new one per request. Connection errors are retried a bounded number of times with exponential backoff; read timeouts are not, since the server may still be generating.
+
+    :param base_url: Scheme, host and port of the Ollama server. (http://localhost:11434)
+    :param connect_timeout: Seconds to wait for the TCP connection.
+    :param read_timeout: Seconds to wait between bytes from the server. Big models on slow hardware need this to be generous.
+    :param max_retries: How many times a failed connection is retried before giving up.
+    :param backoff: Base delay in seconds between retries, doubled each attempt.
+    :param pool_size: Number of keep-alive connections kept for this endpoint. Also bounds how many async requests run at once.
+    """
+    def __init__(self, base_url: str = DEFAULT_OLLAMA_URL, connect_timeout: float = None, read_timeout: float = None, max_retries: int = 3, backoff: float = 0.5, pool_size: int = 10) -> None:
+        self.base_url = base_url.rstrip('/')
+        self.connect_timeout = connect_timeout if connect_timeout is not None else float(os.environ.get('OLLAMA_CONNECT_TIMEOUT', 3.05))
+        self.read_timeout = read_timeout if read_timeout is not None else float(os.environ.get('OLLAMA_READ_TIMEOUT', 300))
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.stats = TransportStats()
+        self._stats_lock = threading.Lock()
+
+        self.session = requests.Session()
+        self.session.headers.update({'Content-Type': 'application/json'})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='ollama')
+
+    def request(self, method: str, path: str, payload: dict = None, stream: bool = False) -> requests.Response:
+        """
+        Send a request to the server, retrying on connection errors. Non-streamed responses are fully read and counted before returning; streamed ones are counted as they are consumed through iter_lines.
+
+        :param method: HTTP method. ('GET', 'POST', 'DELETE')
+        :param path: API path on the server. ('/api/generate')
+        :param payload: JSON body to send, if any.
+        :param stream: Leave the body unread so it can be consumed chunk by chunk.
+        :returns: The requests Response object.
+        """
+        url = f"{self.base_url}{path}"
+        body = json.dumps(payload) if payload is not None else None
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, url, data=body, stream=stream, timeout=(self.connect_timeout, self.read_timeout))
+                break
+            except requests.ConnectionError:
+                if attempt >= self.max_retries:
+                    self._record(sent=0, received=0, latency=time.perf_counter() - started, failed=True)
+                    raise
+                time.sleep(self.backoff * (2 ** attempt))
+                attempt += 1
+                with self._stats_lock:
+                    self.stats.retries += 1
+
+        response.request_started = started
+        if not stream:
+            self._record(sent=len(body or ''), received=len(response.content), latency=time.perf_counter() - started, failed=not response.ok)
+        else:
+            self._record(sent=len(body or ''), received=0, latency=None, failed=not response.ok)
+        return response
+
+    def post(self, path: str, payload: dict, stream: bool = False) -> requests.Response:
+        return self.request('POST', path, payload=payload, stream=stream)
+
+    def get(self, path: str) -> requests.Response:
+        return self.request('GET', path)
+
+    def delete(self, path: str, payload: dict) -> requests.Response:
+        return self.request('DELETE', path, payload=payload)
+
+    def iter_lines(self, response: requests.Response) -> Iterator[bytes]:
+        """
+        Iterate a streamed response line by line (Ollama sends NDJSON) while counting bytes received. The request latency is recorded once the stream is exhausted or closed.
+
+        :param response: A response returned by request(..., stream=True).
+        :yields: (bytes) Raw lines from the response body.
+        """
+        received = 0
+        try:
+            for line in response.iter_lines():
+                received += len(line) + 1
+                yield line
+        finally:
+            self._record(sent=0, received=received, latency=time.perf_counter() - response.request_started, failed=False, count=False)
+
+    def _record(self, sent: int, received: int, latency: float, failed: bool, count: bool = True) -> None:
+        with self._stats_lock:
+            if count:
+                self.stats.requests += 1
+            if failed:
+                self.stats.failures += 1
+            self.stats.bytes_sent += sent
+            self.stats.bytes_received += received
+            if latency is not None:
+                self.stats.total_latency += latency
+                self.stats.last_latency = latency
+
+    async def run_async(self, fn, *args, **kwargs):
+        """
+        Run a blocking call that uses this transport on its executor and await the result. The executor has one thread per pooled connection, so async callers queue up instead of opening extra sockets.
+
+        :param fn: The blocking callable, e.g. Agent.generate_response.
+        :returns: Whatever fn returns.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False)
+        self.session.close()
+
+
+_transports: dict = {}
+_transports_lock = threading.Lock()
+
+
+def ollama_base_url(completions_url: str = None) -> str:
+    """
+    Reduce a configured completions url (http://127.0.0.1:11434/api/generate) to the server's base url so every endpoint on the same server shares one transport. $OLLAMA_HOST, when set, takes precedence over the configured url, so one variable points every agent at another server. It is read the way the ollama CLI reads it: a bare host or host:port is http with port 11434 unless given. With neither, the default local server.
+
+    :param completions_url: The url from the agent's instructions, if any.
+    :returns: (str) scheme://host:port
+    """
+    url = os.environ.get('OLLAMA_HOST', '').strip() or completions_url or DEFAULT_OLLAMA_URL
+    if '://' not in url:
+        parts = urlsplit(f"http://{url}")
+        host = parts.netloc.rpartition(':')[0] if parts.port else parts.netloc
+        return f"http://{host or '127.0.0.1'}:{parts.port or 11434}"
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def get_transport(completions_url: str = None, **kwargs) -> OllamaTransport:
+    """
+    Return the process-wide transport for an Ollama server, creating it on first use. Keyword arguments only apply when the transport is created.
+
+    :param completions_url: Any url on the target server, usually the agent's completions_url.
+    :returns: (OllamaTransport) The shared transport for that server.
+    """
+    base_url = ollama_base_url(completions_url)
+    with _transports_lock:
+        transport = _transports.get(base_url)
+        if transport is None:
+            transport = OllamaTransport(base_url, **kwargs)
+            _transports[base_url] = transport
+        return transport
+
+
+def parse_modelfile(modelfile: str) -> dict:
+    """
+    Turn a Modelfile into the fields of an /api/create request: from, parameters, template, system, license and adapters. Triple-quoted values may span lines, parameters given more than once (stop) become lists and numeric ones are sent as numbers.
+
+    :param modelfile: The Modelfile's text.
+    :returns: (dict) The request fields, without the model name.
+    """
+    request = {}
+    lines = iter(modelfile.splitlines())
+    for line in lines:
+        match = MODELFILE_INSTRUCTION.match(line.strip())
+        if not match:
+            continue
+        instruction, value = match.group(1).upper(), match.group(2).strip()
+        if value.startswith('"""'):
+            value = value[3:]
+            while not value.endswith('"""'):
+                try:
+                    value += '\n' + next(lines)
+                except StopIteration:
+                    break
+            value = value[:-3] if value.endswith('"""') else value
+            value = value.strip('\n')
+        if instruction == 'FROM':
+            request['from'] = value
+        elif instruction == 'PARAMETER':
+            key, _, raw = value.partition(' ')
+            raw = raw.strip().strip('"')
+            try:
+                parsed = int(raw)
+            except ValueError:
+                try:
+                    parsed = float(raw)
+                except ValueError:
+                    parsed = raw
+            parameters = request.setdefault('parameters', {})
+            if key in parameters:
+                existing = parameters[key]
+                parameters[key] = (existing if isinstance(existing, list) else [existing]) + [parsed]
+            else:
+                parameters[key] = parsed
+        elif instruction == 'ADAPTER':
+            request.setdefault('adapters', []).append(value)
+        else:
+            request[instruction.lower()] = value
+    return request
+
+
 class OllamaClient:
-    def __init__(self, port: int = 11434):
-        self.port = port
+    """
+    Model management against an Ollama server.
 
-    def ollama_pull_model(model_name: str) -> None:
+    :param host: The server, as a url or host:port. Defaults to $OLLAMA_HOST, then the local server.
+    """
+    def __init__(self, host: str = None):
+        self.base_url = ollama_base_url(host)
+        self.transport = get_transport(self.base_url)
+
+    def ollama_pull_model(self, model_name: str) -> bool:
         """
-        Download a model from the Ollama server.
+        Download a model onto the Ollama server, printing its progress.
 
         :param model_name: The name of the model to download.
+        :returns: (bool) Whether the server finished the pull.
+        """
+        response = self.transport.post('/api/pull', {'model': model_name, 'stream': True}, stream=True)
+        return self._follow_progress(response, f"Error pulling model {model_name}")
+
+    def _follow_progress(self, response: requests.Response, error_prefix: str) -> bool:
         """
-        subprocess.run(['ollama', 'pull', model_name])
+        Print the status lines a streamed /api/pull or /api/create sends, a percentage for layers being downloaded.
+
+        :returns: (bool) Whether the stream ended in success.
+        """
+        if not response.ok:
+            print(f"{error_prefix}: {response.text}")
+            return False
+        status, progress_line = None, False
+        for line in self.transport.iter_lines(response):
+            if not line:
+                continue
+            update = json.loads(line)
+            if 'error' in update:
+                if progress_line:
+                    print()
+                print(f"{error_prefix}: {update['error']}")
+                return False
+            status = update.get('status', status)
+            if update.get('total') and update.get('completed') is not None:
+                print(f"\r{status} {100 * update['completed'] / update['total']:.0f}%", end='', flush=True)
+                progress_line = True
+            else:
+                print(f"\n{status}" if progress_line else status)
+                progress_line = False
+        if progress_line:
+            print()
+        return status == 'success'
 
     # remove model
-    def ollama_remove_model(model_name: str) -> None:
+    def ollama_remove_model(self, model_name: str) -> bool:
         """
         Remove a model from your local Ollama repo.
 
         :param model_name: The name of the model to remove.
+        :returns: (bool) Whether the server removed it.
         """
-        subprocess.run(['ollama', 'rm', model_name])
+        response = self.transport.delete('/api/delete', {'name': model_name})
+        if not response.ok:
+            print(f"Error removing model {model_name}: {response.text}")
+        return response.ok
 
     # copy model
-    def ollama_copy_model(src_model_name: str, dest_model_name: str) -> None:
+    def ollama_copy_model(self, src_model_name: str, dest_model_name: str) -> None:
         """
         Copies a model from one name to another. Intended for use during fine-tuning or new model creation.
 
         :param src_model_name: The name of the model to copy.
         :param dest_model_name: The name of the new model.
         """
-        subprocess.run(['ollama', 'cp', src_model_name, dest_model_name])
+        response = self.transport.post('/api/copy', {'source': src_model_name, 'destination': dest_model_name})
+        if not response.ok:
+            print(f"Error copying model {src_model_name}: {response.text}")
 
     # create model from Modelfile
-    def ollama_create_model_from_modelfile(model_name: str) -> None:
+    def ollama_create_model_from_modelfile(self, model_name: str) -> bool:
         """
-        Uses the Modelfile to create a new model.
+        Uses the agent's Modelfile (agents/<model_name>/Modelfile) to create a new model on the Ollama server.
 
         :param model_name: The name of the model to create.
+        :returns: (bool) Whether the server created it.
         """
-        with open(f'agents/{model_name}/Modelfile', 'w') as f:
+        with open(f'agents/{model_name.lower()}/Modelfile', 'r') as f:
             modelfile = f.read()
-        subprocess.run(['ollama', 'create', model_name])
+        payload = {'model': model_name, 'stream': True, **parse_modelfile(modelfile)}
+        response = self.transport.post('/api/create', payload, stream=True)
+        return self._follow_progress(response, f"Error creating model {model_name}")
 
 
-    def ollama_list_downloaded_models() -> None:
+    def ollama_list_downloaded_models(self) -> None:
         """
         Lists all the models you have downloaded from the Ollama server.
         """
-        subprocess.run(['ollama', 'list'])
\ No newline at end of file
+        response = self.transport.get('/api/tags')
+        if not response.ok:
+            print(f"Error listing models: {response.text}")
+            return
+        for model in response.json().get('models', []):
+            size_gb = model.get('size', 0) / 1e9
+            print(f"{model.get('name')}    {size_gb:.1f} GB    {model.get('modified_at', '')[:19]}")
\ No newline at end of file
@@ -1,4 +1,5 @@
 import cmd2
+import requests
 from ollama import OllamaClient
 from utilities import toilet_banner_metal
 
@@ -44,23 +45,38 @@ class OllamaApp(cmd2.Cmd):
 
     def do_1(self, line):
         print("\nHere are the models you have available with Ollama...\n\n")
-        self.ollama_client.ollama_list_downloaded_models()
+        try:
+            self.ollama_client.ollama_list_downloaded_models()
+        except requests.RequestException as e:
+            print(f"Error: couldn't reach Ollama at {self.ollama_client.base_url}: {e}")
         print("\n\n")
     
     def do_2(self, line):
+        model_name = input("Enter the name of the model to download: ")
         try:
             # Download a new model TODO: this needs to run in another thread or background and reverse to main at exec
-            self.ollama_client.ollama_pull_model(input("Enter the name of the model to download: "))
-        except Exception as e:
-            print(f"Error: {e}\n\n")
+            if self.ollama_client.ollama_pull_model(model_name):
+                print(f"\nModel {model_name} downloaded.\n\n")
+        except requests.RequestException as e:
+            print(f"Error: couldn't reach Ollama at {self.ollama_client.base_url}: {e}\n\n")
 
     def do_3(self, line):
         model_name = input("Enter the name of the model to remove: ")
-        self.ollama_client.ollama_remove_model(model_name)
-        print(f"\nModel {model_name} removed.\n\n")
+        try:
+            if self.ollama_client.ollama_remove_model(model_name):
+                print(f"\nModel {model_name} removed.\n\n")
+        except requests.RequestException as e:
+            print(f"Error: couldn't reach Ollama at {self.ollama_client.base_url}: {e}\n\n")
 
     def do_4(self, line):
-        pass
+        model_name = input("Enter the name of the agent whose Modelfile to build: ")
+        try:
+            if self.ollama_client.ollama_create_model_from_modelfile(model_name):
+                print(f"\nModel {model_name} created.\n\n")
+        except requests.RequestException as e:  # an OSError too, so it goes first
+            print(f"Error: couldn't reach Ollama at {self.ollama_client.base_url}: {e}\n\n")
+        except OSError as e:
+            print(f"Error: couldn't read the Modelfile: {e}\n\n")
 
     def do_9(self, line):
         print("\nHeading back to base...")
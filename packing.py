@@ -0,0 +1,148 @@
+from dataclasses import asdict, dataclass
+import math
+import threading
+from typing import Dict, List, Tuple
+
+
+class TokenEstimator:
+    """
+    Calibrated characters-per-token estimator, kept per model. Ollama does not expose a tokenizer endpoint, but every full generation reports prompt_eval_count, so each model's ratio starts at a sensible default and is nudged towards what the server actually counted. Good enough to keep prompts inside num_ctx without shipping a tokenizer per model.
+
+    :param default_chars_per_token: Starting ratio for models we have not seen yet. ~4 holds for English on most llama-family tokenizers.
+    :param smoothing: Weight given to each new observation.
+    """
+    def __init__(self, default_chars_per_token: float = 4.0, smoothing: float = 0.2) -> None:
+        self.default_chars_per_token = default_chars_per_token
+        self.smoothing = smoothing
+        self.ratios: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def chars_per_token(self, model: str) -> float:
+        return self.ratios.get(model, self.default_chars_per_token)
+
+    def estimate(self, text: str, model: str) -> int:
+        """
+        Estimated token count for a piece of text.
+
+        :param text: The text to measure.
+        :param model: The model it will be sent to.
+        :returns: (int) Estimated tokens, rounded up.
+        """
+        if not text:
+            return 0
+        return math.ceil(len(text) / self.chars_per_token(model))
+
+    def estimate_chars(self, chars: int, model: str) -> int:
+        return math.ceil(chars / self.chars_per_token(model))
+
+    def calibrate(self, model: str, prompt_chars: int, prompt_tokens: int) -> None:
+        """
+        Fold an observed (characters, tokens) pair into the model's ratio. Observations outside a plausible range are ignored; a prompt cache hit on the server makes prompt_eval_count undercount and would otherwise skew the ratio.
+
+        :param model: The model that evaluated the prompt.
+        :param prompt_chars: Length of the prompt that was sent.
+        :param prompt_tokens: prompt_eval_count reported by Ollama.
+        """
+        if not prompt_tokens or prompt_chars < 200:
+            return
+        observed = prompt_chars / prompt_tokens
+        if not 1.5 <= observed <= 8.0:
+            return
+        with self._lock:
+            current = self.ratios.get(model, self.default_chars_per_token)
+            self.ratios[model] = current + self.smoothing * (observed - current)
+
+
+# One estimator for the process so every agent on the same model shares its calibration
+token_estimator = TokenEstimator()
+
+
+@dataclass
+class PackReport:
+    """
+    What the packer kept and dropped for one prompt. Token counts are estimates.
+    """
+    budget: int
+    fixed_tokens: int
+    used_tokens: int
+    history_kept: int
+    history_dropped: int
+    memories_kept: int
+    memories_dropped: int
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    def dropped_anything(self) -> bool:
+        return bool(self.history_dropped or self.memories_dropped)
+
+    def to_string(self) -> str:
+        return (f"Prompt packed to ~{self.used_tokens}/{self.budget} tokens: "
+                f"{self.history_kept} history turns kept ({self.history_dropped} oldest dropped), "
+                f"{self.memories_kept} memories kept ({self.memories_dropped} lowest-ranked dropped)")
+
+
+def pack_prompt_sections(fixed_tokens: int, history: List[str], memories: List[str], budget: int, model: str, estimator: TokenEstimator = token_estimator) -> Tuple[List[str], List[str], PackReport]:
+    """
+    Greedily fit history turns and memories into a token budget. Candidates are taken alternately from the newest history turn and the best-ranked memory; once an item of a kind no longer fits, everything older (or lower ranked) of that kind is dropped too, so the history stays contiguous and the memories stay a top-k.
+
+    :param fixed_tokens: Tokens that are always sent (template text, user input).
+    :param history: Rendered history turns, oldest first. A turn may be a string or a tuple of strings (MessageCache keeps request and response apart).
+    :param memories: Formatted memories, best match first.
+    :param budget: Total tokens the prompt may use.
+    :param model: The model, for the estimator's per-model ratio.
+    :returns: (kept history oldest first, kept memories best first, PackReport)
+    """
+    remaining = budget - fixed_tokens
+    newest_first = list(reversed(history))
+    kept_history = []
+    kept_memories = []
+    history_open = True
+    memories_open = True
+
+    for index in range(max(len(newest_first), len(memories))):
+        if history_open and index < len(newest_first):
+            turn = newest_first[index]
+            cost = estimator.estimate_chars(sum(map(len, turn)) if isinstance(turn, tuple) else len(turn), model)
+            if cost <= remaining:
+                kept_history.append(newest_first[index])
+                remaining -= cost
+            else:
+                history_open = False
+        if memories_open and index < len(memories):
+            cost = estimator.estimate(memories[index], model)
+            if cost <= remaining:
+                kept_memories.append(memories[index])
+                remaining -= cost
+            else:
+                memories_open = False
+
+    report = PackReport(
+        budget=budget,
+        fixed_tokens=fixed_tokens,
+        used_tokens=budget - remaining,
+        history_kept=len(kept_history),
+        history_dropped=len(history) - len(kept_history),
+        memories_kept=len(kept_memories),
+        memories_dropped=len(memories) - len(kept_memories),
+    )
+    kept_history.reverse()
+    return kept_history, kept_memories, report
+
+
+def align_history_start(kept_history: list, turns_added: int, block: int) -> list:
+    """
+    Trim packed history so it starts on a multiple of block, counting every turn of the chat, for the prefix_stable layout. Dropping the single oldest turn whenever a new one arrives moves the start of the history, and with it the prompt prefix, on every turn; starting on a block boundary keeps it fixed for up to block turns, at the cost of sending up to block - 1 fewer turns than would fit. Nothing is trimmed while the whole chat still fits, or when trimming would leave no history at all.
+
+    :param kept_history: Packed turns, oldest first, ending with the newest turn.
+    :param turns_added: Turns in the chat so far, so the oldest kept turn is number turns_added - len(kept_history).
+    :param block: Turns dropped at a time.
+    :returns: The trimmed history, oldest first.
+    """
+    first = turns_added - len(kept_history)
+    if first <= 0 or block <= 1:
+        return kept_history
+    trim = -(-first // block) * block - first
+    if trim >= len(kept_history):
+        return kept_history
+    return kept_history[trim:]
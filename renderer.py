@@ -0,0 +1,179 @@
+import os
+import queue
+import re
+import select
+import sys
+import threading
+import time
+
+try:
+    import termios
+    import tty
+except ImportError:  # Windows, keypress skipping just isn't available
+    termios = None
+    tty = None
+
+
+# A word plus the whitespace after it, or a run of leading whitespace
+WORD_PATTERN = re.compile(r'\S+\s*|\s+')
+LINE_PATTERN = re.compile(r'[^\n]*\n|[^\n]+')
+
+
+class TerminalRenderer:
+    """
+    Types text to the terminal at a target rate from its own thread. Text is written a word (or line) at a time with one flush per batch instead of a write, flush and sleep per character, and submit() returns straight away so the chat loop can build the next prompt or upsert memories while the reply is still being typed out. Pressing any key while it is typing (when stdin is a terminal) prints the rest at once.
+
+    :param chars_per_second: Default typing speed. 20 matches the old 0.05s per character.
+    :param granularity: 'word' or 'line', the size of each write.
+    :param stream: Where to write, stdout by default.
+    """
+    def __init__(self, chars_per_second: float = 20, granularity: str = 'word', stream=None) -> None:
+        self.chars_per_second = chars_per_second
+        self.pattern = LINE_PATTERN if granularity == 'line' else WORD_PATTERN
+        self.stream = stream or sys.stdout
+        self._jobs = queue.Queue()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._skip = threading.Event()
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, text: str, prefix: str = "", chars_per_second: float = None) -> None:
+        """
+        Queue text to be typed out and return immediately. Jobs are rendered in the order they were submitted.
+
+        :param text: The text to type.
+        :param prefix: Written instantly before the text (e.g. "\nSherlock>> ").
+        :param chars_per_second: Speed for this text. None uses the renderer's default, 0 or less prints it all at once.
+        """
+        with self._lock:
+            self._pending += 1
+            self._idle.clear()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='terminal-renderer', daemon=True)
+                self._thread.start()
+        self._jobs.put((text or "", prefix, self.chars_per_second if chars_per_second is None else chars_per_second))
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+        Block until everything submitted has been written. Call this before input() so the prompt doesn't land in the middle of a reply.
+
+        :param timeout: Seconds to wait. None waits until done.
+        :returns: True if the renderer is idle.
+        """
+        return self._idle.wait(timeout)
+
+    def skip(self) -> None:
+        """
+        Write whatever is still queued without pacing it.
+        """
+        self._skip.set()
+
+    def finish(self) -> None:
+        """
+        Skip the rest and wait for it to be written, for when a session ends.
+        """
+        if not self._idle.is_set():
+            self.skip()
+            self.wait()
+
+    def _run(self) -> None:
+        while True:
+            text, prefix, chars_per_second = self._jobs.get()
+            try:
+                self._render(text, prefix, chars_per_second)
+            except Exception as e:
+                print(f"Error rendering output: {e}")
+            finally:
+                with self._lock:
+                    self._pending -= 1
+                    if self._pending == 0:
+                        self._skip.clear()
+                        self._idle.set()
+
+    def _render(self, text: str, prefix: str, chars_per_second: float) -> None:
+        self.stream.write(prefix)
+        if self._skip.is_set() or not chars_per_second or chars_per_second <= 0:
+            self.stream.write(text + "\n")
+            self.stream.flush()
+            return
+        self.stream.flush()
+
+        with KeypressWatcher(self._skip):
+            started = time.perf_counter()
+            written = 0
+            for match in self.pattern.finditer(text):
+                chunk = match.group(0)
+                if not self._skip.is_set():
+                    # Pace by characters, not by batches, so the speed doesn't depend on word length
+                    delay = started + written / chars_per_second - time.perf_counter()
+                    if delay > 0:
+                        self._skip.wait(delay)
+                if self._skip.is_set():
+                    self.stream.write(text[match.start():])
+                    break
+                self.stream.write(chunk)
+                self.stream.flush()
+                written += len(chunk)
+            self.stream.write("\n")
+            self.stream.flush()
+
+
+class KeypressWatcher:
+    """
+    While active, sets an event when a key is pressed. Puts the terminal in cbreak mode so a single key counts without Enter, and restores it on exit. Does nothing when stdin isn't a terminal.
+
+    :param event: Set on the first keypress.
+    """
+    def __init__(self, event: threading.Event) -> None:
+        self.event = event
+        self._fd = None
+        self._saved = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self) -> 'KeypressWatcher':
+        if termios is None or not sys.stdin.isatty():
+            return self
+        try:
+            self._fd = sys.stdin.fileno()
+            self._saved = termios.tcgetattr(self._fd)
+            tty.setcbreak(self._fd)
+        except (termios.error, OSError, ValueError):
+            self._saved = None
+            return self
+        self._thread = threading.Thread(target=self._watch, name='keypress-watcher', daemon=True)
+        self._thread.start()
+        return self
+
+    def _watch(self) -> None:
+        while not self._stop.is_set():
+            readable, _, _ = select.select([self._fd], [], [], 0.05)
+            if readable:
+                # Swallow the key so it doesn't show up in the next input()
+                os.read(self._fd, 1024)
+                self.event.set()
+                return
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._saved is not None:
+            termios.tcsetattr(self._fd, termios.TCSADRAIN, self._saved)
+
+
+_renderer = None
+_renderer_lock = threading.Lock()
+
+
+def get_renderer() -> TerminalRenderer:
+    """
+    The process-wide renderer. One writer keeps replies from different callers in order.
+    """
+    global _renderer
+    with _renderer_lock:
+        if _renderer is None:
+            _renderer = TerminalRenderer()
+        return _renderer
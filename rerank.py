@@ -0,0 +1,67 @@
+from dataclasses import asdict, dataclass
+from typing import List, Tuple
+import numpy as np
+
+
+@dataclass
+class RerankReport:
+    """
+    What the re-ranking stage did to one turn's memories. Token counts are estimates, filled in by the agent since they depend on the model.
+    """
+    candidates: int = 0
+    kept: int = 0
+    too_distant: int = 0
+    redundant: int = 0
+    tokens_before: int = 0
+    tokens_after: int = 0
+
+    @property
+    def tokens_saved(self) -> int:
+        return max(0, self.tokens_before - self.tokens_after)
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        data['tokens_saved'] = self.tokens_saved
+        return data
+
+    def to_string(self) -> str:
+        return (f"Memory rerank: kept {self.kept} of {self.candidates} candidates "
+                f"({self.too_distant} too distant, {self.redundant} redundant), ~{self.tokens_saved} memory tokens saved")
+
+
+def mmr_select(query_embedding, embeddings, n_results: int, mmr_lambda: float = 0.7, duplicate_similarity: float = None) -> Tuple[List[int], int]:
+    """
+    Maximal marginal relevance: pick, one at a time, the candidate with the best mix of similarity to the query and dissimilarity to what has already been picked, score = lambda * sim(query) - (1 - lambda) * max sim(picked). Similarities are cosine, all of them come from two matrix products up front and each pick only updates a running max.
+
+    :param query_embedding: The query's embedding.
+    :param embeddings: One row per candidate.
+    :param n_results: Most candidates to pick.
+    :param mmr_lambda: 1 ranks purely by relevance, lower values favour diversity.
+    :param duplicate_similarity: Candidates at least this similar to a picked one are dropped outright rather than just ranked down. None keeps them.
+    :returns: (picked candidate indices in pick order, number dropped as duplicates)
+    """
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    if not len(vectors) or n_results <= 0:
+        return [], 0
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    query = np.asarray(query_embedding, dtype=np.float32)
+    query = query / max(float(np.linalg.norm(query)), 1e-12)
+
+    relevance = vectors @ query
+    similarity = vectors @ vectors.T
+    closest_picked = np.full(len(vectors), -np.inf, dtype=np.float32)
+    available = np.ones(len(vectors), dtype=bool)
+    picked = []
+    duplicates = 0
+    while len(picked) < n_results and available.any():
+        penalty = np.where(np.isfinite(closest_picked), closest_picked, 0.0)
+        scores = np.where(available, mmr_lambda * relevance - (1 - mmr_lambda) * penalty, -np.inf)
+        best = int(np.argmax(scores))
+        picked.append(best)
+        available[best] = False
+        closest_picked = np.maximum(closest_picked, similarity[best])
+        if duplicate_similarity is not None:
+            redundant = available & (similarity[best] >= duplicate_similarity)
+            duplicates += int(redundant.sum())
+            available &= ~redundant
+    return picked, duplicates
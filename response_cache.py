@@ -0,0 +1,204 @@
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+import hashlib
+import json
+import os
+from pathlib import Path
+import threading
+
+
+@dataclass
+class ResponseCacheStats:
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    bypassed: int = 0
+    stores: int = 0
+    disk_evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        data['hit_rate'] = self.hit_rate
+        return data
+
+    def to_string(self) -> str:
+        return (f"Response cache: {self.hit_rate:.0%} hit rate "
+                f"({self.memory_hits} memory, {self.disk_hits} disk, {self.misses} generated, {self.bypassed} not deterministic), "
+                f"{self.stores} stored, {self.disk_evictions} evicted")
+
+
+class ResponseCache:
+    """
+    Exact-match cache for deterministic generations. With temperature 0, or with an explicitly fixed seed, the same model, options and prompt always produce the same completion, so regression and demo runs that re-ask the same prompts can skip the model entirely. Entries live in an in-memory LRU in front of a disk tier (one small json file per entry under library/), and the disk tier is trimmed oldest-first when it grows past its byte budget.
+
+    :param path: Directory for the disk tier.
+    :param max_memory_entries: Entries kept in the in-memory LRU.
+    :param max_disk_bytes: Size the disk tier is trimmed back to.
+    """
+    def __init__(self, path: str = 'library/response_cache', max_memory_entries: int = 256, max_disk_bytes: int = 64 * 1024 * 1024) -> None:
+        self.path = Path(path)
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.stats = ResponseCacheStats()
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_bytes = None
+
+    @staticmethod
+    def is_deterministic(payload: dict) -> bool:
+        """
+        Whether a request is guaranteed to produce the same completion every time: either it pins a non-negative seed, or it samples greedily (temperature 0, no mirostat). Requests without a seed at a non-zero temperature are sampled afresh each time and never cached.
+
+        :param payload: The /api/generate request body.
+        """
+        options = payload.get("options") or {}
+        try:
+            if options.get("seed") is not None and int(options["seed"]) >= 0:
+                return True
+            return options.get("temperature") is not None and float(options["temperature"]) == 0 and not options.get("mirostat")
+        except (TypeError, ValueError):
+            return False
+
+    @staticmethod
+    def key_for(payload: dict) -> str:
+        """
+        Cache key for a request: model, the full options dict and hashes of the prompt and of the context it extends.
+
+        :param payload: The /api/generate request body.
+        :returns: Hex digest.
+        """
+        material = {
+            "model": payload.get("model"),
+            "options": payload.get("options") or {},
+            "prompt": hashlib.sha256(payload.get("prompt", "").encode('utf-8')).hexdigest(),
+            "context": hashlib.sha256(json.dumps(payload.get("context") or []).encode('utf-8')).hexdigest(),
+        }
+        return hashlib.sha256(json.dumps(material, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def _entry_path(self, key: str) -> Path:
+        return self.path / key[:2] / f"{key}.json"
+
+    def get(self, key: str) -> dict:
+        """
+        Look up an entry, memory first and then disk. Disk hits are promoted into memory.
+
+        :param key: From key_for.
+        :returns: The stored entry (response, context, eval counts) or None.
+        """
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.stats.memory_hits += 1
+                return entry
+
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path, 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            with self._lock:
+                self.stats.misses += 1
+            return None
+
+        # Touch the file so disk eviction treats it as recently used
+        try:
+            os.utime(entry_path)
+        except OSError:
+            pass
+        with self._lock:
+            self.stats.disk_hits += 1
+            self._remember(key, entry)
+        return entry
+
+    def put(self, key: str, entry: dict) -> None:
+        """
+        Store an entry in memory and on disk, trimming the disk tier if it is over budget.
+
+        :param key: From key_for.
+        :param entry: The response and anything needed to replay it.
+        """
+        data = json.dumps(entry)
+        entry_path = self._entry_path(key)
+        try:
+            entry_path.parent.mkdir(parents=True, exist_ok=True)
+            existing = entry_path.stat().st_size if entry_path.exists() else 0
+            with open(entry_path, 'w') as f:
+                f.write(data)
+        except OSError as e:
+            print(f"Error writing response cache entry: {e}")
+            existing = len(data)
+
+        with self._lock:
+            self.stats.stores += 1
+            self._remember(key, entry)
+            if self._disk_bytes is not None:
+                self._disk_bytes += len(data) - existing
+        self._trim_disk()
+
+    def note_bypass(self) -> None:
+        with self._lock:
+            self.stats.bypassed += 1
+
+    def _remember(self, key: str, entry: dict) -> None:
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _trim_disk(self) -> None:
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(entry.stat().st_size for entry in self.path.glob('*/*.json'))
+            if self._disk_bytes <= self.max_disk_bytes:
+                return
+            entries = sorted(self.path.glob('*/*.json'), key=lambda entry: entry.stat().st_mtime)
+            for entry in entries:
+                if self._disk_bytes <= self.max_disk_bytes:
+                    break
+                try:
+                    size = entry.stat().st_size
+                    entry.unlink()
+                except OSError:
+                    continue
+                self._disk_bytes -= size
+                self.stats.disk_evictions += 1
+
+    def clear(self) -> None:
+        """
+        Empty both tiers.
+        """
+        with self._lock:
+            self._memory.clear()
+            for entry in self.path.glob('*/*.json'):
+                entry.unlink()
+            self._disk_bytes = 0
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """
+    The process-wide response cache, created on first use.
+    """
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache()
+        return _response_cache
+
+
+def response_cache_report() -> str:
+    """
+    Hit rate of the response cache, or None if no agent in this process has used it.
+    """
+    if _response_cache is None:
+        return None
+    return _response_cache.stats.to_string()
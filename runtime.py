@@ -0,0 +1,149 @@
+from dataclasses import asdict, dataclass
+import os
+import threading
+from typing import Dict, Tuple
+from chroma import ChromaHandler
+from config import ModelInstructions, ParamsConfig
+
+
+@dataclass
+class RuntimeStats:
+    """
+    What the runtime built versus handed back from its caches.
+    """
+    agents_loaded: int = 0
+    agents_reused: int = 0
+    agents_reloaded: int = 0
+    chroma_handlers_created: int = 0
+    chroma_handler_reuses: int = 0
+    tool_loads: int = 0
+    tool_reuses: int = 0
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    def to_string(self) -> str:
+        return (f"Runtime: {self.agents_loaded} agents loaded, {self.agents_reused} reused ({self.agents_reloaded} reloaded after edits), "
+                f"chroma handler reused {self.chroma_handler_reuses}x, toolbox loaded {self.tool_loads}x and reused {self.tool_reuses}x")
+
+
+class AgentRuntime:
+    """
+    Process-wide owner of the expensive bits: one ChromaHandler, one loaded ToolManager (loading agent_toolbox.py re-imports bs4, nltk and requests) and the Agent objects themselves, keyed by name. The chat handlers, SystemAdmin and the batch runner all go through here, so loading the same agent twice or starting a second chat costs a dict lookup. A cached agent is reloaded if its yaml files changed on disk since it was loaded.
+    """
+    def __init__(self) -> None:
+        self.stats = RuntimeStats()
+        self.agents: Dict[str, object] = {}
+        self._agent_mtimes: Dict[str, Tuple[float, float]] = {}
+        self._chroma_handler = None
+        self._tool_manager = None
+        self._lock = threading.RLock()
+
+    @property
+    def chroma_handler(self) -> ChromaHandler:
+        """
+        The shared handler, created on first use. Looking at it isn't counted, use share_chroma_handler() when handing it to something that keeps it.
+        """
+        with self._lock:
+            if self._chroma_handler is None:
+                self._chroma_handler = ChromaHandler()
+                self.stats.chroma_handlers_created += 1
+            return self._chroma_handler
+
+    @property
+    def tool_manager(self):
+        """
+        The shared toolbox, loaded on first use. Like chroma_handler, use share_tool_manager() to hand it out.
+        """
+        with self._lock:
+            if self._tool_manager is None:
+                # Imported here, agents imports the runtime for its defaults
+                from agents import ToolManager
+                self._tool_manager = ToolManager()
+                self.stats.tool_loads += 1
+            return self._tool_manager
+
+    def share_chroma_handler(self) -> ChromaHandler:
+        """
+        The shared handler for a new consumer (an agent, a chat handler, a compaction job). Every consumer after the one that created it counts as a reuse.
+        """
+        with self._lock:
+            created = self._chroma_handler is None
+            handler = self.chroma_handler
+            if not created:
+                self.stats.chroma_handler_reuses += 1
+            return handler
+
+    def share_tool_manager(self):
+        """
+        The shared toolbox for a new consumer, counted like share_chroma_handler.
+        """
+        with self._lock:
+            loaded = self._tool_manager is None
+            tool_manager = self.tool_manager
+            if not loaded:
+                self.stats.tool_reuses += 1
+            return tool_manager
+
+    @staticmethod
+    def _config_mtimes(agent_name: str) -> Tuple[float, float]:
+        mtimes = []
+        for file_name in ('instructions.yaml', 'params_config.yaml'):
+            try:
+                mtimes.append(os.path.getmtime(f"agents/{agent_name.lower()}/{file_name}"))
+            except OSError:
+                mtimes.append(0.0)
+        return tuple(mtimes)
+
+    def new_agent(self, agent_name: str):
+        """
+        Load an agent from its yaml files without caching it. It still shares the runtime's chroma handler and toolbox. Use this when two live sessions need the same agent with separate histories.
+
+        :param agent_name: The agent's directory name.
+        :returns: A fresh Agent.
+        """
+        from agents import Agent
+        return Agent(params_config=ParamsConfig(method='load', assistant_name=agent_name),
+                     instructions=ModelInstructions(method='load', assistant_name=agent_name))
+
+    def get_agent(self, agent_name: str):
+        """
+        Return the cached agent for a name, loading it on first use. The agent's chat state is reset so every session starts clean.
+
+        :param agent_name: The agent's directory name.
+        :returns: The shared Agent.
+        """
+        key = agent_name.lower()
+        with self._lock:
+            mtimes = self._config_mtimes(key)
+            agent = self.agents.get(key)
+            if agent is not None and self._agent_mtimes.get(key) == mtimes:
+                self.stats.agents_reused += 1
+                agent.start_session()
+                return agent
+            if agent is not None:
+                self.stats.agents_reloaded += 1
+            agent = self.new_agent(agent_name)
+            self.agents[key] = agent
+            self._agent_mtimes[key] = mtimes
+            self.stats.agents_loaded += 1
+            return agent
+
+    def register_agent(self, agent) -> None:
+        """
+        Cache an agent built elsewhere, e.g. one just made by the agent creator.
+
+        :param agent: The Agent to cache under its name.
+        """
+        # Agents are keyed by directory name, which is the lowercased agent name
+        key = agent.name.lower()
+        with self._lock:
+            self.agents[key] = agent
+            self._agent_mtimes[key] = self._config_mtimes(key)
+
+    def forget_agent(self, agent_name: str) -> None:
+        with self._lock:
+            self.agents.pop(agent_name.lower(), None)
+            self._agent_mtimes.pop(agent_name.lower(), None)
+
+agent_runtime = AgentRuntime()
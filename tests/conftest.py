@@ -0,0 +1,96 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import sys
+from pathlib import Path
+import threading
+import pytest
+
+# The modules sit at the top of the repo rather than in a package
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+class FakeOllama:
+    """
+    Just enough of Ollama's /api/generate to drive an Agent: fixed tokens, streamed as NDJSON or in one response, and a context that grows by one id per request. Every request body is kept.
+    """
+    def __init__(self, tokens=("Elementary", ", my", " dear", " Watson.")):
+        self.tokens = list(tokens)
+        self.requests = []
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                fake.requests.append(body)
+                final = {"done": True, "context": list(range(len(fake.requests))), "prompt_eval_count": 12, "eval_count": len(fake.tokens)}
+                if body.get("stream"):
+                    lines = [{"response": token, "done": False} for token in fake.tokens] + [dict(final, response="")]
+                else:
+                    lines = [dict(final, response="".join(fake.tokens))]
+                data = "".join(json.dumps(line) + "\n" for line in lines).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}/api/generate"
+
+
+@pytest.fixture
+def fake_ollama():
+    fake = FakeOllama()
+    yield fake
+    fake.server.shutdown()
+
+
+class NoMemory:
+    """
+    Stands in for ChromaHandler where an agent opens its memory collection but never queries it (agent-to-agent turns). Records what was opened.
+    """
+    def __init__(self):
+        self.opened = []
+
+    def chroma_get_or_create_collection(self, name, max_numpy_documents=None):
+        self.opened.append(name)
+
+    async def achroma_get_or_create_collection(self, name, max_numpy_documents=None):
+        self.opened.append(name)
+
+
+@pytest.fixture
+def no_memory():
+    return NoMemory()
+
+
+@pytest.fixture
+def make_agent(fake_ollama, no_memory, tmp_path, monkeypatch):
+    """
+    Builds Agents against the fake server without their yaml files. Runs in tmp_path since session contexts are saved under agents/.
+    """
+    from agents import Agent
+    from config import ModelInstructions, ParamsConfig
+
+    monkeypatch.delenv('OLLAMA_HOST', raising=False)
+    monkeypatch.chdir(tmp_path)
+
+    def make(name='Sherlock', prompt_layout=None, **params):
+        # Both __init__s load yaml, the field defaults are all a test needs
+        instructions = ModelInstructions.__new__(ModelInstructions)
+        for key, value in {'name': name, 'llm_model': 'test-model', 'system_message': "You are a detective.", 'assistant_intro': "I am Sherlock.",
+                           'assistant_focus': "the case", 'start_token': "<s>", 'end_token': "</s>", 'mem_start_token': "<m>", 'mem_end_token': "</m>",
+                           'completions_url': fake_ollama.url, 'prompt_layout': prompt_layout}.items():
+            setattr(instructions, key, value)
+        params_config = ParamsConfig.__new__(ParamsConfig)
+        for key, value in dict({'num_ctx': 4096, 'history_turns': 20}, **params).items():
+            setattr(params_config, key, value)
+        return Agent(params_config, instructions, chroma_handler=no_memory, tool_manager=object())
+    return make
@@ -0,0 +1,37 @@
+import asyncio
+import threading
+from chroma import ChromaHandler
+
+
+def test_run_async_calls_overlap(tmp_path):
+    handler = ChromaHandler(path=str(tmp_path / "chroma"))
+    # Three calls that can only finish if they are all running at once
+    barrier = threading.Barrier(3, timeout=5)
+
+    async def main():
+        return await asyncio.gather(*(handler.run_async(barrier.wait) for _ in range(3)))
+    assert sorted(asyncio.run(main())) == [0, 1, 2]
+
+
+def test_sessions_generate_concurrently(make_agent, fake_ollama, no_memory):
+    agents = [make_agent(name) for name in ("Sherlock", "Moriarty", "Watson")]
+
+    async def turn(agent):
+        prompt = await agent.abuild_prompt("Who did it?", username="Lestrade", agent_agent=True)
+        return await agent.agenerate_response(prompt)
+
+    async def main():
+        return await asyncio.wait_for(asyncio.gather(*(turn(agent) for agent in agents)), timeout=10)
+    replies = asyncio.run(main())
+    assert replies == ["Elementary, my dear Watson."] * 3
+    assert sorted(no_memory.opened) == ["Moriarty-Lestrade", "Sherlock-Lestrade", "Watson-Lestrade"]
+    assert len(fake_ollama.requests) == 3
+
+
+def test_async_stream_hands_tokens_to_the_loop(make_agent, fake_ollama):
+    agent = make_agent()
+
+    async def collect():
+        return [token async for token in agent.agenerate_response_stream("Who did it?")]
+    assert asyncio.run(collect()) == fake_ollama.tokens
+    assert agent.last_stats.streamed and agent.last_response == "Elementary, my dear Watson."
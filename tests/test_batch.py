@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+from batch import BatchRunner
+
+
+class EmptyMemory:
+    """
+    A memory collection with nothing in it, batch records always query memory.
+    """
+    def chroma_get_or_create_collection(self, name, max_numpy_documents=None):
+        return name
+
+    def chroma_query_collection(self, collection, query, n_results, where=None, include=None):
+        return None
+
+
+def test_override_params_copies_and_leaves_the_original_untouched(make_agent):
+    params = make_agent().params_config
+    overridden = BatchRunner.override_params(params, {'temperature': 0, 'num_ctx': 1024})
+    assert overridden is not params
+    assert overridden.temperature == 0
+    assert overridden.num_ctx == 1024
+    assert params.num_ctx == 4096
+
+
+@pytest.mark.parametrize('overrides', [{'not_a_param': 1}, {'cache_responses': True}, {'incremental': True}])
+def test_override_params_rejects(make_agent, overrides):
+    with pytest.raises(ValueError):
+        BatchRunner.override_params(make_agent().params_config, overrides)
+
+
+def test_run_skips_completed_ids_and_records_failures(make_agent, fake_ollama, tmp_path, monkeypatch):
+    input_path = tmp_path / 'prompts.jsonl'
+    output_path = tmp_path / 'results.jsonl'
+    records = [
+        {'id': 'q1', 'agent': 'Sherlock', 'prompt': "Who was it?"},
+        {'id': 'q2', 'agent': 'Sherlock', 'prompt': "How?"},
+        {'id': 'q3', 'agent': 'Sherlock', 'prompt': "Why?", 'params': {'not_a_param': 1}},
+    ]
+    input_path.write_text(''.join(json.dumps(record) + "\n" for record in records))
+    output_path.write_text(json.dumps({'id': 'q1', 'status': 'ok'}) + "\n")
+
+    agent = make_agent()
+    agent.chroma_handler = EmptyMemory()
+    runner = BatchRunner(input_path, output_path, workers=1, default_user='juliet')
+    monkeypatch.setattr(runner, 'agent_for', lambda name: agent)
+    summary = runner.run()
+
+    assert (summary.processed, summary.succeeded, summary.failed, summary.skipped, summary.cached) == (2, 1, 1, 1, 0)
+    assert summary.generated_tokens == len(fake_ollama.tokens)
+    results = {result['id']: result for result in map(json.loads, output_path.read_text().splitlines()[1:])}
+    assert results['q2']['status'] == 'ok'
+    assert results['q2']['response'] == "Elementary, my dear Watson."
+    assert results['q2']['cached'] is False
+    assert results['q3']['status'] == 'error'
+    assert 'not_a_param' in results['q3']['error']
+    # Only the new record reached the model
+    assert len(fake_ollama.requests) == 1
+    # The failed override didn't stick to the agent
+    assert agent.params_config.num_ctx == 4096
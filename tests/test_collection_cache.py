@@ -0,0 +1,52 @@
+import numpy as np
+
+from chroma import ChromaHandler, CollectionCache
+from lexical import BM25Index
+
+
+class HashEmbedding:
+    model_name = 'hash-test'
+
+    def __call__(self, input):
+        return [np.full(8, float(len(text)), dtype=np.float32) for text in input]
+
+
+def test_get_counts_hits_and_misses():
+    cache = CollectionCache()
+    assert cache.get(('memories', 'default')) is None
+    cache.put(('memories', 'default'), 'handle')
+    assert cache.get(('memories', 'default')) == 'handle'
+    assert cache.stats.to_dict() == {'hits': 1, 'misses': 1, 'invalidations': 0}
+
+
+def test_invalidate_drops_every_handle_and_the_lexical_index_for_a_name():
+    cache = CollectionCache()
+    cache.put(('memories', 'default'), 'embedded')
+    cache.put(('memories', None), 'plain')
+    cache.put(('notes', 'default'), 'notes')
+    cache.lexical_indexes['memories'] = BM25Index()
+    cache.lexical_indexes['notes'] = BM25Index()
+
+    cache.invalidate('memories')
+    assert list(cache.handles) == [('notes', 'default')]
+    assert list(cache.lexical_indexes) == ['notes']
+    assert cache.stats.invalidations == 2
+
+    cache.invalidate()
+    assert cache.handles == {} and cache.lexical_indexes == {}
+
+
+def test_handlers_on_one_store_share_handles_until_a_delete(tmp_path):
+    path = str(tmp_path / 'chroma.db')
+    handler = ChromaHandler(path=path, embedding=HashEmbedding(), max_numpy_documents=100)
+    other = ChromaHandler(path=path, embedding=HashEmbedding(), max_numpy_documents=100)
+    stats = handler.collection_cache.stats
+
+    collection = handler.chroma_get_or_create_collection('sherlock-juliet')
+    assert other.chroma_get_or_create_collection('sherlock-juliet') is collection
+    assert (stats.hits, stats.misses) == (1, 1)
+
+    # A delete through either handler is seen by both
+    other.chroma_delete_collection('sherlock-juliet')
+    assert handler.chroma_get_or_create_collection('sherlock-juliet') is not collection
+    assert (stats.misses, stats.invalidations) == (2, 1)
@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta
+import numpy as np
+from compaction import ESTIMATED_SUMMARY_CHARACTERS, MemoryCompactor
+from vector_store import NumpyVectorStore
+
+
+class LocalHandler:
+    """
+    Just the parts of ChromaHandler the compactor uses, backed by a NumPy store.
+    """
+    def __init__(self, path):
+        self.store = NumpyVectorStore(path)
+        self.collection_cache = self
+        self.upserts = 0
+
+    def chroma_flush_memories(self):
+        pass
+
+    def chroma_get_collection(self, name):
+        return self.store.get(name)
+
+    def chroma_query_collection(self, collection, query, n_results):
+        return collection.query(query_embeddings=[[1, 0, 0]], n_results=n_results)
+
+    def chroma_upsert_to_collection(self, collection, documents, metadatas, ids):
+        self.upserts += 1
+        collection.upsert(ids=ids, documents=documents, metadatas=metadatas, embeddings=[[0, 0, 1]] * len(ids))
+
+    def invalidate(self, name):
+        pass
+
+
+def summarizer_calls():
+    calls = []
+
+    def summarize(prompt):
+        calls.append(prompt)
+        return "summary"
+    return summarize, calls
+
+
+def seed(handler):
+    old = (datetime.now() - timedelta(days=30)).timestamp()
+    collection = handler.store.get_or_create('sherlock-juliet')
+    collection.upsert(ids=['old-1', 'old-2', 'dup', 'new'],
+                      documents=['x' * 1000, 'y' * 1000, 'the same thing', 'the same thing'],
+                      metadatas=[{'timestamp': old}, {'timestamp': old + 60}, {'timestamp': old + 120}, {'timestamp': datetime.now().timestamp()}],
+                      embeddings=np.array([[1, 0, 0], [0, 1, 0], [0.6, 0.6, 0.5], [0.6, 0.6, 0.5]], dtype=np.float32))
+    return collection
+
+
+def test_dry_run_writes_nothing_and_never_calls_the_model(tmp_path):
+    handler = LocalHandler(tmp_path)
+    collection = seed(handler)
+    summarize, calls = summarizer_calls()
+    report = MemoryCompactor(handler, summarizer=summarize).compact('sherlock-juliet', older_than_days=7, dry_run=True)
+    assert calls == []
+    assert handler.upserts == 0
+    assert sorted(collection.get()['ids']) == ['dup', 'new', 'old-1', 'old-2']
+    assert (report.duplicates_removed, report.turns_rolled_up, report.summaries_written) == (1, 2, 1)
+    assert report.documents_after == 2
+    assert report.characters_after == report.characters_before - 2000 - len('the same thing') + ESTIMATED_SUMMARY_CHARACTERS
+    assert "would roll 2 old turns" in report.to_string()
+
+
+def test_dry_run_needs_no_summarizer_and_matches_the_real_run(tmp_path):
+    handler = LocalHandler(tmp_path)
+    seed(handler)
+    dry = MemoryCompactor(handler).compact('sherlock-juliet', older_than_days=7, dry_run=True)
+    summarize, calls = summarizer_calls()
+    real = MemoryCompactor(handler, summarizer=summarize).compact('sherlock-juliet', older_than_days=7)
+    assert len(calls) == 1
+    assert (dry.documents_after, dry.turns_rolled_up, dry.summaries_written) == (real.documents_after, real.turns_rolled_up, real.summaries_written)
+    kept = sorted(handler.store.get('sherlock-juliet').get()['ids'])
+    assert kept[0] == 'new' and kept[1].startswith('summary-') and len(kept) == 2
@@ -0,0 +1,48 @@
+import os
+import numpy as np
+from chroma import embedding_model_id
+from embedding_cache import CachedEmbeddingFunction
+
+
+class CountingEmbedding:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, input):
+        self.calls.append(list(input))
+        return [np.array([len(text), text.count('a'), 1.0], dtype=np.float32) for text in input]
+
+
+def test_each_text_is_embedded_once_across_instances(tmp_path):
+    embedding = CountingEmbedding()
+    cache = CachedEmbeddingFunction(embedding, 'test-model', path=str(tmp_path))
+    first = cache(['banana', 'apple', 'banana'])
+    assert embedding.calls == [['banana', 'apple']]
+    assert np.array_equal(first[0], first[2])
+    cache(['apple'])
+    assert (cache.stats.misses, cache.stats.memory_hits) == (3, 1)
+
+    reopened = CachedEmbeddingFunction(embedding, 'test-model', path=str(tmp_path))
+    assert np.array_equal(reopened(['apple'])[0], first[1])
+    assert reopened.stats.disk_hits == 1
+    assert len(embedding.calls) == 1
+
+
+def test_a_torn_row_is_cut_off_on_load(tmp_path):
+    embedding = CountingEmbedding()
+    cache = CachedEmbeddingFunction(embedding, 'test-model', path=str(tmp_path))
+    cache(['banana'])
+    with open(cache.vectors_path, 'ab') as f:
+        f.write(b'\x00' * 5)
+
+    reopened = CachedEmbeddingFunction(embedding, 'test-model', path=str(tmp_path))
+    assert os.path.getsize(reopened.vectors_path) == 3 * 4
+    vector = reopened(['cherry'])[0]
+    # The new vector landed on row 1, where the index says it is
+    assert np.array_equal(CachedEmbeddingFunction(embedding, 'test-model', path=str(tmp_path))(['cherry'])[0], vector)
+    assert reopened._rows[reopened.key_for('cherry')] == 1
+
+
+def test_stores_are_kept_per_model_name():
+    assert embedding_model_id('default') == 'all-MiniLM-L6-v2'
+    assert embedding_model_id('sentence-transformers:all-mpnet-base-v2') == 'sentence-transformers/all-mpnet-base-v2'
@@ -0,0 +1,109 @@
+import hashlib
+import numpy as np
+import pytest
+from ingest import CorpusIngestor, chunk_id, iter_file_chunks
+from vector_store import NumpyVectorStore
+
+
+class HashEmbedding:
+    def __call__(self, input):
+        return [np.frombuffer(hashlib.sha256(text.encode('utf-8')).digest()[:16], dtype=np.uint8).astype(np.float32) for text in input]
+
+
+class LocalHandler:
+    """
+    Just the parts of ChromaHandler the ingestor uses, backed by a NumPy store so no Chroma is needed. Records every text it embeds.
+    """
+    def __init__(self, path):
+        self.store = NumpyVectorStore(path)
+        self.embedded = []
+        self.embed = HashEmbedding()
+
+    @property
+    def chroma(self):
+        raise RuntimeError("no chroma client here")
+
+    def chroma_get_or_create_collection(self, name):
+        return self.store.get_or_create(name)
+
+    def embedding_function(self, texts):
+        self.embedded.extend(texts)
+        return self.embed(texts)
+
+    def lexical_note(self, collection, ids, documents):
+        pass
+
+
+class FailingCollection:
+    """
+    Passes upserts through until the allowed number have happened, then fails like a crash mid-run.
+    """
+    def __init__(self, collection, allowed):
+        self.collection = collection
+        self.allowed = allowed
+
+    def get(self, *args, **kwargs):
+        return self.collection.get(*args, **kwargs)
+
+    def upsert(self, *args, **kwargs):
+        if self.allowed == 0:
+            raise RuntimeError("killed")
+        self.allowed -= 1
+        self.collection.upsert(*args, **kwargs)
+
+
+def ingestor(handler):
+    return CorpusIngestor(handler, "test-kb", embed_batch_size=1, upsert_batch_size=2, workers=1, chunk_words=5, overlap=0)
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    path = tmp_path / "corpus.txt"
+    path.write_text(' '.join(f"word{index}" for index in range(40)))
+    return path
+
+
+def test_chunks_overlap_and_cover_the_file(tmp_path):
+    path = tmp_path / "text.txt"
+    path.write_text("a b c d e\nf g\n")
+    assert list(iter_file_chunks(path, chunk_words=4, overlap=2)) == ["a b c d", "c d e f", "e f g"]
+
+
+def test_interrupted_ingest_resumes_from_the_manifest(tmp_path, corpus):
+    manifest_path = tmp_path / ".ingest_manifest.json"
+    chunks = list(iter_file_chunks(corpus, chunk_words=5, overlap=0))
+    assert len(chunks) == 8
+
+    first = ingestor(LocalHandler(tmp_path / "store"))
+    first.collection = FailingCollection(first.collection, allowed=2)
+    with pytest.raises(RuntimeError):
+        first.ingest_paths([corpus], manifest_path=manifest_path)
+    record = CorpusIngestor.load_manifest(manifest_path)[str(corpus)]
+    assert record['chunks_done'] == 4
+    assert not record['complete']
+
+    handler = LocalHandler(tmp_path / "store")
+    report = ingestor(handler).ingest_paths([corpus], manifest_path=manifest_path)
+    # Only the chunks after the last committed upsert are read into batches and embedded again
+    assert handler.embedded == chunks[4:]
+    assert (report.chunks_resumed, report.chunks_seen, report.chunks_written) == (4, 4, 4)
+    assert CorpusIngestor.load_manifest(manifest_path)[str(corpus)]['complete']
+    stored = handler.store.get("test-kb")
+    assert sorted(stored.get()['ids']) == sorted(chunk_id(chunk) for chunk in chunks)
+
+
+def test_unchanged_files_are_skipped_and_changed_ones_redone(tmp_path, corpus):
+    manifest_path = tmp_path / ".ingest_manifest.json"
+    ingestor(LocalHandler(tmp_path / "store")).ingest_paths([corpus], manifest_path=manifest_path)
+
+    handler = LocalHandler(tmp_path / "store")
+    report = ingestor(handler).ingest_paths([corpus], manifest_path=manifest_path)
+    assert report.files_skipped == 1
+    assert handler.embedded == []
+
+    corpus.write_text(corpus.read_text() + " word40 word41 word42 word43 word44")
+    handler = LocalHandler(tmp_path / "store")
+    report = ingestor(handler).ingest_paths([corpus], manifest_path=manifest_path)
+    # Content-hash ids: the eight chunks already stored are found and not embedded again
+    assert report.chunks_existing == 8
+    assert handler.embedded == ["word40 word41 word42 word43 word44"]
@@ -0,0 +1,65 @@
+import math
+from lexical import BM25Index, reciprocal_rank_fusion, tokenize
+
+
+def filler(count: int) -> list:
+    return [f"the cat sat on mat number {index}" for index in range(count)]
+
+
+def test_tokenize_keeps_compound_names_and_their_parts():
+    assert tokenize("Edit config.yaml in UTF-8") == ['edit', 'config.yaml', 'config', 'yaml', 'in', 'utf-8', 'utf', '8']
+
+
+def test_search_ranks_the_exact_identifier_first():
+    index = BM25Index()
+    documents = filler(20) + ["the traceback came from vector_store.py line 12"]
+    index.add_many([f"doc-{i}" for i in range(len(documents))], documents)
+    results = index.search("error in vector_store.py", 3)
+    assert results[0][0] == "doc-20"
+    assert len(results) == 1
+
+
+def test_search_matches_the_bm25_formula():
+    index = BM25Index(k1=1.2, b=0.75)
+    index.add("a", "apple banana")
+    index.add("b", "banana cherry cherry")
+    (id, score), = index.search("apple", 5)
+    # One document out of two has the term, and "a" is shorter than average (2 vs 2.5)
+    idf = math.log(1 + (2 - 1 + 0.5) / (1 + 0.5))
+    norm = 1.2 * (1 - 0.75 + 0.75 * 2 / 2.5)
+    assert id == "a"
+    assert math.isclose(score, idf * 1 * 2.2 / (1 + norm))
+
+
+def test_terms_in_most_documents_are_skipped():
+    index = BM25Index(max_df=0.5)
+    index.add_many([f"doc-{i}" for i in range(20)], filler(20))
+    assert index.search("cat", 5) == []
+    assert index.search("cat 7", 5)[0][0] == "doc-7"
+
+
+def test_replacing_and_removing_documents():
+    index = BM25Index()
+    index.add("a", "first draft about zebras")
+    index.add("a", "second draft about giraffes")
+    assert index.search("zebras", 5) == []
+    assert [id for id, _ in index.search("giraffes", 5)] == ["a"]
+    index.remove("a")
+    assert len(index) == 0
+    assert index.search("giraffes", 5) == []
+    # The freed slot is reused
+    index.add("b", "giraffes again")
+    assert len(index.doc_ids) == 1
+    assert [id for id, _ in index.search("giraffes", 5)] == ["b"]
+
+
+def test_rrf_rewards_agreement_between_rankings():
+    fused = reciprocal_rank_fusion([["x", "y", "z"], ["y", "z", "x"]], k=60)
+    assert [id for id, _ in fused] == ["y", "x", "z"]
+    assert math.isclose(dict(fused)["y"], 1 / 62 + 1 / 61)
+
+
+def test_rrf_keeps_ids_found_by_one_ranking_only():
+    fused = dict(reciprocal_rank_fusion([["a"], ["b", "a"]]))
+    assert set(fused) == {"a", "b"}
+    assert fused["a"] > fused["b"]
@@ -0,0 +1,55 @@
+import time
+
+import numpy as np
+
+from chroma import ChromaHandler, memory_where
+from messages import Message, Turn
+from vector_store import matches_where
+
+
+class HashEmbedding:
+    model_name = 'hash-test'
+
+    def __call__(self, input):
+        return [np.full(8, float(len(text)), dtype=np.float32) for text in input]
+
+
+def test_memory_where_builds_chroma_filters():
+    assert memory_where() is None
+    assert memory_where(source='kb') == {'source': 'kb'}
+    assert memory_where(conversation='c1', speaker='juliet') == {'$and': [{'conversation': 'c1'}, {'speaker': 'juliet'}]}
+
+    before = time.time()
+    cutoff = memory_where(since_days=2)['timestamp']['$gte']
+    assert before - 2 * 86400 <= cutoff <= time.time() - 2 * 86400
+
+
+def test_turn_metadata_matches_its_own_filters():
+    request = Message(uuid='q1', role='user', speaker=None, content="Who was it?", timestamp='2024-01-01 @ 10:00')
+    response = Message(uuid='a1', role='assistant', speaker='Sherlock', content="The butler.", timestamp='2024-01-01 @ 10:01')
+    metadata = Turn(uuid='t1', request=request, response=response).to_memory_metadata('c1', 3)
+    # None values are left out, Chroma won't store them
+    assert 'speaker' not in metadata
+    assert matches_where(metadata, memory_where(conversation='c1', source='chat', since_days=1))
+    assert not matches_where(metadata, memory_where(source='kb'))
+    assert not matches_where(metadata, memory_where(speaker='juliet'))
+
+
+def test_query_only_returns_memories_passing_the_filter(tmp_path):
+    handler = ChromaHandler(path=str(tmp_path / 'chroma.db'), embedding=HashEmbedding(), max_numpy_documents=100)
+    collection = handler.chroma_get_or_create_collection('sherlock-juliet')
+    now = time.time()
+    handler.chroma_upsert_to_collection(collection, ["a recent chat", "a recent note", "an old chat"], [
+        {'source': 'chat', 'timestamp': now},
+        {'source': 'kb', 'timestamp': now},
+        {'source': 'chat', 'timestamp': now - 30 * 86400},
+    ], ["m1", "m2", "m3"])
+    handler.chroma_upsert_to_collection(collection, "no metadata at all", None, "m4")
+
+    def ids(where):
+        return sorted(handler.chroma_query_collection(collection, "chat", 10, where=where)['ids'][0])
+
+    assert ids(None) == ["m1", "m2", "m3", "m4"]
+    assert ids(memory_where(source='chat')) == ["m1", "m3"]
+    assert ids(memory_where(since_days=7)) == ["m1", "m2"]
+    assert ids(memory_where(source='chat', since_days=7)) == ["m1"]
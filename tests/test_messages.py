@@ -0,0 +1,41 @@
+from types import SimpleNamespace
+from messages import Message, MessageCache, Turn
+from utilities import message_cache_format_to_prompt
+
+
+def turn(index: int) -> Turn:
+    request = Message(uuid=f"q{index}", role='user', speaker='bob', content=f"question {index}\n\nwith a blank line", timestamp='2024-01-01 @ 10:00')
+    response = Message(uuid=f"a{index}", role='assistant', speaker='Sherlock', content=f"answer {index}\n", timestamp='2024-01-01 @ 10:01')
+    return Turn(uuid=f"t{index}", request=request, response=response)
+
+
+def agent_with_tokens(start_token: str, end_token: str):
+    return SimpleNamespace(instructions=SimpleNamespace(start_token=start_token, end_token=end_token))
+
+
+def test_ring_renders_exactly_like_formatting_every_turn():
+    cache = MessageCache(3, '<|im_start|>', '<|im_end|>')
+    for index in range(5):
+        cache.add_message(turn(index))
+        expected = message_cache_format_to_prompt(agent_with_tokens('<|im_start|>', '<|im_end|>'), cache.cache)
+        assert cache.render_history() == expected
+    assert len(cache.rendered) == len(cache.cache) == 3
+    assert cache.get_rendered_turns()[0][0].startswith('<|im_start|>bob (2024-01-01 @ 10:00):\nquestion 2\nwith')
+
+
+def test_changing_tokens_re_renders_the_ring():
+    cache = MessageCache(5, '<|im_start|>', '<|im_end|>')
+    for index in range(3):
+        cache.add_message(turn(index))
+    cache.set_tokens('[INST]', '[/INST]')
+    assert cache.render_history() == message_cache_format_to_prompt(agent_with_tokens('[INST]', '[/INST]'), cache.cache)
+    assert '<|im_start|>' not in cache.render_history()
+
+
+def test_chat_history_is_the_flattened_ring():
+    cache = MessageCache(2, '<s>', '</s>')
+    for index in range(3):
+        cache.add_message(turn(index))
+    history = cache.get_chat_history()
+    assert len(history) == 4
+    assert ''.join(history) == cache.render_history()
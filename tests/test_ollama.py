@@ -0,0 +1,69 @@
+import socket
+import pytest
+import requests
+from ollama import OllamaTransport, get_transport, ollama_base_url, parse_modelfile
+
+
+@pytest.mark.parametrize("url, expected", [
+    (None, "http://localhost:11434"),
+    ("http://127.0.0.1:11434/api/generate", "http://127.0.0.1:11434"),
+    ("https://ollama.example.com/api/generate", "https://ollama.example.com"),
+    ("gpu-box", "http://gpu-box:11434"),
+    ("gpu-box:8080/api/generate", "http://gpu-box:8080"),
+    ("[::1]", "http://[::1]:11434"),
+])
+def test_base_url_from_configured_url(monkeypatch, url, expected):
+    monkeypatch.delenv('OLLAMA_HOST', raising=False)
+    assert ollama_base_url(url) == expected
+
+
+@pytest.mark.parametrize("host, expected", [
+    ("gpu-box", "http://gpu-box:11434"),
+    (":9000", "http://127.0.0.1:9000"),
+    ("http://gpu-box", "http://gpu-box"),
+    ("  ", "http://127.0.0.1:11434"),
+])
+def test_ollama_host_takes_precedence(monkeypatch, host, expected):
+    monkeypatch.setenv('OLLAMA_HOST', host)
+    assert ollama_base_url("http://127.0.0.1:11434/api/generate") == expected
+
+
+def test_endpoints_on_one_server_share_a_transport(monkeypatch):
+    monkeypatch.delenv('OLLAMA_HOST', raising=False)
+    assert get_transport("http://127.0.0.1:11999/api/generate") is get_transport("http://127.0.0.1:11999/api/chat")
+    assert get_transport("http://127.0.0.1:11999") is not get_transport("http://127.0.0.1:11998")
+
+
+def test_stats_count_requests_and_bytes(fake_ollama):
+    transport = OllamaTransport(fake_ollama.url.rsplit('/api', 1)[0])
+    response = transport.post('/api/generate', {"model": "m", "prompt": "p", "stream": False})
+    assert response.json()["response"] == "Elementary, my dear Watson."
+    with transport.post('/api/generate', {"model": "m", "prompt": "p", "stream": True}, stream=True) as streamed:
+        assert len(list(transport.iter_lines(streamed))) == 5
+    stats = transport.stats
+    assert (stats.requests, stats.failures, stats.retries) == (2, 0, 0)
+    assert stats.bytes_sent > 0 and stats.bytes_received > len(response.content)
+    assert stats.total_latency >= stats.last_latency > 0
+    assert "2 requests (0 failed, 0 retries)" in stats.to_string()
+    transport.close()
+
+
+def test_connection_errors_are_retried_then_raised():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    transport = OllamaTransport(f"http://127.0.0.1:{port}", max_retries=2, backoff=0)
+    with pytest.raises(requests.ConnectionError):
+        transport.get('/api/tags')
+    assert (transport.stats.requests, transport.stats.failures, transport.stats.retries) == (1, 1, 2)
+    transport.close()
+
+
+def test_modelfile_becomes_create_fields():
+    modelfile = 'FROM llama3\nPARAMETER temperature 0.2\nPARAMETER num_ctx 4096\nPARAMETER stop "<|end|>"\nPARAMETER stop "User:"\nSYSTEM You are a detective.\nTEMPLATE """\n{{ .System }}\n{{ .Prompt }}\n"""\n'
+    assert parse_modelfile(modelfile) == {
+        'from': 'llama3',
+        'parameters': {'temperature': 0.2, 'num_ctx': 4096, 'stop': ['<|end|>', 'User:']},
+        'system': 'You are a detective.',
+        'template': '{{ .System }}\n{{ .Prompt }}',
+    }
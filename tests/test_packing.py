@@ -0,0 +1,91 @@
+from collections import deque
+from packing import TokenEstimator, align_history_start, pack_prompt_sections
+
+
+def pack(history, memories, budget, fixed_tokens=0):
+    # 4 characters per token, so a 40 character item costs 10 tokens
+    return pack_prompt_sections(fixed_tokens, history, memories, budget, 'model', TokenEstimator(default_chars_per_token=4.0))
+
+
+def item(label: str, tokens: int = 10) -> str:
+    return label.ljust(tokens * 4, '.')
+
+
+def test_everything_fits():
+    history = [item('h1'), item('h2')]
+    memories = [item('m1')]
+    kept_history, kept_memories, report = pack(history, memories, budget=100, fixed_tokens=20)
+    assert kept_history == history
+    assert kept_memories == memories
+    assert report.used_tokens == 50
+    assert not report.dropped_anything()
+
+
+def test_newest_history_and_best_memories_win():
+    history = [item('h1'), item('h2'), item('h3')]
+    memories = [item('m1'), item('m2'), item('m3')]
+    kept_history, kept_memories, report = pack(history, memories, budget=40)
+    # Taken alternately: h3, m1, h2, m2
+    assert kept_history == [item('h2'), item('h3')]
+    assert kept_memories == [item('m1'), item('m2')]
+    assert (report.history_dropped, report.memories_dropped) == (1, 1)
+
+
+def test_history_stays_contiguous():
+    # The oldest turn is small enough to fit, but the one after it isn't, so it goes too
+    history = [item('h1', 2), item('h2', 30), item('h3')]
+    kept_history, _, report = pack(history, [], budget=15)
+    assert kept_history == [item('h3')]
+    assert report.history_dropped == 2
+
+
+def test_memories_stay_a_top_k():
+    memories = [item('m1'), item('m2', 30), item('m3', 2)]
+    _, kept_memories, _ = pack([], memories, budget=15)
+    assert kept_memories == [item('m1')]
+
+
+def test_turns_can_be_request_response_pairs():
+    history = [(item('q1', 5), item('a1', 5)), (item('q2', 5), item('a2', 5))]
+    kept_history, _, report = pack(history, [], budget=15)
+    assert kept_history == [history[1]]
+    assert report.used_tokens == 10
+
+
+def test_fixed_tokens_come_off_the_budget():
+    kept_history, kept_memories, report = pack([item('h1')], [item('m1')], budget=20, fixed_tokens=15)
+    assert kept_history == [] and kept_memories == []
+    assert report.dropped_anything()
+
+
+def test_estimator_calibrates_towards_observed_ratio():
+    estimator = TokenEstimator(default_chars_per_token=4.0, smoothing=0.5)
+    assert estimator.estimate('x' * 10, 'm') == 3
+    estimator.calibrate('m', prompt_chars=1000, prompt_tokens=500)
+    assert estimator.chars_per_token('m') == 3.0
+    assert estimator.chars_per_token('other') == 4.0
+
+
+def test_estimator_ignores_short_and_implausible_observations():
+    estimator = TokenEstimator(default_chars_per_token=4.0)
+    estimator.calibrate('m', prompt_chars=100, prompt_tokens=50)
+    # A server-side prompt cache hit: almost nothing evaluated
+    estimator.calibrate('m', prompt_chars=10000, prompt_tokens=10)
+    assert estimator.chars_per_token('m') == 4.0
+
+
+def test_aligned_history_start_holds_for_a_block_of_turns():
+    ring = deque(maxlen=6)
+    starts = []
+    for turn in range(14):
+        ring.append(turn)
+        kept = align_history_start(list(ring), turn + 1, 3)
+        assert kept[-1] == turn
+        starts.append(kept[0])
+    # Untouched until the ring first evicts, then the start only moves every third turn
+    assert starts == [0, 0, 0, 0, 0, 0, 3, 3, 3, 6, 6, 6, 9, 9]
+
+
+def test_aligned_history_never_trims_everything():
+    assert align_history_start(['t9'], 10, 4) == ['t9']
+    assert align_history_start(['t8', 't9'], 10, 1) == ['t8', 't9']
@@ -0,0 +1,31 @@
+from messages import Message, Turn
+
+
+def turn(index: int) -> Turn:
+    request = Message(uuid=f"q{index}", role='user', speaker='juliet', content=f"question {index}", timestamp='2024-01-01 @ 10:00')
+    response = Message(uuid=f"a{index}", role='assistant', speaker='Sherlock', content=f"answer {index}", timestamp='2024-01-01 @ 10:01')
+    return Turn(uuid=f"t{index}", request=request, response=response)
+
+
+def prompts(agent, turns: int) -> list:
+    rendered = []
+    for index in range(turns):
+        rendered.append(agent.build_prompt(f"question {index}", username="juliet", agent_agent=True))
+        agent.message_cache.add_message(turn(index))
+    return rendered
+
+
+def test_history_prefix_holds_between_block_trims(make_agent):
+    agent = make_agent(prompt_layout='prefix_stable', history_turns=6, history_block=3)
+    rendered = prompts(agent, 15)
+    # Everything up to the end of the previous history is still the start of the next prompt, except on the turns a block is trimmed
+    broken = [index for index in range(1, len(rendered)) if not rendered[index].startswith(rendered[index - 1].split("\n<m>Context from memory")[0])]
+    assert broken == [7, 10, 13]
+
+
+def test_prefix_stable_layout_shares_more_than_classic(make_agent):
+    stable = make_agent(prompt_layout='prefix_stable', history_turns=6, history_block=3)
+    classic = make_agent(history_turns=6)
+    prompts(stable, 15)
+    prompts(classic, 15)
+    assert stable.prefix_cache_report()['mean_shared_ratio'] > classic.prefix_cache_report()['mean_shared_ratio']
@@ -0,0 +1,61 @@
+import numpy as np
+from chroma import ChromaHandler
+from rerank import RerankReport, mmr_select
+
+
+QUERY = [1.0, 0.0, 0.0]
+# Two near-copies of the best match, then a weaker but different one
+CANDIDATES = [[0.9, 0.1, 0.0], [0.9, 0.11, 0.0], [0.6, 0.0, 0.8]]
+
+
+class AxisEmbedding:
+    """
+    Embeds the query text "x" onto the x axis, enough for the reranker's query lookup.
+    """
+    def __call__(self, input):
+        return [np.array(QUERY if text == "x" else [0.0, 0.0, 1.0], dtype=np.float32) for text in input]
+
+
+def test_lambda_one_ranks_by_relevance_alone():
+    picked, duplicates = mmr_select(QUERY, CANDIDATES, 3, mmr_lambda=1.0)
+    assert picked == [0, 1, 2]
+    assert duplicates == 0
+
+
+def test_diversity_promotes_the_different_candidate():
+    picked, _ = mmr_select(QUERY, CANDIDATES, 2, mmr_lambda=0.5)
+    assert picked == [0, 2]
+
+
+def test_near_duplicates_are_dropped_and_counted():
+    picked, duplicates = mmr_select(QUERY, CANDIDATES, 3, mmr_lambda=1.0, duplicate_similarity=0.99)
+    assert picked == [0, 2]
+    assert duplicates == 1
+
+
+def test_nothing_to_pick():
+    assert mmr_select(QUERY, np.empty((0, 3)), 3) == ([], 0)
+    assert mmr_select(QUERY, CANDIDATES, 0) == ([], 0)
+
+
+def test_rerank_results_cuts_distant_and_duplicate_memories(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    handler = ChromaHandler(path=str(tmp_path / "chroma.db"), embedding=AxisEmbedding())
+    far = [0.0, 0.0, 1.0]
+    results = {
+        'ids': [["a", "b", "c", "d"]],
+        'documents': [["first", "copy of first", "sideways", "unrelated"]],
+        'metadatas': [[None, None, None, None]],
+        'distances': [[float(np.sum((np.array(vector) - QUERY) ** 2)) for vector in CANDIDATES + [far]]],
+        'embeddings': [CANDIDATES + [far]],
+    }
+    reranked, report = handler.chroma_rerank_results(results, "x", 3, max_distance=1.0, mmr_lambda=1.0, duplicate_similarity=0.99)
+    assert reranked['ids'] == [["a", "c"]]
+    assert reranked['documents'] == [["first", "sideways"]]
+    assert (report.candidates, report.too_distant, report.redundant, report.kept) == (4, 1, 1, 2)
+
+
+def test_report_never_claims_negative_savings():
+    report = RerankReport(tokens_before=10, tokens_after=12)
+    assert report.tokens_saved == 0
+    assert report.to_dict()['tokens_saved'] == 0
@@ -0,0 +1,60 @@
+import os
+from response_cache import ResponseCache
+
+
+def payload(prompt="hello", **options):
+    return {"model": "mistral", "prompt": prompt, "options": {"temperature": 0, **options}}
+
+
+def test_key_is_stable_and_covers_everything_that_changes_the_reply():
+    key = ResponseCache.key_for(payload())
+    assert key == ResponseCache.key_for(payload())
+    assert key != ResponseCache.key_for(payload(prompt="hello!"))
+    assert key != ResponseCache.key_for(payload(num_ctx=8192))
+    assert key != ResponseCache.key_for({**payload(), "model": "llama3"})
+    assert key != ResponseCache.key_for({**payload(), "context": [1, 2, 3]})
+
+
+def test_key_ignores_option_order():
+    first = {"model": "m", "prompt": "p", "options": {"temperature": 0, "seed": 1}}
+    second = {"model": "m", "prompt": "p", "options": {"seed": 1, "temperature": 0}}
+    assert ResponseCache.key_for(first) == ResponseCache.key_for(second)
+
+
+def test_only_reproducible_requests_are_cacheable():
+    assert ResponseCache.is_deterministic(payload())
+    assert ResponseCache.is_deterministic(payload(temperature=0.8, seed=42))
+    assert not ResponseCache.is_deterministic(payload(temperature=0.8))
+    assert not ResponseCache.is_deterministic(payload(temperature=0.8, seed=-1))
+    assert not ResponseCache.is_deterministic(payload(mirostat=2))
+    assert not ResponseCache.is_deterministic({"model": "m", "prompt": "p"})
+
+
+def test_memory_lru_evicts_least_recently_used_and_disk_still_answers(tmp_path):
+    cache = ResponseCache(path=str(tmp_path), max_memory_entries=2)
+    for name in ("a", "b", "c"):
+        cache.put(name * 8, {"response": name})
+    assert list(cache._memory) == ["bbbbbbbb", "cccccccc"]
+    assert cache.get("aaaaaaaa") == {"response": "a"}
+    assert (cache.stats.memory_hits, cache.stats.disk_hits) == (0, 1)
+    # The disk hit was promoted, pushing out the oldest in memory
+    assert list(cache._memory) == ["cccccccc", "aaaaaaaa"]
+    assert cache.get("cccccccc") == {"response": "c"}
+    assert cache.stats.memory_hits == 1
+    assert cache.get("dddddddd") is None
+    assert cache.stats.misses == 1
+    assert cache.stats.to_string().startswith("Response cache: 67% hit rate (1 memory, 1 disk, 1 generated")
+
+
+def test_disk_tier_is_trimmed_oldest_first(tmp_path):
+    entry = {"response": "x" * 100}
+    cache = ResponseCache(path=str(tmp_path), max_disk_bytes=10000)
+    for index, name in enumerate(("a", "b", "c")):
+        cache.put(name * 8, entry)
+        os.utime(cache._entry_path(name * 8), (1000 + index, 1000 + index))
+    size = cache._entry_path("aaaaaaaa").stat().st_size
+    cache.max_disk_bytes = size * 3
+    cache.put("dddddddd", entry)
+    assert not cache._entry_path("aaaaaaaa").exists()
+    assert all(cache._entry_path(name * 8).exists() for name in ("b", "c", "d"))
+    assert cache.stats.disk_evictions == 1
@@ -0,0 +1,53 @@
+import os
+
+import runtime
+from runtime import AgentRuntime
+
+
+def test_get_agent_is_case_insensitive_and_reloads_after_edits(make_agent, monkeypatch):
+    agent_runtime = AgentRuntime()
+    loaded = []
+    monkeypatch.setattr(agent_runtime, 'new_agent', lambda name: loaded.append(name) or make_agent(name))
+
+    first = agent_runtime.get_agent('Sherlock')
+    assert agent_runtime.get_agent('sherlock') is first
+    assert list(agent_runtime.agents) == ['sherlock']
+    assert (agent_runtime.stats.agents_loaded, agent_runtime.stats.agents_reused) == (1, 1)
+
+    # The agent's yaml changing on disk gets it reloaded
+    os.makedirs('agents/sherlock')
+    with open('agents/sherlock/instructions.yaml', 'w') as file:
+        file.write("name: Sherlock\n")
+    reloaded = agent_runtime.get_agent('SHERLOCK')
+    assert reloaded is not first
+    assert agent_runtime.stats.agents_reloaded == 1
+    assert len(loaded) == 2
+
+
+def test_register_and_forget_use_the_lowercased_name(make_agent):
+    agent_runtime = AgentRuntime()
+    agent = make_agent('Sherlock')
+    agent_runtime.register_agent(agent)
+    assert agent_runtime.agents == {'sherlock': agent}
+    assert agent_runtime.get_agent('Sherlock') is agent
+    agent_runtime.forget_agent('SHERLOCK')
+    assert agent_runtime.agents == {}
+
+
+def test_shared_handler_and_toolbox_count_reuses(monkeypatch):
+    created = []
+    monkeypatch.setattr(runtime, 'ChromaHandler', lambda: created.append(1) or object())
+    agent_runtime = AgentRuntime()
+    agent_runtime._tool_manager = object()
+
+    handler = agent_runtime.share_chroma_handler()
+    assert agent_runtime.share_chroma_handler() is handler
+    assert agent_runtime.chroma_handler is handler
+    agent_runtime.share_tool_manager()
+    agent_runtime.share_tool_manager()
+
+    stats = agent_runtime.stats
+    assert len(created) == stats.chroma_handlers_created == 1
+    # The first consumer created it, only the second counts as a reuse and plain property access isn't counted
+    assert stats.chroma_handler_reuses == 1
+    assert (stats.tool_loads, stats.tool_reuses) == (0, 2)
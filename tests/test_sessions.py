@@ -0,0 +1,61 @@
+from messages import SessionContext
+
+
+def test_context_is_only_valid_for_the_same_model_and_instructions():
+    session = SessionContext(agent="Sherlock", username="juliet", llm_model="llama3", instructions_fingerprint="abc", context=[1, 2, 3])
+    assert session.is_valid_for("llama3", "abc")
+    assert not session.is_valid_for("mistral", "abc")
+    assert not session.is_valid_for("llama3", "def")
+    session.memory_ids = ["m1"]
+    session.reset()
+    assert (session.context, session.memory_ids) == ([], [])
+    assert not session.is_valid_for("llama3", "abc")
+
+
+def test_saved_context_is_picked_up_again(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    SessionContext(agent="Sherlock", username="juliet", llm_model="llama3", instructions_fingerprint="abc", context=[1, 2], memory_ids=["m1"]).save()
+    assert (tmp_path / "agents/sherlock/contexts/juliet.json").exists()
+    loaded = SessionContext.load("Sherlock", "juliet")
+    assert loaded.context == [1, 2] and loaded.memory_ids == ["m1"] and loaded.is_valid_for("llama3", "abc")
+    assert SessionContext.load("Sherlock", "watson").context == []
+
+
+def test_second_turn_sends_only_the_new_turn_with_the_context(make_agent, fake_ollama):
+    agent = make_agent(incremental=True)
+    assert agent.incremental
+    first = agent.build_prompt("Who did it?", username="juliet", agent_agent=True)
+    assert first.startswith("<s>System: \nYou are a detective.")
+    agent.generate_response(first)
+    assert "context" not in fake_ollama.requests[-1]
+
+    second = agent.build_prompt("Are you sure?", username="juliet", agent_agent=True)
+    assert second == "<s>juliet: \nAre you sure?</s>\n<s>Sherlock: \n"
+    agent.generate_response(second)
+    assert fake_ollama.requests[-1]["context"] == [0]
+    # The context from the second reply is the one kept for the third turn
+    assert agent.session_for("juliet").context == [0, 1]
+
+
+def test_editing_the_instructions_forces_a_full_prompt(make_agent):
+    agent = make_agent(incremental=True)
+    agent.generate_response(agent.build_prompt("Who did it?", username="juliet", agent_agent=True))
+    agent.instructions.system_message = "You are a retired detective."
+    prompt = agent.build_prompt("Are you sure?", username="juliet", agent_agent=True)
+    assert prompt.startswith("<s>System: \nYou are a retired detective.")
+    assert "context" not in agent.completion_payload(prompt)
+
+
+def test_a_new_session_resumes_from_the_saved_context(make_agent):
+    agent = make_agent(incremental=True)
+    agent.generate_response(agent.build_prompt("Who did it?", username="juliet", agent_agent=True))
+    later = make_agent(incremental=True)
+    prompt = later.build_prompt("Are you sure?", username="juliet", agent_agent=True)
+    assert prompt == "<s>juliet: \nAre you sure?</s>\n<s>Sherlock: \n"
+
+
+def test_incremental_is_off_unless_configured(make_agent):
+    agent = make_agent()
+    assert not agent.incremental
+    agent.generate_response(agent.build_prompt("Who did it?", username="juliet", agent_agent=True))
+    assert agent.build_prompt("Are you sure?", username="juliet", agent_agent=True).startswith("<s>System: ")
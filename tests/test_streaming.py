@@ -0,0 +1,29 @@
+from utilities import stream_agent_tokens
+
+
+def test_stream_yields_tokens_and_records_latency(make_agent, fake_ollama):
+    agent = make_agent()
+    tokens = list(agent.generate_response_stream("Who did it?"))
+    assert tokens == fake_ollama.tokens
+    assert fake_ollama.requests[-1]['stream'] is True
+    assert agent.last_response == "Elementary, my dear Watson."
+    stats = agent.last_stats
+    assert stats.streamed and not stats.cached
+    assert 0 < stats.time_to_first_token <= stats.total_latency
+    assert (stats.prompt_eval_count, stats.eval_count) == (12, 4)
+
+
+def test_blocking_generation_records_the_same_stats(make_agent, fake_ollama):
+    agent = make_agent()
+    assert agent.generate_response("Who did it?") == "Elementary, my dear Watson."
+    assert fake_ollama.requests[-1]['stream'] is False
+    stats = agent.last_stats
+    assert not stats.streamed
+    # Nothing shows up before the whole reply does
+    assert stats.time_to_first_token == stats.total_latency > 0
+    assert stats.eval_count == 4
+
+
+def test_stream_agent_tokens_prints_as_it_goes_and_returns_the_text(capsys):
+    assert stream_agent_tokens("Sherlock", iter(["Ele", "mentary"])) == "Elementary"
+    assert capsys.readouterr().out.startswith("\nSherlock>> Elementary")
@@ -0,0 +1,39 @@
+from agents import compile_prompt_template
+
+
+def test_fingerprint_is_memoised_until_a_field_changes(make_agent):
+    instructions = make_agent().instructions
+    first = instructions.fingerprint()
+    assert instructions.__dict__['_fingerprint'] == first
+    assert instructions.fingerprint() == first
+
+    instructions.assistant_focus = "the hound"
+    assert instructions.__dict__['_fingerprint'] is None
+    assert instructions.fingerprint() != first
+
+    # Same fields, same fingerprint
+    instructions.assistant_focus = "the case"
+    assert instructions.fingerprint() == first
+
+
+def test_compiled_template_is_reused_and_recompiled_after_an_edit(make_agent):
+    instructions = make_agent().instructions
+    compiled = compile_prompt_template(instructions)
+    assert compile_prompt_template(instructions) is compiled
+    assert compiled.placeholders == {'context', 'history', 'username', 'user_input'}
+    assert "the case" in compiled.template.template
+
+    instructions.assistant_focus = "the hound"
+    recompiled = compile_prompt_template(instructions)
+    assert recompiled is not compiled
+    assert recompiled.fingerprint == instructions.fingerprint()
+    assert "the hound" in recompiled.template.template
+
+
+def test_prompt_layout_change_recompiles_the_template(make_agent):
+    agent = make_agent()
+    classic = compile_prompt_template(agent.instructions)
+    agent.instructions.prompt_layout = 'prefix_stable'
+    stable = compile_prompt_template(agent.instructions)
+    assert stable.template.template != classic.template.template
+    assert stable.template.template.index("$history") < stable.template.template.index("$context")
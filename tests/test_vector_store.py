@@ -0,0 +1,62 @@
+import numpy as np
+from vector_store import ChromaCollection, ChromaVectorStore, NumpyCollection, NumpyVectorStore, TieredVectorStore, matches_where
+
+
+def vectors(*rows):
+    return np.array(rows, dtype=np.float32)
+
+
+def test_query_ranks_by_squared_l2_and_applies_where(tmp_path):
+    collection = NumpyVectorStore(tmp_path).get_or_create('mem-test')
+    collection.upsert(ids=['a', 'b', 'c'], documents=['a', 'b', 'c'], embeddings=vectors([1, 0], [0, 1], [0.9, 0.1]),
+                      metadatas=[{'turn': 1}, {'turn': 2}, {'turn': 3}])
+    results = collection.query(query_embeddings=[[1, 0]], n_results=2)
+    assert results['ids'] == [['a', 'c']]
+    assert np.allclose(results['distances'][0], [0.0, 0.02])
+    filtered = collection.query(query_embeddings=[[1, 0]], n_results=2, where={'turn': {'$gte': 2}})
+    assert filtered['ids'] == [['c', 'b']]
+
+
+def test_every_write_is_on_disk_straight_away(tmp_path):
+    collection = NumpyVectorStore(tmp_path).get_or_create('mem-test')
+    collection.upsert(ids=['a'], documents=['a'], embeddings=vectors([1, 0]))
+    assert NumpyVectorStore(tmp_path).get('mem-test').get()['ids'] == ['a']
+    collection.delete(ids=['a'])
+    assert NumpyVectorStore(tmp_path).get('mem-test').count() == 0
+
+
+def test_writes_from_another_store_are_picked_up_not_overwritten(tmp_path):
+    # Two stores on one directory stand in for a chat and a CLI job in separate processes
+    chat = NumpyVectorStore(tmp_path).get_or_create('mem-test')
+    job = NumpyVectorStore(tmp_path).get('mem-test')
+    chat.upsert(ids=['a'], documents=['a'], embeddings=vectors([1, 0]))
+    job.upsert(ids=['b'], documents=['b'], embeddings=vectors([0, 1]))
+    assert sorted(chat.get()['ids']) == ['a', 'b']
+    chat.upsert(ids=['c'], documents=['c'], embeddings=vectors([1, 1]))
+    assert sorted(job.get()['ids']) == ['a', 'b', 'c']
+    job.delete(ids=['a'])
+    assert chat.count() == 2
+
+
+def test_collections_are_promoted_past_their_own_limit(tmp_path):
+    store = TieredVectorStore(ChromaVectorStore(str(tmp_path / 'chroma')), NumpyVectorStore(tmp_path / 'numpy'), max_numpy_documents=5000)
+    store.set_limit('mem-small', 1)
+    small = store.get_or_create('mem-small')
+    big = store.get_or_create('mem-big')
+    assert isinstance(small.backing, NumpyCollection) and isinstance(big.backing, NumpyCollection)
+    small.upsert(ids=['a', 'b'], documents=['a', 'b'], embeddings=vectors([1, 0], [0, 1]))
+    big.upsert(ids=['a', 'b'], documents=['a', 'b'], embeddings=vectors([1, 0], [0, 1]))
+    assert isinstance(small.backing, ChromaCollection) and small.count() == 2
+    assert small.query(query_embeddings=[[1, 0]], n_results=1, include=['documents'])['ids'] == [['a']]
+    assert small.get(where=None)['ids'] == ['a', 'b']
+    assert isinstance(big.backing, NumpyCollection)
+    assert store.promotions == 1
+
+
+def test_matches_where_operators():
+    metadata = {'source': 'chat', 'turn': 4}
+    assert matches_where(metadata, {'source': 'chat'})
+    assert matches_where(metadata, {'$and': [{'turn': {'$gt': 3}}, {'source': {'$in': ['chat', 'kb']}}]})
+    assert not matches_where(metadata, {'$or': [{'turn': {'$lt': 2}}, {'source': 'kb'}]})
+    assert not matches_where(metadata, {'missing': 1})
+    assert not matches_where(None, {'source': 'chat'})
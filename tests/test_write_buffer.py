@@ -0,0 +1,55 @@
+import time
+from chroma import MemoryWriteBuffer
+
+
+class StubHandler:
+    def embedding_function(self, texts):
+        return [[float(len(text))] for text in texts]
+
+
+class FlakyCollection:
+    name = 'mem-test'
+
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.attempts = []
+        self.stored = {}
+
+    def upsert(self, ids, documents, embeddings, metadatas=None):
+        self.attempts.append(time.monotonic())
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("database is locked")
+        self.stored.update(zip(ids, documents))
+
+
+def wait_for(condition, timeout: float = 3.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_failed_batches_back_off_then_succeed(capsys):
+    buffer = MemoryWriteBuffer(StubHandler(), max_delay=0.01, max_retries=5, retry_delay=0.1)
+    collection = FlakyCollection(failures=2)
+    buffer.add(collection, 'remember this', None, 'm1')
+    wait_for(lambda: collection.stored)
+    buffer.close()
+    assert collection.stored == {'m1': 'remember this'}
+    assert len(collection.attempts) == 3
+    gaps = [later - earlier for earlier, later in zip(collection.attempts, collection.attempts[1:])]
+    assert gaps[0] >= 0.1 and gaps[1] >= 0.2
+    assert capsys.readouterr().out.count("Error flushing memories") == 2
+    assert buffer.pending('mem-test') == []
+
+
+def test_batches_are_dropped_after_the_last_retry(capsys):
+    buffer = MemoryWriteBuffer(StubHandler(), max_delay=0.01, max_retries=2, retry_delay=0.05)
+    collection = FlakyCollection(failures=100)
+    buffer.add(collection, 'lost', None, 'm1')
+    wait_for(lambda: buffer.documents_dropped)
+    buffer.close()
+    assert len(collection.attempts) == 3
+    assert buffer.documents_dropped == 1
+    assert buffer.pending('mem-test') == []
+    assert "Gave up after 2 retries" in capsys.readouterr().out
@@ -1,51 +1,70 @@
+import hashlib
 import json
 import os
 from pathlib import Path
 import shutil
 import subprocess
 import sys
-import time
 from typing import List
 import yaml
-import nltk
-from nltk import pos_tag
-from nltk.chunk.regexp import RegexpParser
-from nltk.tokenize import word_tokenize
 from messages import format_chat_history
+from renderer import get_renderer
+
+
+BANNER_CACHE_DIR = Path('library/banners')
+# (text, filter) -> rendered banner, so menus only ever hit the disk once per process
+_banner_cache = {}
 
 
 def stream_terminal_output(text: str, delay: float=0.05) -> None:
     """
-    Print string one character at a time with a defined delay between characters. I do not like relying on streaming methods from completion endpoints. This is a better way to do it anyway. Agents can talk at different speeds depending on need and will be able to be changed en-chat with a parsed command (eventually)
+    Type a string out to the terminal through the shared TerminalRenderer, a word at a time paced at one character per delay, and wait until it's done. Any key skips to the end. I do not like relying on streaming methods from completion endpoints. This is a better way to do it anyway. Agents can talk at different speeds depending on need and will be able to be changed en-chat with a parsed command (eventually).
 
     :param text: The string to print
-    :param delay: The delay between printing each character
+    :param delay: Seconds per character, so a word takes its length times this. 0 prints it all at once.
     :returns: Prints streaming text to terminal
     """
-    for char in text:
-        sys.stdout.write(char)
-        sys.stdout.flush()  # Ensure char is displayed immediately
-        time.sleep(delay)   # Wait a bit before printing the next one
-    print()  # Move to the next line
+    renderer = get_renderer()
+    renderer.submit(text, chars_per_second=1 / delay if delay else 0)
+    renderer.wait()
 
 
-def stream_agent_response(agent_name, text: str, delay: int) -> None:
+def stream_agent_response(agent_name, text: str, delay: int, wait: bool = True) -> None:
     """
-    Print string one character at a time.
+    Type an agent's response out through the shared TerminalRenderer, a word at a time paced at one character per delay, after an "agent_name>> " prefix. Any key skips to the end.
 
+    :param agent_name: The name to prepend to the response.
     :param text: The string to print
-    :param delay: The delay between printing each character
+    :param delay: Seconds per character, so a word takes its length times this. 0 prints it all at once.
+    :param wait: Block until it has been typed out. Pass False to carry on while it renders, then call get_renderer().wait() before printing anything else or asking for input.
     :returns: Prints streaming text to terminal with Agent_Name prepended for terminal chat formatting.
     """
+    renderer = get_renderer()
+    renderer.submit(text, prefix=f"\n{agent_name}>> ", chars_per_second=1 / delay if delay else 0)
+    if wait:
+        renderer.wait()
+
+
+def stream_agent_tokens(agent_name, tokens) -> str:
+    """
+    Print tokens to the terminal as the model produces them. Same formatting as stream_agent_response, but the pace is set by the server instead of a delay so the first words show up as soon as they are generated.
+
+    :param agent_name: The name to prepend to the response.
+    :param tokens: An iterable of token strings, usually Agent.generate_response_stream.
+    :returns: The full response text once the stream is exhausted.
+    """
     sys.stdout.write(f"\n{agent_name}>> ")
-    sys.stdout.flush()  # Flush to ensure bot_name is printed immediately
+    sys.stdout.flush()
 
-    for char in text:
-        sys.stdout.write(char)
-        sys.stdout.flush()  # Ensure char is displayed immediately
-        time.sleep(delay)   # Wait a bit before printing the next one
+    text = []
+    for token in tokens:
+        sys.stdout.write(token)
+        sys.stdout.flush()
+        text.append(token)
     print()  # Move to the next line
 
+    return "".join(text)
+
 
 def create_agent_structure(agent_name: str) -> None:
     """
@@ -238,33 +257,76 @@ def update_parameters(parameters):
     return '\n'.join(updated_params)
 
 
+def render_banner(text: str, toilet_filter: str = None) -> str:
+    """
+    Render a banner with toilet, once. The ANSI output is kept in memory and under library/banners, so returning to a menu never forks again. Without toilet installed the text comes back as is (and is not written to disk, so installing toilet later just works).
+
+    :param text: The text to bannerize.
+    :param toilet_filter: toilet --filter argument, e.g. 'metal' or 'border:metal'. None for the plain font.
+    :returns: The rendered banner.
+    """
+    key = (text, toilet_filter)
+    banner = _banner_cache.get(key)
+    if banner is not None:
+        return banner
+
+    digest = hashlib.sha1(f"{toilet_filter}\0{text}".encode('utf-8')).hexdigest()
+    banner_path = BANNER_CACHE_DIR / f"{digest}.txt"
+    try:
+        banner = banner_path.read_text(encoding='utf-8')
+    except OSError:
+        if shutil.which('toilet') is None:
+            banner = f"\n{text}\n"
+        else:
+            command = ['toilet', text] if toilet_filter is None else ['toilet', '--filter', toilet_filter, text]
+            banner = subprocess.run(command, stdout=subprocess.PIPE).stdout.decode('utf-8')
+            try:
+                BANNER_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+                banner_path.write_text(banner, encoding='utf-8')
+            except OSError as e:
+                print(f"Error caching banner: {e}")
+
+    _banner_cache[key] = banner
+    return banner
+
+
 def toilet_banner_plain(text):
     """
-    Toilet subprocess helper for simple pre-stylized banner for prettier outputs. -> Plain
+    Toilet helper for simple pre-stylized banner for prettier outputs. -> Plain
 
     :param text: The text to bannerize.
     """
-    banner = subprocess.run(['toilet', text], stdout=subprocess.PIPE)
-    print(banner.stdout.decode('utf-8'))
+    print(render_banner(text))
 
 
 def toilet_banner_metal(text):
     """
-    Toilet subprocess helper for simple pre-stylized banner for prettier outputs. -> Metal
+    Toilet helper for simple pre-stylized banner for prettier outputs. -> Metal
 
     :param text: The text to bannerize.
     :return: Print the bannerized text.
     """ 
-    banner = subprocess.run(['toilet', '--filter', 'metal', text], stdout=subprocess.PIPE)
-    print(banner.stdout.decode('utf-8'))
+    print(render_banner(text, 'metal'))
 
 
 def toilet_banner_border_metal(text):
     """
-    Toilet subprocess helper for simple pre-stylized banner for prettier outputs. -> Borderized:Metal
+    Toilet helper for simple pre-stylized banner for prettier outputs. -> Borderized:Metal
     """
-    banner = subprocess.run(['toilet', '--filter', 'border:metal', text], stdout=subprocess.PIPE)
-    print(banner.stdout.decode('utf-8'))
+    print(render_banner(text, 'border:metal'))
+
+
+def shared_prefix_length(previous: str, current: str) -> int:
+    """
+    Number of leading characters two prompts have in common. Ollama can only reuse its prompt cache up to the first difference, so this is a good proxy for how much of a prompt did not need to be evaluated again.
+
+    :param previous: The prompt sent on the previous turn.
+    :param current: The prompt for this turn.
+    :returns: Length of the common prefix in characters.
+    """
+    if previous is None or current is None:
+        return 0
+    return len(os.path.commonprefix([previous, current]))
 
 
 def message_cache_format_to_prompt(agent, message_history):
@@ -306,6 +368,8 @@ def initialize_nltk_punkt_tagger():
     """
     Initialize the NLTK Punkt Tokenizer for sentence segmentation.
     """
+    import nltk  # Slow to import, only needed here
+
     # Download the Punkt Tokenizer Models
     nltk.download('punkt')
     print("NLTK Punkt tokenizer downloaded.")
@@ -0,0 +1,785 @@
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+import json
+import os
+from pathlib import Path
+import re
+import shutil
+import threading
+from typing import Dict, List
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: snapshots are still written atomically but only one process should use a store at a time
+    fcntl = None
+
+
+# Chroma's own rule, kept for NumPy collections too so any of them can be promoted
+COLLECTION_NAME_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]{1,510}[A-Za-z0-9]$")
+SNAPSHOT_NAME = 'snapshot.npz'
+COMPARISONS = {
+    '$eq': lambda value, target: value == target,
+    '$ne': lambda value, target: value != target,
+    '$gt': lambda value, target: value > target,
+    '$gte': lambda value, target: value >= target,
+    '$lt': lambda value, target: value < target,
+    '$lte': lambda value, target: value <= target,
+    '$in': lambda value, target: value in target,
+    '$nin': lambda value, target: value not in target,
+}
+
+
+def matches_where(metadata: dict, where: dict) -> bool:
+    """
+    Whether a metadata dict passes a Chroma-style where filter ({"key": value}, {"key": {"$gte": 3}}, {"$and": [...]}, {"$or": [...]}). Used wherever Chroma isn't there to apply the filter itself: NumPy collections and documents still in the write-behind buffer. A document without the key never matches, as in Chroma.
+
+    :param metadata: The document's metadata, or None.
+    :param where: The filter. None or {} matches everything.
+    """
+    if not where:
+        return True
+    for key, condition in where.items():
+        if key == '$and':
+            if not all(matches_where(metadata, clause) for clause in condition):
+                return False
+        elif key == '$or':
+            if not any(matches_where(metadata, clause) for clause in condition):
+                return False
+        else:
+            if not metadata or key not in metadata:
+                return False
+            value = metadata[key]
+            comparisons = condition.items() if isinstance(condition, dict) else [('$eq', condition)]
+            try:
+                if not all(COMPARISONS[operator](value, target) for operator, target in comparisons):
+                    return False
+            except TypeError:
+                return False
+    return True
+
+
+class VectorCollection(ABC):
+    """
+    The part of chromadb's Collection API ChromaHandler uses, so a collection can live in any backend. Arguments and results are Chroma's: ids, documents, metadatas and embeddings as parallel lists, and query results nested one list per query.
+    """
+    name: str
+
+    @abstractmethod
+    def count(self) -> int:
+        """
+        Number of documents in the collection.
+        """
+
+    @abstractmethod
+    def upsert(self, ids, documents=None, metadatas=None, embeddings=None, **kwargs) -> None:
+        """
+        Insert documents, replacing any with the same id. Documents without embeddings are embedded with the collection's embedding function.
+        """
+
+    def add(self, ids, documents=None, metadatas=None, embeddings=None, **kwargs) -> None:
+        self.upsert(ids, documents=documents, metadatas=metadatas, embeddings=embeddings, **kwargs)
+
+    @abstractmethod
+    def query(self, query_embeddings=None, query_texts=None, n_results: int = 10, include: List[str] = None, where: dict = None, **kwargs) -> dict:
+        """
+        The n_results nearest documents to each query, nearest first, with squared L2 distances.
+        """
+
+    @abstractmethod
+    def get(self, ids=None, include: List[str] = None, limit: int = None, offset: int = None, where: dict = None, **kwargs) -> dict:
+        """
+        Documents by id and/or where filter, in insertion order.
+        """
+
+    @abstractmethod
+    def delete(self, ids=None, where: dict = None, **kwargs) -> None:
+        """
+        Delete documents by id and/or where filter.
+        """
+
+    @abstractmethod
+    def modify(self, name: str = None, metadata: dict = None, **kwargs) -> None:
+        """
+        Rename the collection.
+        """
+
+
+class VectorStore(ABC):
+    """
+    Where collections live. ChromaHandler only talks to a VectorStore, and the collections a store hands out are VectorCollections.
+    """
+    @abstractmethod
+    def get_or_create(self, name: str, embedding_function=None) -> VectorCollection:
+        """
+        Load a collection, creating it if it doesn't exist.
+
+        :param name: The collection's name.
+        :param embedding_function: Used to create it, and to embed documents upserted without embeddings.
+        """
+
+    @abstractmethod
+    def get(self, name: str) -> VectorCollection:
+        """
+        Load an existing collection. Raises ValueError if there is none.
+        """
+
+    @abstractmethod
+    def exists(self, name: str) -> bool:
+        """
+        Whether the store has a collection by that name.
+        """
+
+    @abstractmethod
+    def delete(self, name: str) -> None:
+        """
+        Delete a collection and everything in it.
+        """
+
+    def close(self) -> None:
+        """
+        Persist anything not yet on disk.
+        """
+
+
+class ChromaVectorStore(VectorStore):
+    """
+    Collections in a Chroma PersistentClient (SQLite + HNSW). Meant for the big ones.
+
+    :param path: Directory of the chroma store.
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    @property
+    def client(self):
+        from chroma import get_chroma_client
+        return get_chroma_client(self.path)
+
+    def has_store(self) -> bool:
+        """
+        Whether there is a chroma store on disk at all, so callers can skip opening the client when there isn't.
+        """
+        return os.path.exists(os.path.join(self.path, 'chroma.sqlite3'))
+
+    def get_or_create(self, name: str, embedding_function=None) -> 'ChromaCollection':
+        return ChromaCollection(self.client.get_or_create_collection(name=name, embedding_function=embedding_function))
+
+    def get(self, name: str) -> 'ChromaCollection':
+        return ChromaCollection(self.client.get_collection(name=name))
+
+    def exists(self, name: str) -> bool:
+        if not self.has_store():
+            return False
+        try:
+            self.client.get_collection(name=name)
+            return True
+        except Exception:
+            return False
+
+    def delete(self, name: str) -> None:
+        self.client.delete_collection(name=name)
+
+    def max_batch_size(self) -> int:
+        return self.client.get_max_batch_size()
+
+
+class ChromaCollection(VectorCollection):
+    """
+    A chromadb Collection behind the VectorCollection interface.
+
+    :param collection: The chromadb Collection.
+    """
+    def __init__(self, collection) -> None:
+        self.collection = collection
+
+    @property
+    def name(self) -> str:
+        return self.collection.name
+
+    def count(self) -> int:
+        return self.collection.count()
+
+    def upsert(self, ids, documents=None, metadatas=None, embeddings=None, **kwargs) -> None:
+        self.collection.upsert(ids=ids, documents=documents, metadatas=metadatas, embeddings=embeddings, **kwargs)
+
+    def add(self, ids, documents=None, metadatas=None, embeddings=None, **kwargs) -> None:
+        self.collection.add(ids=ids, documents=documents, metadatas=metadatas, embeddings=embeddings, **kwargs)
+
+    def query(self, query_embeddings=None, query_texts=None, n_results: int = 10, include: List[str] = None, where: dict = None, **kwargs) -> dict:
+        if include is not None:
+            kwargs['include'] = include
+        return self.collection.query(query_embeddings=query_embeddings, query_texts=query_texts, n_results=n_results, where=where, **kwargs)
+
+    def get(self, ids=None, include: List[str] = None, limit: int = None, offset: int = None, where: dict = None, **kwargs) -> dict:
+        if include is not None:
+            kwargs['include'] = include
+        return self.collection.get(ids=ids, limit=limit, offset=offset, where=where, **kwargs)
+
+    def delete(self, ids=None, where: dict = None, **kwargs) -> None:
+        self.collection.delete(ids=ids, where=where, **kwargs)
+
+    def modify(self, name: str = None, metadata: dict = None, **kwargs) -> None:
+        self.collection.modify(name=name, metadata=metadata, **kwargs)
+
+
+class NumpyCollection(VectorCollection):
+    """
+    A collection held as one contiguous float32 matrix plus parallel lists of ids, documents and metadatas. A query is a single matrix product over the whole collection and an argpartition for the top k, which for a few thousand memories is far cheaper than a round trip through SQLite and an HNSW index. Distances are squared L2 like Chroma's default space, computed from cached row norms, so results mix freely with Chroma's and with the write-behind buffer's; for the normalised vectors the embedding models produce this ranks exactly as cosine similarity does.
+
+    :param name: The collection's name.
+    :param store: The NumpyVectorStore it belongs to.
+    :param embedding_function: Embeds documents upserted without embeddings.
+    """
+    def __init__(self, name: str, store: 'NumpyVectorStore', embedding_function=None) -> None:
+        self.name = name
+        self.store = store
+        self.embedding_function = embedding_function
+        self.ids: List[str] = []
+        self.rows: Dict[str, int] = {}
+        self.documents: List[str] = []
+        self.metadatas: List[dict] = []
+        self.matrix = None
+        self.norms = None
+        self.version = 0
+        # stat of the snapshot these contents match, compared on every call to pick up other processes' writes
+        self.signature = None
+        self._lock = threading.RLock()
+
+    def count(self) -> int:
+        self.store.refresh(self)
+        return len(self.ids)
+
+    def _reserve(self, dim: int, rows: int) -> None:
+        if self.matrix is None:
+            self.matrix = np.zeros((max(rows, 64), dim), dtype=np.float32)
+            self.norms = np.zeros(self.matrix.shape[0], dtype=np.float32)
+        elif rows > self.matrix.shape[0]:
+            # Double the capacity so appends stay amortised O(1)
+            capacity = max(rows, self.matrix.shape[0] * 2)
+            matrix = np.zeros((capacity, dim), dtype=np.float32)
+            matrix[:len(self.ids)] = self.matrix[:len(self.ids)]
+            norms = np.zeros(capacity, dtype=np.float32)
+            norms[:len(self.ids)] = self.norms[:len(self.ids)]
+            self.matrix, self.norms = matrix, norms
+
+    def upsert(self, ids, documents=None, metadatas=None, embeddings=None, **kwargs) -> None:
+        ids = [ids] if isinstance(ids, str) else list(ids)
+        documents = [documents] if isinstance(documents, str) else (list(documents) if documents is not None else [None] * len(ids))
+        metadatas = [metadatas] if isinstance(metadatas, dict) else (list(metadatas) if metadatas is not None else [None] * len(ids))
+        if embeddings is None:
+            if self.embedding_function is None:
+                raise ValueError(f"Collection {self.name} has no embedding function, pass embeddings")
+            embeddings = self.embedding_function(documents)
+        vectors = np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1)
+
+        with self.store.writing(self):
+            if self.matrix is not None and vectors.shape[1] != self.matrix.shape[1]:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match collection dimension {self.matrix.shape[1]}")
+            new_ids = {id for id in ids if id not in self.rows}
+            self._reserve(vectors.shape[1], len(self.ids) + len(new_ids))
+            for id, document, metadata, vector in zip(ids, documents, metadatas, vectors):
+                row = self.rows.get(id)
+                if row is None:
+                    row = self.rows[id] = len(self.ids)
+                    self.ids.append(id)
+                    self.documents.append(document)
+                    self.metadatas.append(metadata)
+                else:
+                    self.documents[row] = document
+                    self.metadatas[row] = metadata
+                self.matrix[row] = vector
+                self.norms[row] = float(vector @ vector)
+            self.version += 1
+
+    add = upsert
+
+    def _filter(self, where: dict) -> np.ndarray:
+        return np.array([row for row, metadata in enumerate(self.metadatas) if matches_where(metadata, where)], dtype=np.int64)
+
+    def query(self, query_embeddings=None, query_texts=None, n_results: int = 10, include: List[str] = None, where: dict = None, **kwargs) -> dict:
+        include = include if include is not None else ['documents', 'metadatas', 'distances']
+        if query_embeddings is None:
+            query_texts = [query_texts] if isinstance(query_texts, str) else query_texts
+            query_embeddings = self.embedding_function(query_texts)
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        queries = queries.reshape(1, -1) if queries.ndim == 1 else queries
+
+        results = {'ids': [], 'documents': [], 'metadatas': [], 'distances': [], 'embeddings': []}
+        self.store.refresh(self)
+        with self._lock:
+            # A filter narrows the rows before any distance is computed
+            candidates = self._filter(where) if where else None
+            size = len(self.ids) if candidates is None else len(candidates)
+            k = min(n_results, size)
+            if k:
+                matrix = self.matrix[:size] if candidates is None else self.matrix[candidates]
+                norms = self.norms[:size] if candidates is None else self.norms[candidates]
+                distances = norms[None, :] + np.einsum('ij,ij->i', queries, queries)[:, None] - 2.0 * (queries @ matrix.T)
+                np.maximum(distances, 0.0, out=distances)
+            for query_index in range(len(queries)):
+                if not k:
+                    top = np.empty(0, dtype=np.int64)
+                else:
+                    row_distances = distances[query_index]
+                    top = np.argpartition(row_distances, k - 1)[:k] if k < size else np.arange(size)
+                    top = top[np.argsort(row_distances[top], kind='stable')]
+                    distance_rows, top = top, (top if candidates is None else candidates[top])
+                results['ids'].append([self.ids[row] for row in top])
+                results['documents'].append([self.documents[row] for row in top])
+                results['metadatas'].append([self.metadatas[row] for row in top])
+                results['distances'].append([float(distances[query_index][row]) for row in distance_rows] if k else [])
+                results['embeddings'].append(self.matrix[top].copy() if k else np.empty((0, 0), dtype=np.float32))
+        return self._shape(results, include, nested=True)
+
+    def get(self, ids=None, include: List[str] = None, limit: int = None, offset: int = None, where: dict = None, **kwargs) -> dict:
+        include = include if include is not None else ['documents', 'metadatas']
+        self.store.refresh(self)
+        with self._lock:
+            if ids is not None:
+                ids = [ids] if isinstance(ids, str) else ids
+                rows = [self.rows[id] for id in ids if id in self.rows]
+            else:
+                rows = list(range(len(self.ids)))
+            if where:
+                rows = [row for row in rows if matches_where(self.metadatas[row], where)]
+            rows = rows[offset or 0:]
+            if limit is not None:
+                rows = rows[:limit]
+            results = {
+                'ids': [self.ids[row] for row in rows],
+                'documents': [self.documents[row] for row in rows],
+                'metadatas': [self.metadatas[row] for row in rows],
+                'embeddings': self.matrix[rows].copy() if rows else np.empty((0, 0), dtype=np.float32),
+            }
+        return self._shape(results, include, nested=False)
+
+    @staticmethod
+    def _shape(results: dict, include: List[str], nested: bool) -> dict:
+        # Same keys as Chroma, with None for whatever wasn't asked for
+        shaped = {'ids': results['ids'], 'included': list(include)}
+        for key in ('documents', 'metadatas', 'distances', 'embeddings'):
+            if key in results:
+                shaped[key] = results[key] if key in include else None
+        return shaped
+
+    def delete(self, ids=None, where: dict = None, **kwargs) -> None:
+        ids = [ids] if isinstance(ids, str) else list(ids or [])
+        with self.store.writing(self):
+            if where:
+                ids = [id for id in (ids or list(self.ids)) if id in self.rows and matches_where(self.metadatas[self.rows[id]], where)]
+            for id in ids:
+                row = self.rows.pop(id, None)
+                if row is None:
+                    continue
+                # Move the last row into the hole so the matrix stays contiguous
+                last = len(self.ids) - 1
+                if row != last:
+                    moved = self.ids[last]
+                    self.ids[row] = moved
+                    self.documents[row] = self.documents[last]
+                    self.metadatas[row] = self.metadatas[last]
+                    self.matrix[row] = self.matrix[last]
+                    self.norms[row] = self.norms[last]
+                    self.rows[moved] = row
+                self.ids.pop()
+                self.documents.pop()
+                self.metadatas.pop()
+            self.version += 1
+
+    def modify(self, name: str = None, metadata: dict = None, **kwargs) -> None:
+        if name and name != self.name:
+            self.store.rename(self, name)
+
+    def snapshot(self) -> tuple:
+        """
+        A consistent copy of the collection's contents, taken under its lock so it can be written out without holding it.
+
+        :returns: (version, embeddings, records) where records is a JSON-ready dict of ids, documents and metadatas.
+        """
+        with self._lock:
+            size = len(self.ids)
+            embeddings = self.matrix[:size].copy() if self.matrix is not None else np.zeros((0, 0), dtype=np.float32)
+            records = {'ids': list(self.ids), 'documents': list(self.documents), 'metadatas': list(self.metadatas)}
+            return self.version, embeddings, records
+
+    def load(self, embeddings: np.ndarray, records: dict) -> None:
+        with self._lock:
+            self.ids = list(records['ids'])
+            self.documents = list(records['documents'])
+            self.metadatas = list(records['metadatas'])
+            self.rows = {id: row for row, id in enumerate(self.ids)}
+            self.matrix = self.norms = None
+            if len(self.ids):
+                self._reserve(embeddings.shape[1], len(self.ids))
+                self.matrix[:len(self.ids)] = embeddings
+                self.norms[:len(self.ids)] = np.einsum('ij,ij->i', embeddings, embeddings)
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    Collections held in memory as NumpyCollections and snapshotted to disk, one .npz per collection. Every write rewrites the collection's snapshot before it returns (the write-behind buffer batches memories, so that is once per flush), to a temp file renamed into place so a crash never leaves a torn one. Writes hold an exclusive lock on <name>.lock and reads a shared one while loading, and a collection reloads whenever the snapshot on disk isn't the one it last read or wrote, so a compaction or ingest in another process is picked up instead of being overwritten. Rewriting the whole snapshot is why these are for small collections only.
+
+    :param path: Directory for the snapshots.
+    """
+    def __init__(self, path: str) -> None:
+        self.path = Path(path)
+        self.collections: Dict[str, NumpyCollection] = {}
+        self._lock = threading.RLock()
+
+    def directory_for(self, name: str) -> Path:
+        return self.path / name
+
+    def snapshot_path(self, name: str) -> Path:
+        return self.directory_for(name) / SNAPSHOT_NAME
+
+    def exists(self, name: str) -> bool:
+        with self._lock:
+            return name in self.collections or self.on_disk(name)
+
+    def on_disk(self, name: str) -> bool:
+        return self.snapshot_path(name).exists()
+
+    def _signature(self, name: str) -> tuple:
+        try:
+            stat = os.stat(self.snapshot_path(name))
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    @contextmanager
+    def file_lock(self, name: str, exclusive: bool = True):
+        """
+        Hold flock on the collection's lock file, shared between processes using the same store. Within a process the collection's own lock is taken first, so threads never stack flocks on one file.
+        """
+        if fcntl is None:
+            yield
+            return
+        self.path.mkdir(parents=True, exist_ok=True)
+        with open(self.path / f"{name}.lock", 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_snapshot(self, collection: NumpyCollection) -> None:
+        # Caller holds the file lock
+        signature = self._signature(collection.name)
+        if signature is None or signature == collection.signature:
+            return
+        with np.load(self.snapshot_path(collection.name), allow_pickle=False) as snapshot:
+            collection.load(snapshot['embeddings'], json.loads(str(snapshot['records'])))
+        collection.signature = signature
+
+    def refresh(self, collection: NumpyCollection) -> None:
+        """
+        Reload a collection if another process wrote its snapshot since this one last read or wrote it. Just a stat when nothing changed.
+        """
+        if self._signature(collection.name) in (None, collection.signature):
+            return
+        with collection._lock, self.file_lock(collection.name, exclusive=False):
+            self._read_snapshot(collection)
+
+    @contextmanager
+    def writing(self, collection: NumpyCollection):
+        """
+        Wrap a write to a collection: locks it in this process and on disk, brings it up to date first and writes the snapshot after.
+        """
+        with collection._lock, self.file_lock(collection.name):
+            self._read_snapshot(collection)
+            yield
+            self.write_snapshot(collection)
+
+    def _load(self, name: str, embedding_function=None) -> NumpyCollection:
+        collection = self.collections.get(name)
+        if collection is not None:
+            if embedding_function is not None and collection.embedding_function is None:
+                collection.embedding_function = embedding_function
+            return collection
+        if not self.on_disk(name):
+            return None
+        collection = NumpyCollection(name, self, embedding_function)
+        self.refresh(collection)
+        self.collections[name] = collection
+        return collection
+
+    def get_or_create(self, name: str, embedding_function=None) -> NumpyCollection:
+        if not COLLECTION_NAME_PATTERN.match(name) or '..' in name:
+            raise ValueError(f"Invalid collection name: {name}")
+        with self._lock:
+            collection = self._load(name, embedding_function)
+            if collection is None:
+                collection = self.collections[name] = NumpyCollection(name, self, embedding_function)
+                # Written straight away so the next process finds it here without asking Chroma
+                with self.writing(collection):
+                    pass
+            return collection
+
+    def get(self, name: str) -> NumpyCollection:
+        with self._lock:
+            collection = self._load(name)
+        if collection is None:
+            raise ValueError(f"Collection {name} does not exist.")
+        return collection
+
+    def delete(self, name: str) -> None:
+        with self._lock:
+            collection = self.collections.pop(name, None)
+            directory = self.directory_for(name)
+            if collection is None and not directory.exists():
+                raise ValueError(f"Collection {name} does not exist.")
+            with self.file_lock(name):
+                shutil.rmtree(directory, ignore_errors=True)
+
+    def rename(self, collection: NumpyCollection, new_name: str) -> None:
+        if not COLLECTION_NAME_PATTERN.match(new_name) or '..' in new_name:
+            raise ValueError(f"Invalid collection name: {new_name}")
+        with self._lock, collection._lock, self.file_lock(collection.name):
+            if self.exists(new_name):
+                raise ValueError(f"Collection {new_name} already exists.")
+            old_directory = self.directory_for(collection.name)
+            self.collections.pop(collection.name, None)
+            collection.name = new_name
+            self.collections[new_name] = collection
+            if old_directory.exists():
+                os.replace(old_directory, self.directory_for(new_name))
+
+    def write_snapshot(self, collection: NumpyCollection) -> None:
+        """
+        Write a collection's snapshot. Called by writing() with the collection locked in this process and on disk.
+        """
+        _, embeddings, records = collection.snapshot()
+        directory = self.directory_for(collection.name)
+        tmp_path = directory / f"{SNAPSHOT_NAME}.tmp.npz"
+        try:
+            directory.mkdir(parents=True, exist_ok=True)
+            np.savez(tmp_path, embeddings=embeddings, records=np.array(json.dumps(records)))
+            os.replace(tmp_path, directory / SNAPSHOT_NAME)
+            collection.signature = self._signature(collection.name)
+        except (OSError, TypeError, ValueError) as e:
+            print(f"Error writing snapshot for {collection.name}: {e}")
+
+    def drop(self, name: str) -> None:
+        """
+        Forget a collection held in memory, leaving the disk alone.
+        """
+        with self._lock:
+            self.collections.pop(name, None)
+
+    def forget(self, name: str) -> None:
+        """
+        Drop a collection from memory and disk without the existence check delete() makes, for after it has been promoted.
+        """
+        with self._lock:
+            self.collections.pop(name, None)
+            with self.file_lock(name):
+                shutil.rmtree(self.directory_for(name), ignore_errors=True)
+
+
+class TieredCollection(VectorCollection):
+    """
+    A handle onto a collection in a TieredVectorStore. Every call goes to wherever the collection currently lives, so handles cached by ChromaHandler (and entries queued on the write-behind buffer) stay valid when a collection is promoted from NumPy to Chroma.
+    """
+    def __init__(self, store: 'TieredVectorStore', name: str) -> None:
+        self.store = store
+        self.name = name
+
+    @property
+    def backing(self):
+        return self.store.backing(self.name)
+
+    @property
+    def backend(self) -> str:
+        return 'numpy' if isinstance(self.backing, NumpyCollection) else 'chroma'
+
+    def count(self) -> int:
+        return self.backing.count()
+
+    def upsert(self, ids, documents=None, metadatas=None, embeddings=None, **kwargs) -> None:
+        self.backing.upsert(ids, documents=documents, metadatas=metadatas, embeddings=embeddings, **kwargs)
+        self.store.maybe_promote(self.name)
+
+    def add(self, ids, documents=None, metadatas=None, embeddings=None, **kwargs) -> None:
+        self.backing.add(ids, documents=documents, metadatas=metadatas, embeddings=embeddings, **kwargs)
+        self.store.maybe_promote(self.name)
+
+    def query(self, query_embeddings=None, query_texts=None, n_results: int = 10, include: List[str] = None, where: dict = None, **kwargs) -> dict:
+        return self.backing.query(query_embeddings=query_embeddings, query_texts=query_texts, n_results=n_results, include=include, where=where, **kwargs)
+
+    def get(self, ids=None, include: List[str] = None, limit: int = None, offset: int = None, where: dict = None, **kwargs) -> dict:
+        return self.backing.get(ids=ids, include=include, limit=limit, offset=offset, where=where, **kwargs)
+
+    def delete(self, ids=None, where: dict = None, **kwargs) -> None:
+        self.backing.delete(ids=ids, where=where, **kwargs)
+
+    def modify(self, name: str = None, metadata: dict = None, **kwargs) -> None:
+        if metadata is not None:
+            kwargs['metadata'] = metadata
+        self.store.rename(self.name, name, **kwargs)
+        if name:
+            self.name = name
+
+
+class TieredVectorStore(VectorStore):
+    """
+    New collections start in the NumPy store and are promoted to Chroma once they grow past max_numpy_documents, so a per-agent-per-user memory of a few hundred turns never touches SQLite or HNSW while big knowledge bases still get an index. Collections that already exist in Chroma stay there. The limit can be set per collection (an agent's params_config does this for its memories), 0 puts a collection straight into Chroma. Callers get TieredCollection handles and can't tell the backends apart.
+
+    :param chroma_store: Where big collections live.
+    :param numpy_store: Where small collections live.
+    :param max_numpy_documents: Promote a collection once it holds more than this many documents, unless it has its own limit. 0 puts everything in Chroma.
+    """
+    def __init__(self, chroma_store: ChromaVectorStore, numpy_store: NumpyVectorStore, max_numpy_documents: int = 5000) -> None:
+        self.chroma_store = chroma_store
+        self.numpy_store = numpy_store
+        self.max_numpy_documents = max_numpy_documents
+        self._backings = {}
+        self._embedding_functions = {}
+        self._limits: Dict[str, int] = {}
+        self._lock = threading.RLock()
+        self.promotions = 0
+
+    def limit_for(self, name: str) -> int:
+        return self._limits.get(name, self.max_numpy_documents)
+
+    def set_limit(self, name: str, max_numpy_documents: int) -> None:
+        """
+        Give one collection its own promotion threshold. Only decides where it is created and when it is promoted, a collection already in Chroma stays there.
+        """
+        self._limits[name] = max_numpy_documents
+
+    def backing(self, name: str):
+        backing = self._backings.get(name)
+        if isinstance(backing, NumpyCollection) and not self.numpy_store.on_disk(name):
+            # Promoted or deleted by another process
+            with self._lock:
+                self._backings.pop(name, None)
+                self.numpy_store.drop(name)
+            backing = None
+        if backing is None:
+            # Forgotten by reset(), look it up again
+            with self._lock:
+                backing = self._backings.get(name)
+                if backing is None:
+                    backing = self._backings[name] = self._open(name, self._embedding_functions.get(name), create=False)
+        return backing
+
+    def _open(self, name: str, embedding_function=None, create: bool = True):
+        if self.numpy_store.exists(name):
+            return self.numpy_store.get_or_create(name, embedding_function)
+        if self.chroma_store.exists(name):
+            if create:
+                return self.chroma_store.get_or_create(name, embedding_function)
+            return self.chroma_store.get(name)
+        if not create:
+            raise ValueError(f"Collection {name} does not exist.")
+        if self.limit_for(name) > 0:
+            return self.numpy_store.get_or_create(name, embedding_function)
+        return self.chroma_store.get_or_create(name, embedding_function)
+
+    def get_or_create(self, name: str, embedding_function=None) -> TieredCollection:
+        with self._lock:
+            if name not in self._backings:
+                self._backings[name] = self._open(name, embedding_function)
+            if embedding_function is not None:
+                self._embedding_functions[name] = embedding_function
+            return TieredCollection(self, name)
+
+    def get(self, name: str) -> TieredCollection:
+        with self._lock:
+            if name not in self._backings:
+                self._backings[name] = self._open(name, create=False)
+            return TieredCollection(self, name)
+
+    def exists(self, name: str) -> bool:
+        return name in self._backings or self.numpy_store.exists(name) or self.chroma_store.exists(name)
+
+    def delete(self, name: str) -> None:
+        with self._lock:
+            self._backings.pop(name, None)
+            self._embedding_functions.pop(name, None)
+            if self.numpy_store.exists(name):
+                self.numpy_store.delete(name)
+            else:
+                self.chroma_store.delete(name)
+
+    def rename(self, name: str, new_name: str, **kwargs) -> None:
+        with self._lock:
+            backing = self.backing(name)
+            backing.modify(name=new_name, **kwargs)
+            if new_name and new_name != name:
+                self._backings[new_name] = self._backings.pop(name)
+                if name in self._embedding_functions:
+                    self._embedding_functions[new_name] = self._embedding_functions.pop(name)
+                if name in self._limits:
+                    self._limits[new_name] = self._limits.pop(name)
+
+    def reset(self) -> None:
+        """
+        Forget where each collection lives so the next open looks again.
+        """
+        with self._lock:
+            self._backings.clear()
+
+    def maybe_promote(self, name: str) -> None:
+        backing = self._backings.get(name)
+        if isinstance(backing, NumpyCollection) and backing.count() > self.limit_for(name):
+            self.promote(name)
+
+    def promote(self, name: str) -> None:
+        """
+        Move a NumPy collection into Chroma, embeddings included so nothing is re-embedded. The NumPy copy is only dropped once Chroma has everything.
+        """
+        with self._lock:
+            backing = self._backings.get(name)
+            if not isinstance(backing, NumpyCollection):
+                return
+            _, embeddings, records = backing.snapshot()
+            try:
+                target = self.chroma_store.get_or_create(name, self._embedding_functions.get(name) or backing.embedding_function)
+                try:
+                    batch_size = self.chroma_store.max_batch_size()
+                except Exception:
+                    batch_size = 1000
+                for start in range(0, len(records['ids']), batch_size):
+                    end = start + batch_size
+                    metadatas = records['metadatas'][start:end]
+                    target.upsert(ids=records['ids'][start:end],
+                                  documents=records['documents'][start:end],
+                                  metadatas=metadatas if any(metadatas) else None,
+                                  embeddings=embeddings[start:end])
+            except Exception as e:
+                print(f"Error promoting {name} to chroma: {e}")
+                return
+            self._backings[name] = target
+            self.numpy_store.forget(name)
+            self.promotions += 1
+
+    def close(self) -> None:
+        self.numpy_store.close()
+
+
+_vector_stores = {}
+_vector_stores_lock = threading.Lock()
+
+
+def numpy_store_path(chroma_path: str) -> str:
+    """
+    Where the NumPy snapshots for a chroma store go, next to it (library/chroma.db -> library/chroma_numpy).
+    """
+    return f"{os.path.splitext(chroma_path.rstrip('/'))[0]}_numpy"
+
+
+def get_vector_store(path: str, max_numpy_documents: int) -> TieredVectorStore:
+    """
+    The process-wide store for a chroma path, shared like the client so every handler sees the same in-memory collections.
+
+    :param path: Directory of the chroma store.
+    :param max_numpy_documents: See TieredVectorStore. Set by whichever handler opens the store first.
+    """
+    with _vector_stores_lock:
+        store = _vector_stores.get(path)
+        if store is None:
+            store = _vector_stores[path] = TieredVectorStore(ChromaVectorStore(path), NumpyVectorStore(numpy_store_path(path)), max_numpy_documents)
+        return store
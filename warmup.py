@@ -0,0 +1,115 @@
+from dataclasses import dataclass, field
+import threading
+import time
+from typing import Dict, List
+from chroma import ChromaHandler
+from config import ModelInstructions, ParamsConfig
+from ollama import get_transport
+
+
+@dataclass
+class WarmupReport:
+    """
+    How long each warmup step took, in seconds, and the error for any step that failed.
+    """
+    steps: Dict[str, float] = field(default_factory=dict)
+    errors: Dict[str, str] = field(default_factory=dict)
+
+    def to_string(self) -> str:
+        lines = [f"    {step}: {seconds:.2f}s" for step, seconds in self.steps.items()]
+        lines += [f"    {step}: failed ({error})" for step, error in self.errors.items()]
+        return "Warmup:\n" + "\n".join(lines)
+
+
+class SessionWarmup:
+    """
+    The first turn of a chat pays for three cold starts: Ollama loading the model, the embedding function building its ONNX session, and Chroma loading each collection's HNSW segment. SessionWarmup kicks all of that off in the background as soon as the agent names are known so it overlaps with the banners and the user's typing. The model preload runs on one thread (it only waits on the server) and the embedding + collection steps on another.
+
+    :param chroma_handler: The handler the chat will use for memory.
+    :param agents: (instructions, params_config) pairs for the agents taking part.
+    :param collection_names: Collections the chat will query.
+    """
+    def __init__(self, chroma_handler: ChromaHandler, agents: List[tuple], collection_names: List[str]) -> None:
+        self.chroma_handler = chroma_handler
+        self.agents = agents
+        self.collection_names = collection_names
+        self.report = WarmupReport()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def start(self) -> 'SessionWarmup':
+        """
+        Start the warmup threads and return immediately.
+
+        :returns: self, so it can be chained off the constructor.
+        """
+        for target in (self._warm_models, self._warm_memory):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def wait(self, timeout: float = None) -> WarmupReport:
+        """
+        Block until every warmup step has finished (or the timeout passes).
+
+        :param timeout: Seconds to wait in total. None waits for everything.
+        :returns: The report so far.
+        """
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(0, deadline - time.perf_counter()))
+        return self.report
+
+    def done(self) -> bool:
+        return all(not thread.is_alive() for thread in self._threads)
+
+    def _step(self, name: str, fn) -> None:
+        started = time.perf_counter()
+        try:
+            fn()
+            with self._lock:
+                self.report.steps[name] = time.perf_counter() - started
+        except Exception as e:
+            with self._lock:
+                self.report.errors[name] = str(e)
+
+    def _warm_models(self) -> None:
+        seen = set()
+        for instructions, params_config in self.agents:
+            if instructions.llm_model in seen:
+                continue
+            seen.add(instructions.llm_model)
+            self._step(f"model {instructions.llm_model}", lambda: self.preload_model(instructions, params_config))
+
+    def _warm_memory(self) -> None:
+        self._step("embedding function", lambda: self.chroma_handler.embedding_function(["warmup"]))
+        for name in self.collection_names:
+            self._step(f"collection {name}", lambda: self.touch_collection(name))
+
+    def preload_model(self, instructions: ModelInstructions, params_config: ParamsConfig) -> None:
+        """
+        Ask Ollama to load the model without generating anything. An empty prompt does exactly that, keep_alive decides how long it stays resident afterwards.
+
+        :param instructions: The agent's instructions (model and endpoint).
+        :param params_config: The agent's params (keep_alive, num_ctx).
+        """
+        payload = {"model": instructions.llm_model, "options": {"num_ctx": params_config.num_ctx}}
+        if params_config.keep_alive is not None:
+            payload["keep_alive"] = params_config.keep_alive
+        response = get_transport(instructions.completions_url).post('/api/generate', payload)
+        if not response.ok:
+            raise RuntimeError(f"HTTP {response.status_code}: {response.text}")
+
+    def touch_collection(self, name: str) -> None:
+        """
+        Load a collection and run a throwaway query so its vector index is read into memory before the first real query, and build its lexical index if an agent uses hybrid search.
+
+        :param name: The collection to warm.
+        """
+        collection = self.chroma_handler.chroma_get_or_create_collection(name)
+        if collection.count() > 0:
+            self.chroma_handler.chroma_query_collection(collection, "warmup", 1)
+            # Hybrid retrieval builds its BM25 index from the whole collection on first use, do that now instead of on the first turn
+            if any(params_config.memory_search == 'hybrid' for _, params_config in self.agents):
+                self.chroma_handler.lexical_index(collection)